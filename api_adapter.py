@@ -1,22 +1,141 @@
 from __future__ import annotations
-import json, os, subprocess, sys, uuid
-from typing import Any, Dict, List, Optional
+import codecs, hashlib, json, multiprocessing, os, re, sys, threading, time, uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel, Field
 
-app = FastAPI(title="Planner Adapter", version="1.1.0")
+from storage import Storage
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup()
+    yield
+    shutdown()
+
+app = FastAPI(title="Planner Adapter", version="1.1.0", lifespan=lifespan)
+
+class UploadSizeLimit:
+    """
+    Отказывает слишком большой загрузке: объявленной в Content-Length — не читая её тело,
+    остальным (chunked, неверная длина) — как только прочитано больше лимита. Starlette кладёт
+    multipart во временный файл целиком ещё до роута, так что считать байты приходится здесь.
+    """
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["path"] != "/upload":
+            return await self.app(scope, receive, send)
+        limit = UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD
+        length = dict(scope["headers"]).get(b"content-length", b"").decode("latin-1")
+        if length.isdigit() and int(length) > limit:
+            return await JSONResponse(status_code=413, content={"detail": upload_too_large()})(scope, receive, send)
+        received = 0
+
+        async def limited_receive() -> Dict[str, Any]:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI пропускает HTTPException из разбора тела как есть, ответ — 413
+                    raise HTTPException(status_code=413, detail=upload_too_large())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Добавлен раньше CORS, чтобы отказ тоже шёл с заголовками CORS
+app.add_middleware(UploadSizeLimit)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Plan-Cache"],
+)
+
+# Загрузки, расписания и задачи — в SQLite в PLANNER_DATA_DIR, общие для всех процессов uvicorn и переживают перезапуск.
+# Старше срока жизни или сверх лимита удаляются вместе с файлами загрузок.
+DATA_DIR = os.environ.get("PLANNER_DATA_DIR", os.path.join(os.getcwd(), "planner-data"))
+STORAGE = Storage(
+    DATA_DIR,
+    upload_ttl=float(os.environ.get("PLANNER_UPLOAD_TTL", "86400")),  # секунд
+    plan_ttl=float(os.environ.get("PLANNER_PLAN_TTL", "86400")),  # секунд
+    max_uploads=int(os.environ.get("PLANNER_MAX_UPLOADS", "100")),
+    max_plans=int(os.environ.get("PLANNER_MAX_PLANS", "1000")),
+    job_ttl=float(os.environ.get("PLANNER_JOB_TTL", "3600")),  # секунд, сколько помнить завершённую задачу
+    max_jobs=int(os.environ.get("PLANNER_JOB_HISTORY", "256")),  # сколько завершённых задач помнить
+    # секунд без heartbeat, после которых незавершённая задача считается брошенной
+    job_stale=float(os.environ.get("PLANNER_JOB_STALE", "120")),
 )
+CLEANUP_INTERVAL = float(os.environ.get("PLANNER_CLEANUP_INTERVAL", "600"))  # секунд между очистками
+_cleanup_stop = threading.Event()
+
+# Загрузка пишется на диск частями по UPLOAD_CHUNK и проверяется по ходу, целиком в памяти не бывает.
+UPLOAD_MAX_BYTES = int(float(os.environ.get("PLANNER_MAX_UPLOAD_MB", "20")) * 2**20)
+UPLOAD_CHUNK = 1 << 20
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # заголовки multipart вокруг файла
+UPLOAD_SUFFIXES = (".xlsx", ".csv")
+
+# Готовые ответы /schedule/plan по (хэш файла, параметры запроса): расписания и отказы с кодом 400.
+# Частичные расписания (лимит времени) не кэшируются — повтор может найти полное.
+PLAN_CACHE_SIZE = 128
+PLAN_CACHE_TTL = 600.0  # секунд
+PLAN_CACHE: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()  # ключ -> (когда истекает, ответ)
+_plan_cache_lock = threading.Lock()  # синхронные обработчики работают в нескольких потоках
+
+# Фоновые задачи /schedule/jobs: планировщик считает в отдельных процессах, чтобы не делить GIL с сервером.
+# Статус, прогресс, отмена и результат — в STORAGE, их видит любой процесс uvicorn.
+JOB_WORKERS = int(os.environ.get("PLANNER_JOB_WORKERS", "2"))  # сколько задач считается одновременно
+JOB_QUEUE_LIMIT = int(os.environ.get("PLANNER_JOB_QUEUE", "16"))  # сколько ещё может ждать своей очереди
+JOB_PROGRESS_INTERVAL = 0.5  # секунд между обновлениями прогресса и проверками отмены
+JOB_HEARTBEAT_INTERVAL = 10.0  # секунд между отметками, что процесс жив и его задачи не брошены
+# задачи, отправленные в пул этого процесса и ещё не завершённые: job_id -> future, params, cacheKey
+JOBS: Dict[str, Dict[str, Any]] = {}
+_job_pool: Optional[ProcessPoolExecutor] = None
+_job_lock = threading.Lock()
+
+# Метрики для /metrics: счётчики этого процесса с его запуска, имя -> {метки -> значение}.
+# Каждый процесс uvicorn считает своё, Prometheus складывает их сам.
+METRICS: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+METRIC_TYPES: Dict[str, Tuple[str, str, str]] = {  # имя -> (тип, описание, метка или "")
+    "planner_plans_total": ("counter", "Расписания, построенные планировщиком, по полноте", "complete"),
+    "planner_plan_failures_total": ("counter", "Отказы планировщика по коду ответа", "status"),
+    "planner_plan_cache_hits_total": ("counter", "Ответы из кэша расписаний", ""),
+    "planner_search_nodes_total": ("counter", "Узлы перебора", ""),
+    "planner_search_probes_total": ("counter", "Проверки свободного времени кортов", ""),
+    "planner_search_books_total": ("counter", "Попытки занять корт", ""),
+    "planner_search_unbooks_total": ("counter", "Освобождения корта при возврате", ""),
+    "planner_search_backtracks_total": ("counter", "Отменённые размещения", ""),
+    "planner_search_jumps_total": ("counter", "Тупики перебора по числу отменённых за раз размещений", "distance"),
+    "planner_search_nogood_checks_total": ("counter", "Сравнения с запомненными тупиками", ""),
+    "planner_search_nogood_hits_total": ("counter", "Поддеревья, пропущенные по запомненным тупикам", ""),
+    "planner_search_max_depth": ("gauge", "Наибольшая глубина перебора в последнем расписании", ""),
+    "planner_parse_seconds_total": ("counter", "Время чтения входных данных", ""),
+    "planner_solve_seconds_total": ("counter", "Время поиска расписания", ""),
+    "planner_serialize_seconds_total": ("counter", "Время сборки ответа планировщика", ""),
+    "planner_jobs": ("gauge", "Фоновые задачи всех процессов по статусу", "status"),
+    "planner_plan_cache_entries": ("gauge", "Записи в кэше расписаний", ""),
+}
+_metrics_lock = threading.Lock()
 
-SCHEDULES: Dict[str, Dict[str, Any]] = {}
-UPLOADS: Dict[str, str] = {}  # uploadId -> path
+# Изолированный режим: планировщик работает не в процессе сервера, а в одном постоянном процессе,
+# который переживает запросы, — падение или утечка в планировщике не задевают сервер.
+PLANNER_ISOLATED = os.environ.get("PLANNER_ISOLATED", "") == "1"
+_isolated_pool: Optional[ProcessPoolExecutor] = None
+
+# planner и его функция расписания, находятся один раз на процесс
+_planner: Any = None
+_planner_fn: Optional[Callable[..., Any]] = None
 
 # МОДЕЛИ
 class TimeWindow(BaseModel):
@@ -26,8 +145,10 @@ class TimeWindow(BaseModel):
 
 class PlanRequest(BaseModel):
     window: TimeWindow
-    slotMinutes: int = Field(15, ge=5, le=180)
+    # шаг сетки поиска, без него — с точностью до минуты
+    slotMinutes: Optional[int] = Field(None, ge=1, le=180)
     parallelLimit: int = Field(1, ge=1)
+    uploadId: Optional[str] = None  # из ответа /upload, без него — 400
     options: Dict[str, Any] = {}
 
 class Slot(BaseModel):
@@ -43,52 +164,373 @@ class PlanResponse(BaseModel):
     id: str
     date: str
     slots: List[Slot]
+    # False, если планировщик не уложился в лимит времени и slots — лучшая частичная раскладка
+    complete: bool = True
+    placedGroups: List[str] = []
+    unplacedGroups: List[str] = []
+    stats: Dict[str, Any] = {}
+    # только для /replan: группы, у которых слоты отличаются от исходного расписания
+    changedGroups: List[str] = []
+
+class JobStatus(BaseModel):
+    jobId: str
+    status: str  # queued, running, done, failed, cancelled
+    # nodes — перебрано вариантов, placedGroups — групп размещено в текущей ветке поиска
+    progress: Dict[str, int] = {}
+    result: Optional[PlanResponse] = None
+    error: Optional[str] = None
+
+# Время — "HH:MM", "HH:MM:SS" или число минут, как во входном файле
+class GroupEdit(BaseModel):
+    name: str
+    count: Optional[int] = None
+    activity: Optional[str] = None
+    minStart: Optional[Union[int, str]] = None
+    maxEnd: Optional[Union[int, str]] = None
+
+class CourtWindow(BaseModel):
+    court: str
+    start: Union[int, str]
+    end: Union[int, str]
+
+class ReplanRequest(BaseModel):
+    addGroups: List[GroupEdit] = []
+    removeGroups: List[str] = []
+    modifyGroups: List[GroupEdit] = []
+    openCourts: List[CourtWindow] = []
+    closeCourts: List[CourtWindow] = []
 
 # ВСПОМОГАТЕЛЬНОЕ
 POSSIBLE_FUNCS = ["generate_schedule", "plan", "run", "main"]
 
-def call_planner(params: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    1) Пытаемся импортировать planner и вызвать одну из известных функций без изменения её контракта.
-    2) Если не получилось — запускаем planner.py как CLI и ждём JSON на stdout.
-    """
-    sys.path.insert(0, os.getcwd())
-    try:
+def planner_module() -> Any:
+    """Импортирует planner и находит функцию расписания из POSSIBLE_FUNCS при первом вызове."""
+    global _planner, _planner_fn
+    if _planner is None:
+        if os.getcwd() not in sys.path:
+            sys.path.insert(0, os.getcwd())
         import planner  # noqa
         for fn_name in POSSIBLE_FUNCS:
             fn = getattr(planner, fn_name, None)
             if callable(fn):
-                result = fn(params)
-                if isinstance(result, str):
-                    result = json.loads(result)
-                if result is None:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail="Не удалось построить расписание с заданными ограничениями. Возможные причины: недостаточно времени, конфликты в расписании кортов, слишком строгие временные ограничения групп. Попробуйте увеличить временное окно, добавить больше кортов или ослабить ограничения."
-                    )
-                if not isinstance(result, dict):
-                    raise HTTPException(status_code=500, detail="planner returned non-dict")
-                return result
-    except HTTPException:
-        raise
-    except Exception:
-        # падаем в CLI режим
-        pass
+                _planner_fn = fn
+                break
+        else:
+            raise RuntimeError(f"planner.py has none of {POSSIBLE_FUNCS}")
+        _planner = planner
+    return _planner
+
+def prewarm() -> None:
+    """Инициализатор процессов пулов: planner с openpyxl импортируется до первой задачи."""
+    planner_module()
 
+def run_planner(params: Dict[str, Any], **hooks: Any) -> Dict[str, Any]:
+    """
+    Вызывает функцию планировщика в этом процессе.
+    hooks (should_stop, progress) передаются ей, если заданы.
+    """
     try:
-        proc = subprocess.run(
-            [sys.executable, "planner.py"],
-            input=json.dumps(params).encode("utf-8"),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
+        planner_module()
+        result = _planner_fn(params, **hooks) if hooks else _planner_fn(params)
+    except Exception as e:
+        if isinstance(e, getattr(_planner, "InputError", ())):
+            # входные данные, правки или опции не годятся либо расписания при них нет, повтор ответит так же
+            raise HTTPException(
+                status_code=400,
+                detail=f"Входные данные не позволяют построить расписание: {e}"
+            )
+        # остальное — сбой планировщика, он не кешируется
+        raise HTTPException(status_code=500, detail=f"planner failed: {type(e).__name__}: {e}")
+    if isinstance(result, str):
+        result = json.loads(result)
+    if result is None:
+        raise HTTPException(
+            status_code=400, 
+            detail="Не удалось построить расписание с заданными ограничениями. Возможные причины: недостаточно времени, конфликты в расписании кортов, слишком строгие временные ограничения групп. Попробуйте увеличить временное окно, добавить больше кортов или ослабить ограничения."
         )
-        out = proc.stdout.decode("utf-8").strip()
-        return json.loads(out)
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=500, detail=f"planner.py failed: {e.stderr.decode('utf-8')}")
-    except json.JSONDecodeError as e:
-        raise HTTPException(status_code=500, detail=f"planner.py did not return JSON: {str(e)}")
+    if not isinstance(result, dict):
+        raise HTTPException(status_code=500, detail="planner returned non-dict")
+    return result
+
+def run_planner_outcome(params: Dict[str, Any], **hooks: Any) -> Tuple[str, Any]:
+    """run_planner для других процессов: ("done", ответ) или ("failed", (код, текст ошибки))."""
+    try:
+        return "done", run_planner(params, **hooks)
+    except HTTPException as e:
+        return "failed", (e.status_code, str(e.detail))
+
+def warm_input(path: str, digest: str) -> None:
+    planner_module().load_input(path, digest)
+
+def isolated_pool() -> ProcessPoolExecutor:
+    global _isolated_pool
+    with _job_lock:
+        if _isolated_pool is None:
+            _isolated_pool = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn"), initializer=prewarm,
+            )
+        return _isolated_pool
+
+def call_planner(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Планировщик в процессе сервера, а в изолированном режиме — в постоянном процессе."""
+    if not PLANNER_ISOLATED:
+        return run_planner(params)
+    try:
+        outcome, payload = isolated_pool().submit(run_planner_outcome, params).result()
+    except Exception as e:
+        # процесс планировщика умер, пул перезапустится при следующем запросе
+        reset_isolated_pool()
+        raise HTTPException(status_code=500, detail=f"planner process failed: {type(e).__name__}: {e}")
+    if outcome == "failed":
+        raise HTTPException(status_code=payload[0], detail=payload[1])
+    return payload
+
+def reset_isolated_pool() -> None:
+    global _isolated_pool
+    with _job_lock:
+        if _isolated_pool is not None:
+            _isolated_pool.shutdown(wait=False, cancel_futures=True)
+            _isolated_pool = None
+
+def cache_upload(path: str, digest: str) -> None:
+    """
+    Разбирает загруженный файл сразу: planner кладёт результат в кэш по хэшу содержимого,
+    и планирование по этому файлу (или по такому же, загруженному под другим именем) его уже не разбирает.
+    Хэш уже посчитан при загрузке, planner файл заново не читает.
+    В изолированном режиме разбирает процесс планировщика, его кэш в памяти и заполняется.
+    """
+    if PLANNER_ISOLATED:
+        isolated_pool().submit(warm_input, path, digest).result()
+    else:
+        warm_input(path, digest)
+
+def startup() -> None:
+    """Всё дорогое — при старте сервера, а не в первом запросе."""
+    planner_module()
+    if PLANNER_ISOLATED:
+        isolated_pool().submit(prewarm).result()
+    # процессы пула задач запускаются заранее и сразу импортируют planner
+    pool = job_pool()
+    for _ in range(JOB_WORKERS):
+        pool.submit(prewarm)
+    _cleanup_stop.clear()
+    threading.Thread(target=cleanup_loop, name="storage-cleanup", daemon=True).start()
+    threading.Thread(target=heartbeat_loop, name="job-heartbeat", daemon=True).start()
+
+def shutdown() -> None:
+    _cleanup_stop.set()
+    reset_isolated_pool()
+    with _job_lock:
+        if _job_pool is not None:
+            _job_pool.shutdown(wait=False, cancel_futures=True)
+
+def cleanup_loop() -> None:
+    """Просроченные загрузки и расписания удаляются раз в CLEANUP_INTERVAL, первый раз — сразу при старте."""
+    while True:
+        try:
+            STORAGE.cleanup()
+        except Exception as e:
+            print(f"storage cleanup failed: {type(e).__name__}: {e}", file=sys.stderr)
+        if _cleanup_stop.wait(CLEANUP_INTERVAL):
+            return
+
+def heartbeat_loop() -> None:
+    """Раз в JOB_HEARTBEAT_INTERVAL отмечает в STORAGE задачи этого процесса, пока они в очереди или считаются."""
+    while not _cleanup_stop.wait(JOB_HEARTBEAT_INTERVAL):
+        with _job_lock:
+            job_ids = list(JOBS)
+        try:
+            STORAGE.touch_jobs(job_ids)
+        except Exception as e:
+            print(f"job heartbeat failed: {type(e).__name__}: {e}", file=sys.stderr)
+
+def plan_cache_key(digest: str, params: Dict[str, Any]) -> str:
+    """Хэш содержимого файла и всех параметров запроса, кроме пути к файлу и его хэша."""
+    options = {k: v for k, v in params["options"].items() if k not in ("lastUploadPath", "lastUploadDigest")}
+    normalized = {k: v for k, v in params.items() if k != "options"}
+    normalized["options"] = options
+    return digest + ":" + json.dumps(normalized, sort_keys=True, default=str)
+
+def plan_cache_get(key: str) -> Optional[Dict[str, Any]]:
+    with _plan_cache_lock:
+        entry = PLAN_CACHE.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del PLAN_CACHE[key]
+            return None
+        PLAN_CACHE.move_to_end(key)
+    metric_add("planner_plan_cache_hits_total")
+    return value
+
+def plan_cache_put(key: str, value: Dict[str, Any]) -> None:
+    with _plan_cache_lock:
+        PLAN_CACHE[key] = (time.monotonic() + PLAN_CACHE_TTL, value)
+        PLAN_CACHE.move_to_end(key)
+        while len(PLAN_CACHE) > PLAN_CACHE_SIZE:
+            PLAN_CACHE.popitem(last=False)
+
+def metric_add(name: str, value: float = 1, **labels: str) -> None:
+    key = tuple(sorted(labels.items()))
+    with _metrics_lock:
+        series = METRICS.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+def metric_set(name: str, value: float, **labels: str) -> None:
+    with _metrics_lock:
+        METRICS.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+def record_plan_stats(resp: Dict[str, Any]) -> None:
+    """Статистика поиска из ответа планировщика — в счётчики /metrics."""
+    stats = resp["stats"]
+    metric_add("planner_plans_total", complete=str(resp["complete"]).lower())
+    for key, name in (
+        ("nodes", "planner_search_nodes_total"),
+        ("probes", "planner_search_probes_total"),
+        ("books", "planner_search_books_total"),
+        ("unbooks", "planner_search_unbooks_total"),
+        ("backtracks", "planner_search_backtracks_total"),
+        ("nogoodChecks", "planner_search_nogood_checks_total"),
+        ("nogoodHits", "planner_search_nogood_hits_total"),
+        ("parseSeconds", "planner_parse_seconds_total"),
+        ("solveSeconds", "planner_solve_seconds_total"),
+        ("serializeSeconds", "planner_serialize_seconds_total"),
+    ):
+        if isinstance(stats.get(key), (int, float)):
+            metric_add(name, stats[key])
+    for distance, count in (stats.get("jumps") or {}).items():
+        metric_add("planner_search_jumps_total", count, distance=str(distance))
+    if isinstance(stats.get("maxDepth"), int):
+        metric_set("planner_search_max_depth", stats["maxDepth"])
+
+def render_metrics() -> str:
+    """Текстовый формат Prometheus 0.0.4."""
+    jobs = STORAGE.count_jobs()
+    for status in ("queued", "running", "done", "failed", "cancelled"):
+        metric_set("planner_jobs", jobs.get(status, 0), status=status)
+    metric_set("planner_plan_cache_entries", len(PLAN_CACHE))
+
+    lines: List[str] = []
+    with _metrics_lock:
+        for name, (kind, description, label) in METRIC_TYPES.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            # метрика без меток видна и до первого события
+            series = METRICS.get(name) or ({} if label else {(): 0})
+            for labels, value in sorted(series.items()):
+                text = ",".join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"{name}{{{text}}} {value}" if text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def plan_response(raw: Dict[str, Any], date: str, source: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Ответ планировщика в формате PlanResponse с новым id, сохраняется в хранилище.
+    source — параметры запроса и правки, по которым построено расписание.
+    """
+    slots = raw.get("slots") or []
+    # Преобразуем формат времени из timedelta ("9:30:00") в HH:MM ("09:30")
+    for slot in slots:
+        if "start" in slot:
+            slot["start"] = timedelta_to_hhmm(slot["start"])
+        if "end" in slot:
+            slot["end"] = timedelta_to_hhmm(slot["end"])
+
+    plan_id = str(uuid.uuid4())
+    resp = {
+        "id": plan_id,
+        "date": raw.get("date", date),
+        "slots": slots,
+        "complete": raw.get("complete", True),
+        "placedGroups": raw.get("placedGroups") or [],
+        "unplacedGroups": raw.get("unplacedGroups") or [],
+        "stats": raw.get("stats") or {},
+        "changedGroups": raw.get("changedGroups") or [],
+    }
+    STORAGE.save_plan(resp, source)
+    record_plan_stats(resp)
+    return resp
+
+def run_plan_job(job_id: str, params: Dict[str, Any]) -> Tuple[str, Any]:
+    """
+    Выполняется в процессе пула задач, прогресс пишет в STORAGE, отмену оттуда же и узнаёт:
+    DELETE мог прийти в любой процесс uvicorn.
+    Возвращает ("done", ответ планировщика), ("failed", (код, текст ошибки))
+    или ("cancelled", None), если задачу отменили, пока она ждала очереди.
+    """
+    if not STORAGE.start_job(job_id):
+        return "cancelled", None
+    reported = [0.0]
+    checked = [0.0]
+    cancelled = [STORAGE.job_cancelled(job_id)]
+
+    def report(nodes: int, placed: int) -> None:
+        now = time.monotonic()
+        if now - reported[0] >= JOB_PROGRESS_INTERVAL:
+            reported[0] = now
+            STORAGE.set_job_progress(job_id, {"nodes": nodes, "placedGroups": placed})
+
+    def should_stop() -> bool:
+        # планировщик спрашивает часто, база — не чаще JOB_PROGRESS_INTERVAL
+        now = time.monotonic()
+        if not cancelled[0] and now - checked[0] >= JOB_PROGRESS_INTERVAL:
+            checked[0] = now
+            cancelled[0] = STORAGE.job_cancelled(job_id)
+        return cancelled[0]
+
+    return run_planner_outcome(params, should_stop=should_stop, progress=report)
+
+def job_pool() -> ProcessPoolExecutor:
+    """Пул процессов создаётся при первой задаче."""
+    global _job_pool
+    with _job_lock:
+        if _job_pool is None:
+            # spawn: дочерние процессы не наследуют потоки сервера
+            context = multiprocessing.get_context("spawn")
+            _job_pool = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=context, initializer=prewarm)
+        return _job_pool
+
+def job_finished(job_id: str, future: Future) -> None:
+    """Вызывается пулом, когда задача завершилась или отменена до запуска."""
+    with _job_lock:
+        job = JOBS.pop(job_id)
+    status, result, error = "failed", None, None
+    try:
+        if future.cancelled():
+            status = "cancelled"
+        else:
+            outcome, payload = future.result()
+            if outcome == "cancelled":
+                status = "cancelled"
+            elif outcome == "failed":
+                error = payload[1]
+                metric_add("planner_plan_failures_total", status=str(payload[0]))
+                if payload[0] == 400:
+                    plan_cache_put(job["cacheKey"], {"error": error})
+            else:
+                result = plan_response(payload, job["params"]["window"]["date"], {"params": job["params"], "deltas": []})
+                if STORAGE.job_cancelled(job_id):
+                    # остановленная на ходу задача отдаёт лучшее частичное расписание
+                    status = "cancelled"
+                else:
+                    status = "done"
+                    if result["complete"]:
+                        plan_cache_put(job["cacheKey"], result)
+    except Exception as e:
+        error = str(e)
+    STORAGE.finish_job(job_id, status, result, error)
+
+def job_status(job_id: str) -> Dict[str, Any]:
+    job = STORAGE.get_job(job_id)
+    if job is None:
+        raise HTTPException(404, "job not found")
+    return {
+        "jobId": job_id,
+        "status": job["status"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+    }
 
 def hhmm_to_min(s: str) -> int:
     h, m = s.split(":")
@@ -121,56 +563,226 @@ def timedelta_to_hhmm(td_str: str) -> str:
             return td_str
     return td_str
 
+class UploadCheck:
+    """
+    Проверяет загрузку по мере чтения и считает её SHA-256.
+    .xlsx должен быть zip-архивом, .csv — текстом в UTF-8, где есть строки с названиями всех листов.
+    Полностью файл проверяет planner при разборе.
+    """
+    def __init__(self, filename: str) -> None:
+        self.is_csv = filename.lower().endswith(".csv")
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.sheets = set(getattr(planner_module(), "INPUT_SHEETS", ()))
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.tail = ""
+
+    def feed(self, chunk: bytes) -> None:
+        if self.size == 0 and not self.is_csv and not chunk.startswith(b"PK\x03\x04"):
+            raise HTTPException(status_code=400, detail="Файл не похож на .xlsx")
+        self.size += len(chunk)
+        if self.size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=upload_too_large())
+        self.sha256.update(chunk)
+        if self.is_csv:
+            self.scan(chunk, final=False)
+
+    def finish(self) -> str:
+        """Хэш содержимого, если файл прошёл проверку."""
+        if self.is_csv:
+            self.scan(b"", final=True)
+            if self.sheets:
+                raise HTTPException(status_code=400, detail=f"В файле нет листов: {', '.join(sorted(self.sheets))}")
+        return self.sha256.hexdigest()
+
+    def scan(self, chunk: bytes, final: bool) -> None:
+        try:
+            text = self.tail + self.decoder.decode(chunk, final)
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="CSV-файл должен быть в кодировке UTF-8")
+        lines = text.split("\n")
+        self.tail = "" if final else lines.pop()
+        for line in lines:
+            # строка листа — его название в первой ячейке, остальные пустые
+            cells = [cell.strip().strip('"').strip() for cell in re.split("[,;]", line)]
+            if not any(cells[1:]):
+                self.sheets.discard(cells[0])
+
+def upload_too_large() -> str:
+    return f"Файл больше {UPLOAD_MAX_BYTES / 2**20:g} МБ"
+
 # РОУТЫ
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Счётчики планировщика этого процесса для Prometheus."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/upload")
 async def upload(file: UploadFile = File(...)):
-    content = await file.read()
+    if not (file.filename or "").lower().endswith(UPLOAD_SUFFIXES):
+        raise HTTPException(status_code=400, detail="Поддерживаются файлы .xlsx и .csv")
     tmp_id = str(uuid.uuid4())
-    tmp_path = os.path.join(os.getcwd(), f"_upload_{tmp_id}_{file.filename}")
-    with open(tmp_path, "wb") as f:
-        f.write(content)
-    UPLOADS[tmp_id] = tmp_path
+    tmp_path = STORAGE.upload_path(tmp_id, file.filename)
+    check = UploadCheck(file.filename)
+    # файл на диске открывается, пишется и закрывается в пуле потоков, цикл событий не ждёт диск
+    out = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK):
+                check.feed(chunk)
+                await run_in_threadpool(out.write, chunk)
+            digest = check.finish()
+        finally:
+            await run_in_threadpool(out.close)
+        await run_in_threadpool(cache_upload, tmp_path, digest)
+    except HTTPException:
+        os.remove(tmp_path)
+        raise
+    except Exception as e:
+        os.remove(tmp_path)
+        if isinstance(e, getattr(_planner, "InputError", ())):
+            # planner не смог прочитать файл, повторная загрузка того же файла ответит так же
+            raise HTTPException(status_code=400, detail=f"Не удалось прочитать файл: {e}")
+        # остальное — сбой сервера или планировщика, а не плохой файл
+        raise HTTPException(status_code=500, detail=f"upload failed: {type(e).__name__}: {e}")
+    await run_in_threadpool(STORAGE.add_upload, tmp_id, tmp_path, file.filename, digest)
     return {"uploadId": tmp_id, "filename": file.filename, "path": tmp_path}
 
-@app.post("/schedule/plan", response_model=PlanResponse)
-def schedule_plan(req: PlanRequest):
+def plan_params(req: PlanRequest) -> Tuple[Dict[str, Any], str]:
+    """Параметры планировщика и хэш загруженного файла для ключа кэша."""
     params = req.dict()
     params.setdefault("options", {})
-    params["options"]["lastUploadPath"] = next(iter(UPLOADS.values()), None)
-    
-    # Проверяем, что файл был загружен
-    if not params["options"]["lastUploadPath"]:
+    upload_id = params.pop("uploadId", None)
+    # без uploadId не угадываем: последний загруженный файл может быть чужим
+    if not upload_id:
         raise HTTPException(
             status_code=400, 
             detail="Не загружен файл с данными. Пожалуйста, сначала загрузите Excel-файл на вкладке 'Загрузка данных'."
         )
-    
+    upload = STORAGE.get_upload(upload_id)
+    if upload is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Загруженный файл не найден или устарел. Пожалуйста, загрузите его заново."
+        )
+    params["options"]["lastUploadPath"] = upload["path"]
+    # хэш посчитан при загрузке, planner не читает файл ради него
+    params["options"]["lastUploadDigest"] = upload["digest"]
+
     # Добавляем параметры restTime и evaluateTime, если они не указаны (по умолчанию 0)
     params.setdefault("restTime", 0)
     params.setdefault("evaluateTime", 0)
+    return params, upload["digest"]
 
-    raw = call_planner(params)
+@app.post("/schedule/plan", response_model=PlanResponse)
+def schedule_plan(req: PlanRequest, response: Response):
+    params, digest = plan_params(req)
+    key = plan_cache_key(digest, params)
+    cached = plan_cache_get(key)
+    if cached is not None:
+        if "error" in cached:
+            raise HTTPException(status_code=400, detail=cached["error"], headers={"X-Plan-Cache": "hit"})
+        resp = dict(cached, id=str(uuid.uuid4()))
+        STORAGE.save_plan(resp, {"params": params, "deltas": []})
+        response.headers["X-Plan-Cache"] = "hit"
+        return resp
 
-    slots = raw.get("slots") or []
-    # Преобразуем формат времени из timedelta ("9:30:00") в HH:MM ("09:30")
-    for slot in slots:
-        if "start" in slot:
-            slot["start"] = timedelta_to_hhmm(slot["start"])
-        if "end" in slot:
-            slot["end"] = timedelta_to_hhmm(slot["end"])
-    
-    date = raw.get("date", req.window.date)
-    plan_id = str(uuid.uuid4())
-    resp = {"id": plan_id, "date": date, "slots": slots}
-    SCHEDULES[plan_id] = resp
+    try:
+        raw = call_planner(params)
+    except HTTPException as e:
+        metric_add("planner_plan_failures_total", status=str(e.status_code))
+        if e.status_code == 400:
+            # расписания нет при этих данных, повтор ответит так же
+            plan_cache_put(key, {"error": e.detail})
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"X-Plan-Cache": "miss"})
+
+    resp = plan_response(raw, req.window.date, {"params": params, "deltas": []})
+    if resp["complete"]:
+        plan_cache_put(key, resp)
+    response.headers["X-Plan-Cache"] = "miss"
     return resp
 
+@app.post("/schedule/{plan_id}/replan", response_model=PlanResponse)
+def schedule_replan(plan_id: str, req: ReplanRequest):
+    """
+    Правит данные, по которым построено расписание plan_id, и перестраивает его:
+    слоты групп, которых правка не касается, остаются на месте, если это возможно.
+    Исходное расписание не меняется, ответ — новое расписание со своим id.
+    """
+    plan = STORAGE.get_plan(plan_id)
+    source = STORAGE.get_plan_source(plan_id)
+    if plan is None or source is None:
+        raise HTTPException(404, "schedule not found")
+    params = dict(source["params"])
+    if not os.path.exists(params["options"]["lastUploadPath"]):
+        raise HTTPException(410, "Файл, по которому построено расписание, уже удалён. Загрузите его заново и постройте расписание.")
+    # планировщик применяет правки к загруженному файлу по порядку, последняя — к этому расписанию
+    params["deltas"] = source["deltas"] + [req.dict()]
+    params["timetable"] = plan["slots"]
+
+    try:
+        raw = call_planner(params)
+    except HTTPException as e:
+        metric_add("planner_plan_failures_total", status=str(e.status_code))
+        raise
+    return plan_response(raw, plan["date"], {"params": source["params"], "deltas": params["deltas"]})
+
+@app.post("/schedule/jobs", response_model=JobStatus, status_code=202)
+def schedule_job(req: PlanRequest):
+    """
+    То же, что /schedule/plan, но сразу возвращает id задачи, а расписание строится в пуле процессов.
+    Статус, прогресс и результат — GET /schedule/jobs/{job_id}, отмена — DELETE.
+    """
+    params, digest = plan_params(req)
+    key = plan_cache_key(digest, params)
+    job_id = str(uuid.uuid4())
+
+    cached = plan_cache_get(key)
+    if cached is not None:
+        if "error" in cached:
+            STORAGE.add_job(job_id, "failed", error=cached["error"])
+        else:
+            resp = dict(cached, id=str(uuid.uuid4()))
+            STORAGE.save_plan(resp, {"params": params, "deltas": []})
+            STORAGE.add_job(job_id, "done", result=resp)
+        return job_status(job_id)
+
+    pool = job_pool()
+    with _job_lock:
+        # очередь у каждого процесса uvicorn своя, как и пул
+        if len(JOBS) >= JOB_WORKERS + JOB_QUEUE_LIMIT:
+            raise HTTPException(status_code=429, detail="Очередь задач заполнена, попробуйте позже")
+        STORAGE.add_job(job_id, "queued")
+        job = JOBS[job_id] = {"params": params, "cacheKey": key}
+        job["future"] = pool.submit(run_plan_job, job_id, params)
+    job["future"].add_done_callback(lambda future: job_finished(job_id, future))
+    return job_status(job_id)
+
+@app.get("/schedule/jobs/{job_id}", response_model=JobStatus)
+def schedule_job_get(job_id: str):
+    return job_status(job_id)
+
+@app.delete("/schedule/jobs/{job_id}", response_model=JobStatus)
+def schedule_job_cancel(job_id: str):
+    """
+    Ждущая задача снимается с очереди, идущая останавливается и отдаёт лучшее частичное расписание.
+    Задачу другого процесса uvicorn останавливает сам процесс пула, узнав об отмене из STORAGE.
+    """
+    if not STORAGE.cancel_job(job_id):
+        raise HTTPException(404, "job not found")
+    with _job_lock:
+        job = JOBS.get(job_id)
+    if job is not None:
+        job["future"].cancel()
+    return job_status(job_id)
+
 @app.get("/schedule/{plan_id}", response_model=PlanResponse)
 def schedule_get(plan_id: str):
-    if plan_id not in SCHEDULES:
+    plan = STORAGE.get_plan(plan_id)
+    if plan is None:
         raise HTTPException(404, "schedule not found")
-    return SCHEDULES[plan_id]
+    return plan
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки планировщика на сгенерированных данных.
+
+Запуск:
+    python benchmark.py search --groups 300 --courts 12 --days 3
+    python benchmark.py depth --groups 3000 --courts 40 --days 30
+    python benchmark.py order --groups 170 --runs 10 --limit 2
+    python benchmark.py portfolio --groups 200 --workers 8
+    python benchmark.py memory --groups 10000 --courts 40 --days 100
+    python benchmark.py load --groups 50000 --courts 40 --days 100
+    python benchmark.py grid --groups 3000 --courts 40 --days 30 --slot 15
+    python benchmark.py index --groups 3000 --courts 40 --days 30
+    python benchmark.py objective --groups 40 --courts 6 --days 1 --limit 10
+    python benchmark.py nogoods --groups 40 --courts 3 --days 2 --runs 10 --limit 5
+    python benchmark.py symmetry --groups 14 --courts 4 --runs 8 --limit 10 --slot 15
+"""
+import argparse
+import csv
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+from openpyxl import Workbook
+
+from planner import (
+    COURT_INDEXES, COURT_ORDERS, GROUP_ORDERS, NOGOOD_LIMIT, OBJECTIVES, Court, Group, InfeasibleInputError, InputInfo, Solver, TimePeriod,
+    parse_input, solve_portfolio,
+)
+
+DAY = 24 * 60
+
+
+def generate_input(groups: int, courts: int, days: int, seed: int = 0) -> InputInfo:
+    """
+    многодневный турнир: корты работают днём, часть из них с перерывом,
+    у части групп есть ограничения по времени
+    """
+    rnd = random.Random(seed)
+    activity_durations: dict[str, float] = {'Индивидуальная': 3, 'Парная': 4, 'Командная': 6}
+    stage_limits = [5, 10]
+
+    court_list: list[Court] = []
+    for court_idx in range(courts):
+        periods: list[TimePeriod] = []
+        for day in range(days):
+            open_at = day * DAY + rnd.choice([8, 9, 10]) * 60
+            close_at = day * DAY + rnd.choice([18, 19, 20]) * 60
+            if rnd.random() < 0.3:
+                pause = open_at + rnd.randrange(3, 6) * 60
+                periods.append(TimePeriod(open_at, pause))
+                periods.append(TimePeriod(pause + 60, close_at))
+            else:
+                periods.append(TimePeriod(open_at, close_at))
+        court_list.append(Court(f'Корт {court_idx + 1}', periods))
+
+    group_list: list[Group] = []
+    for group_idx in range(groups):
+        day = group_idx * days // groups
+        if rnd.random() < 0.7:
+            limit = TimePeriod(day * DAY + 8 * 60, day * DAY + 20 * 60)
+        else:
+            start = day * DAY + rnd.randrange(8, 12) * 60
+            limit = TimePeriod(start, start + rnd.randrange(6, 9) * 60)
+        group_list.append(Group(
+            f'Группа {group_idx + 1}',
+            rnd.randrange(2, 13),
+            rnd.choice(list(activity_durations)),
+            limit,
+        ))
+
+    return InputInfo(
+        activity_durations=activity_durations,
+        courts=court_list,
+        groups=group_list,
+        stage_limits=stage_limits,
+    )
+
+
+def generate_symmetric_input(groups: int, courts: int, seed: int = 0, kinds: int = 3) -> InputInfo:
+    """
+    один день на одинаковых кортах, открытых с 9 до 13, группы нескольких видов,
+    у всех группы одного вида одинаковые упражнение, число участников и время
+    """
+    rnd = random.Random(seed)
+    activity_durations: dict[str, float] = {'Индивидуальная': 3, 'Парная': 4, 'Командная': 6}
+    court_list = [Court(f'Корт {court_idx + 1}', [TimePeriod(9 * 60, 13 * 60)]) for court_idx in range(courts)]
+    group_kinds = [(rnd.randrange(2, 13), rnd.choice(list(activity_durations))) for _ in range(kinds)]
+    group_list: list[Group] = []
+    for group_idx in range(groups):
+        count, activity = rnd.choice(group_kinds)
+        group_list.append(Group(f'Группа {group_idx + 1}', count, activity, TimePeriod(9 * 60, 13 * 60)))
+    return InputInfo(
+        activity_durations=activity_durations,
+        courts=court_list,
+        groups=group_list,
+        stage_limits=[5, 10],
+    )
+
+
+def input_rows(info: InputInfo) -> dict[str, list[list[object]]]:
+    """листы входного файла с заголовками, время кортов в виде ЧЧ:ММ:СС"""
+    def hhmmss(minutes: int) -> str:
+        return f'{minutes // 60}:{minutes % 60:02d}:00'
+
+    return {
+        'Упражнения': [['Название', 'Длительность']] + [[name, duration] for name, duration in info.activity_durations.items()],
+        'Этапы': [['МаксимумУчастников']] + [[limit] for limit in info.stage_limits],
+        'Корты': [['Корт', 'Открытие', 'Закрытие']] + [
+            [court.name, hhmmss(start), hhmmss(end)]
+            for court in info.courts for start, end in zip(court.starts, court.ends)
+        ],
+        'Группы': [['ИмяГруппы', 'КоличествоУчастников', 'Упражнение', 'МинимальноеВремяНачала', 'МаксимальноеВремяОкончания']] + [
+            [group.name, group.count, group.activity, group.limit.start, group.limit.end] for group in info.groups
+        ],
+    }
+
+
+def write_xlsx(info: InputInfo, path: str) -> None:
+    """как create_example_file.py через pandas: с общими строками и размерами листов"""
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in input_rows(info).items():
+        sheet = workbook.create_sheet(title)
+        for row in rows:
+            sheet.append(row)
+    workbook.save(path)
+
+
+def write_csv(info: InputInfo, path: str) -> None:
+    """листы друг за другом, перед каждым строка с его названием"""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        for title, rows in input_rows(info).items():
+            writer.writerow([title])
+            writer.writerows(rows)
+
+
+def timed(fn: Callable[[], object]) -> tuple[object, float]:
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def bench_search(args: argparse.Namespace) -> None:
+    """поиск по событиям против поминутного перебора, расписания должны совпасть"""
+    print(f"{'режим':<12}{'узлы':>12}{'пробы':>14}{'время, с':>12}")
+    timetables = []
+    for minute_scan in (True, False):
+        info = generate_input(args.groups, args.courts, args.days, args.seed)
+        solver = Solver(
+            info.groups, info.courts, args.rest, args.evaluate,
+            info.stage_limits, info.activity_durations, minute_scan=minute_scan,
+        )
+        try:
+            timetable, elapsed = timed(solver.find_timetable)
+        except InfeasibleInputError as e:
+            print(f'расписания нет: {e}')
+            return
+        timetables.append(None if timetable is None else [
+            (entry.group_idx, entry.court_idx, entry.period.start, entry.period.end)
+            for entry in timetable
+        ])
+        name = 'поминутно' if minute_scan else 'события'
+        print(f'{name:<12}{solver.stats.nodes:>12}{solver.stats.probes:>14}{elapsed:>12.3f}')
+    print('расписания совпадают' if timetables[0] == timetables[1] else 'РАСПИСАНИЯ РАЗЛИЧАЮТСЯ')
+
+
+def bench_depth(args: argparse.Namespace) -> None:
+    """
+    длинное расписание без возвратов: глубина поиска равна числу размещённых этапов;
+    порядок tightest, в порядке из файла на таких данных поиск возвращается и упирается в --limit
+    """
+    info = generate_input(args.groups, args.courts, args.days, args.seed)
+    solver = Solver(
+        info.groups, info.courts, args.rest, args.evaluate,
+        info.stage_limits, info.activity_durations, group_order='tightest', time_limit=args.limit,
+    )
+    try:
+        solution, elapsed = timed(solver.solve)
+    except InfeasibleInputError as e:
+        print(f'расписания нет: {e}')
+        return
+    placed = 0 if solution is None else len(solution.timetable)
+    complete = solution is not None and solution.complete
+    print(
+        f'этапов размещено: {placed}, полное: {"да" if complete else "нет"}, узлов: {solver.stats.nodes}, '
+        f'возвратов: {solver.stats.backtracks}, время: {elapsed:.3f} с'
+    )
+
+
+def bench_order(args: argparse.Namespace) -> None:
+    """
+    порядки групп и кортов на нескольких входах подряд (seed, seed + 1, ...),
+    запуск дольше --limit секунд прерывается и считается нерешённым
+    """
+    print(f"{'группы':<10}{'корты':<10}{'решено':>8}{'узлы':>12}{'возвраты':>12}{'время, с':>12}")
+    for group_order in GROUP_ORDERS:
+        for court_order in COURT_ORDERS:
+            solved = nodes = backtracks = 0
+            total = 0.0
+            for seed in range(args.seed, args.seed + args.runs):
+                info = generate_input(args.groups, args.courts, args.days, seed)
+                solver = Solver(
+                    info.groups, info.courts, args.rest, args.evaluate,
+                    info.stage_limits, info.activity_durations,
+                    group_order=group_order, court_order=court_order, time_limit=args.limit,
+                )
+                try:
+                    timetable, elapsed = timed(solver.find_timetable)
+                    solved += timetable is not None
+                except InfeasibleInputError:
+                    elapsed = solver.stats.seconds
+                total += elapsed
+                nodes += solver.stats.nodes
+                backtracks += solver.stats.backtracks
+            print(f'{group_order:<10}{court_order:<10}{solved:>5}/{args.runs:<2}{nodes:>12}{backtracks:>12}{total:>12.3f}')
+
+
+def bench_portfolio(args: argparse.Namespace) -> None:
+    """один решатель с порядком из файла против портфеля из --workers процессов"""
+    print(f"{'режим':<14}{'решено':>8}{'время, с':>12}")
+    for workers in (1, args.workers):
+        solved = 0
+        total = 0.0
+        for seed in range(args.seed, args.seed + args.runs):
+            info = generate_input(args.groups, args.courts, args.days, seed)
+            started = time.perf_counter()
+            try:
+                if workers == 1:
+                    solver = Solver(
+                        info.groups, info.courts, args.rest, args.evaluate,
+                        info.stage_limits, info.activity_durations, time_limit=args.limit,
+                    )
+                    solved += solver.find_timetable() is not None
+                else:
+                    found = solve_portfolio(
+                        info.groups, info.courts, args.rest, args.evaluate,
+                        info.stage_limits, info.activity_durations, workers, time_limit=args.limit,
+                    )
+                    solved += found is not None and found[0].complete
+            except InfeasibleInputError:
+                pass
+            total += time.perf_counter() - started
+        name = 'один решатель' if workers == 1 else f'портфель x{workers}'
+        print(f'{name:<14}{solved:>5}/{args.runs:<2}{total:>12.3f}')
+
+
+def bench_memory(args: argparse.Namespace) -> None:
+    """
+    память входа и поиска по tracemalloc, число сборок мусора
+    младшего поколения во время поиска — примерно по одной на 700 новых объектов
+    """
+    tracemalloc.start()
+    info = generate_input(args.groups, args.courts, args.days, args.seed)
+    solver = Solver(
+        info.groups, info.courts, args.rest, args.evaluate,
+        info.stage_limits, info.activity_durations, group_order='tightest',
+    )
+    input_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    collections = gc.get_stats()[0]['collections']
+    timetable, elapsed = timed(solver.find_timetable)
+    collections = gc.get_stats()[0]['collections'] - collections
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    placed = 0 if timetable is None else len(timetable)
+    print(f'этапов размещено: {placed}, узлов: {solver.stats.nodes}')
+    print(f'вход: {input_size / 2**20:.2f} МБ, пик при поиске: {(peak - input_size) / 2**20:.2f} МБ сверх входа')
+    print(f'сборок мусора: {collections}, время под tracemalloc: {elapsed:.3f} с')
+
+
+def bench_load(args: argparse.Namespace) -> None:
+    """чтение сгенерированного входа из .xlsx и .csv"""
+    info = generate_input(args.groups, args.courts, args.days, args.seed)
+    print(f"{'формат':<8}{'размер, МБ':>12}{'групп':>10}{'время, с':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for suffix, write in (('.xlsx', write_xlsx), ('.csv', write_csv)):
+            path = os.path.join(tmp, f'input{suffix}')
+            write(info, path)
+            loaded, elapsed = timed(lambda: parse_input(path))
+            assert isinstance(loaded, InputInfo)
+            print(f'{suffix:<8}{os.path.getsize(path) / 2**20:>12.2f}{len(loaded.groups):>10}{elapsed:>12.3f}')
+
+
+def bench_grid(args: argparse.Namespace) -> None:
+    """
+    поиск по минутам, по сетке в --slot минут и по сетке со сжатием до минут,
+    время окончания — когда заканчивается последний этап
+    """
+    print(f"{'режим':<18}{'узлы':>10}{'пробы':>12}{'окончание':>18}{'время, с':>12}")
+    for grid, compact in ((1, False), (args.slot, False), (args.slot, True)):
+        info = generate_input(args.groups, args.courts, args.days, args.seed)
+        solver = Solver(
+            info.groups, info.courts, args.rest, args.evaluate,
+            info.stage_limits, info.activity_durations,
+            group_order='tightest', time_limit=args.limit, grid=grid, compact=compact,
+        )
+        name = 'минуты' if grid == 1 else f'сетка {grid}' + (' + сжатие' if compact else '')
+        try:
+            solution, elapsed = timed(solver.solve)
+        except InfeasibleInputError as e:
+            print(f'{name:<18}расписания нет: {e}')
+            continue
+        if solution is None or not solution.complete:
+            print(f'{name:<18}{solver.stats.nodes:>10}{solver.stats.probes:>12}{"не найдено":>18}{elapsed:>12.3f}')
+            continue
+        last_end = max(entry.period.end for entry in solution.timetable)
+        finish = f'{last_end // DAY} д {last_end % DAY // 60:02d}:{last_end % 60:02d}'
+        print(f'{name:<18}{solver.stats.nodes:>10}{solver.stats.probes:>12}{finish:>18}{elapsed:>12.3f}')
+
+
+def bench_index(args: argparse.Namespace) -> None:
+    """дерево отрезков (или перебор кортов на малых площадках) против битовых карт numpy, расписания должны совпасть"""
+    print(f"{'индекс':<10}{'узлы':>10}{'пробы':>12}{'время, с':>12}")
+    timetables = []
+    for court_index in COURT_INDEXES:
+        info = generate_input(args.groups, args.courts, args.days, args.seed)
+        solver = Solver(
+            info.groups, info.courts, args.rest, args.evaluate,
+            info.stage_limits, info.activity_durations,
+            group_order='tightest', time_limit=args.limit, court_index=court_index,
+        )
+        try:
+            solution, elapsed = timed(solver.solve)
+        except InfeasibleInputError as e:
+            print(f'расписания нет: {e}')
+            return
+        timetables.append(None if solution is None else [
+            (entry.group_idx, entry.court_idx, entry.period.start, entry.period.end)
+            for entry in solution.timetable
+        ])
+        print(f'{court_index:<10}{solver.stats.nodes:>10}{solver.stats.probes:>12}{elapsed:>12.3f}')
+    print('расписания совпадают' if timetables[0] == timetables[1] else 'РАСПИСАНИЯ РАЗЛИЧАЮТСЯ')
+
+
+def bench_objective(args: argparse.Namespace) -> None:
+    """
+    поиск лучшего расписания за --limit секунд: сколько раз оно улучшалось,
+    его значение (минуты от открытия первого корта до конца последнего этапа или корто-часы) и нижняя оценка
+    """
+    print(f"{'цель':<14}{'узлы':>10}{'улучшений':>12}{'значение':>10}{'оценка':>10}{'зазор':>8}{'время, с':>12}")
+    for objective in OBJECTIVES:
+        info = generate_input(args.groups, args.courts, args.days, args.seed)
+        solver = Solver(
+            info.groups, info.courts, args.rest, args.evaluate,
+            info.stage_limits, info.activity_durations,
+            group_order='tightest', time_limit=args.limit, objective=objective,
+        )
+        try:
+            solution, elapsed = timed(solver.solve)
+        except InfeasibleInputError as e:
+            print(f'расписания нет: {e}')
+            return
+        stats = solver.stats
+        if solution is None or stats.objective is None:
+            print(f'{objective:<14}{stats.nodes:>10}{"не найдено":>12}{"":>28}{elapsed:>12.3f}')
+            continue
+        gap = 'опт.' if stats.optimal else f'{(stats.objective - stats.bound) / stats.objective:.1%}'
+        print(
+            f'{objective:<14}{stats.nodes:>10}{stats.solutions:>12}{stats.objective:>10}{stats.bound:>10}'
+            f'{gap:>8}{elapsed:>12.3f}'
+        )
+
+
+def bench_nogoods(args: argparse.Namespace) -> None:
+    """
+    перебор без запоминания тупиков и с ним на нескольких входах подряд (seed, seed + 1, ...):
+    решено, узлы, сравнения с запомненными тупиками и пропущенные по ним поддеревья
+    """
+    print(f"{'тупики':<10}{'решено':>8}{'узлы':>12}{'сравнения':>12}{'пропуски':>10}{'время, с':>12}")
+    for nogood_limit in (0, NOGOOD_LIMIT):
+        solved = nodes = checks = hits = 0
+        total = 0.0
+        for seed in range(args.seed, args.seed + args.runs):
+            info = generate_input(args.groups, args.courts, args.days, seed)
+            solver = Solver(
+                info.groups, info.courts, args.rest, args.evaluate,
+                info.stage_limits, info.activity_durations,
+                group_order='tightest', time_limit=args.limit, nogood_limit=nogood_limit,
+            )
+            try:
+                timetable, elapsed = timed(solver.find_timetable)
+                solved += timetable is not None
+            except InfeasibleInputError:
+                elapsed = solver.stats.seconds
+            total += elapsed
+            nodes += solver.stats.nodes
+            checks += solver.stats.nogood_checks
+            hits += solver.stats.nogood_hits
+        print(f'{nogood_limit:<10}{solved:>5}/{args.runs:<2}{nodes:>12}{checks:>12}{hits:>10}{total:>12.3f}')
+
+
+def bench_symmetry(args: argparse.Namespace) -> None:
+    """
+    перебор одинаковых групп и кортов во всех порядках и по одному на сетке --slot минут,
+    на нескольких симметричных входах подряд (seed, seed + 1, ...)
+    """
+    print(f"{'симметрия':<12}{'решено':>8}{'узлы':>12}{'группы':>8}{'корты':>10}{'время, с':>12}")
+    for symmetry in (False, True):
+        solved = nodes = twin_groups = twin_courts = 0
+        total = 0.0
+        for seed in range(args.seed, args.seed + args.runs):
+            info = generate_symmetric_input(args.groups, args.courts, seed)
+            solver = Solver(
+                info.groups, info.courts, args.rest, args.evaluate,
+                info.stage_limits, info.activity_durations,
+                group_order='tightest', time_limit=args.limit, grid=args.slot, symmetry=symmetry,
+            )
+            try:
+                timetable, elapsed = timed(solver.find_timetable)
+                solved += timetable is not None
+            except InfeasibleInputError:
+                elapsed = solver.stats.seconds
+            total += elapsed
+            nodes += solver.stats.nodes
+            twin_groups += solver.stats.twin_groups
+            twin_courts += solver.stats.twin_courts
+        mode = 'вкл' if symmetry else 'выкл'
+        print(f'{mode:<12}{solved:>5}/{args.runs:<2}{nodes:>12}{twin_groups:>8}{twin_courts:>10}{total:>12.3f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--groups', type=int, default=300)
+    parser.add_argument('--courts', type=int, default=12)
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--rest', type=int, default=10)
+    parser.add_argument('--evaluate', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--limit', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--slot', type=int, default=15)
+    benches = {
+        'search': bench_search, 'depth': bench_depth, 'order': bench_order,
+        'portfolio': bench_portfolio, 'memory': bench_memory, 'load': bench_load,
+        'grid': bench_grid, 'index': bench_index, 'objective': bench_objective,
+        'nogoods': bench_nogoods, 'symmetry': bench_symmetry,
+    }
+    parser.add_argument('bench', choices=benches)
+    args = parser.parse_args()
+    benches[args.bench](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,35 @@
-from bisect import bisect_left
-from datetime import timedelta
-from math import ceil, inf
-from typing import Any, NamedTuple
+import cProfile
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import pstats
+import random
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, time, timedelta
+from math import ceil, floor, inf
+from time import monotonic
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Sequence
+from zipfile import BadZipFile
 
-import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+try:
+    import numpy as np
+except ImportError:
+    # only the bitmap court index needs it
+    np = None
 
 # All time values are in minutes
 # Storing them as ints/float is MUCH simpler
@@ -11,6 +37,7 @@ import pandas as pd
 
 
 class TimePeriod:
+    __slots__ = ('start', 'end')
     start: int
     end: int
 
@@ -39,73 +66,433 @@ class TimePeriod:
 
 
 class Group:
+    __slots__ = ('name', 'count', 'limit', 'activity')
     name: str
     count: int
-    next_available: int
     limit: TimePeriod
     activity: str
 
     def __init__(self, name: str, count: int, activity: str, limit: TimePeriod) -> None:
         if count <= 0:
-            raise ValueError(f"group count must be positive, got {count}")
+            raise InputError(f"group count must be positive, got {count}")
         self.name = name
         self.count = count
-        self.next_available = limit.start
         self.limit = limit
         self.activity = activity
 
 
 class Court:
+    """
+    free time of a court, kept as two parallel sorted arrays of
+    disjoint, non adjacent free periods [starts[i], ends[i])
+    with n free periods, finding the period around a time is O(log n),
+    but booking inside a period or gluing periods back shifts the tails
+    of the arrays, which is O(n), a memmove of a few hundred ints
+    for a court booked for a season
+    """
+    __slots__ = ('name', 'starts', 'ends')
     name: str
-    time_available: list[TimePeriod]
+    starts: array
+    ends: array
 
     def __init__(self, name: str, available: list[TimePeriod]) -> None:
         self.name = name
-        self.time_available = available
-        self.time_available.sort()
+        self.starts = array('i')
+        self.ends = array('i')
+        # overlapping and adjacent windows are merged, so that unbooking
+        # a period can always glue free periods back together
+        for period in sorted(available):
+            if self.ends and self.ends[-1] >= period.start:
+                self.ends[-1] = max(self.ends[-1], period.end)
+            else:
+                self.starts.append(period.start)
+                self.ends.append(period.end)
 
-    def book_period(self, period: TimePeriod) -> bool:
-        idx = bisect_left(self.time_available, period)
-        if idx >= len(self.time_available):
-            return False
-        if (
-            self.time_available[idx].start > period.start
-            or self.time_available[idx].end < period.end
-        ):
+    @property
+    def time_available(self) -> list[TimePeriod]:
+        return [TimePeriod(start, end) for start, end in zip(self.starts, self.ends)]
+
+    def earliest_fit(self, start: int, duration: int) -> int | None:
+        """
+        returns the earliest time not before start at which
+        a period of given duration can be booked, or None
+        binary search finds the free period around start,
+        only free periods shorter than duration are skipped after it,
+        that walk is linear in the number of free periods in the worst case,
+        CourtIndex keeps the longest free periods in a tree for many courts
+        """
+        starts = self.starts
+        ends = self.ends
+        idx = bisect_right(starts, start) - 1
+        if idx >= 0 and ends[idx] >= start + duration:
+            return start
+        for idx in range(idx + 1, len(starts)):
+            if ends[idx] - starts[idx] >= duration:
+                return starts[idx]
+        return None
+
+    def latest_fit(self, end: int, duration: int) -> int | None:
+        """
+        returns the latest time at which a period of given duration
+        can be booked so that it ends not after end, or None
+        """
+        starts = self.starts
+        ends = self.ends
+        for idx in range(bisect_left(starts, end) - 1, -1, -1):
+            fit = min(ends[idx], end) - duration
+            if fit >= starts[idx]:
+                return fit
+        return None
+
+    def book(self, start: int, end: int) -> bool:
+        # the only free period that can contain the booked one
+        # is the last one starting not after it
+        idx = bisect_right(self.starts, start) - 1
+        if idx < 0 or self.ends[idx] < end:
             return False
 
-        if period == self.time_available[idx]:
-            self.time_available.pop(idx)
-        elif period.end == self.time_available[idx].end:
-            self.time_available[idx].end = period.start
-        elif period.start == self.time_available[idx].start:
-            self.time_available[idx].start = period.end
+        free_start = self.starts[idx]
+        free_end = self.ends[idx]
+        if free_start == start and free_end == end:
+            del self.starts[idx]
+            del self.ends[idx]
+        elif free_end == end:
+            self.ends[idx] = start
+        elif free_start == start:
+            self.starts[idx] = end
         else:
-            end = self.time_available[idx].end
-            self.time_available[idx].end = period.start
-            self.time_available.insert(idx + 1, TimePeriod(period.end, end))
+            self.ends[idx] = start
+            self.starts.insert(idx + 1, end)
+            self.ends.insert(idx + 1, free_end)
         return True
 
+    def unbook(self, start: int, end: int) -> None:
+        idx = bisect_right(self.starts, start)
+        if idx > 0 and self.ends[idx - 1] >= end:
+            # already free
+            return
+
+        # free periods touching [start, end) are glued into one
+        lo = idx
+        if idx > 0 and self.ends[idx - 1] >= start:
+            lo = idx - 1
+            start = self.starts[lo]
+        hi = idx
+        while hi < len(self.starts) and self.starts[hi] <= end:
+            end = max(end, self.ends[hi])
+            hi += 1
+
+        if lo == hi:
+            self.starts.insert(lo, start)
+            self.ends.insert(lo, end)
+            return
+        self.starts[lo] = start
+        self.ends[lo] = end
+        del self.starts[lo + 1:hi]
+        del self.ends[lo + 1:hi]
+
+    def book_period(self, period: TimePeriod) -> bool:
+        return self.book(period.start, period.end)
+
     def unbook_period(self, period: TimePeriod):
-        idx: int = bisect_left(self.time_available, period)
-        if (idx > 0 and self.time_available[idx - 1].contains(period)) or (
-            idx < len(self.time_available) and self.time_available[idx].contains(period)
-        ):
+        self.unbook(period.start, period.end)
+
+
+class CourtIndex:
+    """
+    free periods of all courts in one place, over minutes [origin, origin + size)
+    periods are keyed by the minute they start, in two max segment trees
+    which tell where the earliest period of given duration fits on any court
+    all bookings have to go through the index to keep it in sync with the courts
+    """
+    __slots__ = ('courts', 'origin', 'size', 'gaps', 'max_end', 'max_len')
+    courts: list[Court]
+    origin: int
+    size: int
+    # court index -> end of its free period starting at given minute
+    gaps: list[dict[int, int] | None]
+    # max end / max length of free periods starting within a node
+    max_end: array
+    max_len: array
+
+    def __init__(self, courts: list[Court]) -> None:
+        self.courts = courts
+        first = min((court.starts[0] for court in courts if court.starts), default=0)
+        last = max((court.ends[-1] for court in courts if court.ends), default=first + 1)
+        self.origin = first
+        self.size = 1
+        while self.size < last - first:
+            self.size *= 2
+        self.gaps = [None] * self.size
+        self.max_end = array('i', bytes(4 * 2 * self.size))
+        self.max_len = array('i', bytes(4 * 2 * self.size))
+        for court_idx, court in enumerate(courts):
+            for start, end in zip(court.starts, court.ends):
+                self._set_gap(court_idx, start, end)
+
+    def _set_gap(self, court_idx: int, start: int, end: int | None) -> None:
+        """sets or, when end is None, removes the court's free period starting at start"""
+        pos = start - self.origin
+        gaps = self.gaps[pos]
+        if end is not None:
+            if gaps is None:
+                gaps = self.gaps[pos] = {}
+            gaps[court_idx] = end
+        elif gaps is not None:
+            gaps.pop(court_idx, None)
+
+        max_end = self.max_end
+        max_len = self.max_len
+        node = pos + self.size
+        top = max(gaps.values()) if gaps else 0
+        if max_end[node] == top:
+            # some other court still has the longest period starting here
             return
+        max_end[node] = top
+        max_len[node] = top - start if gaps else 0
+        node >>= 1
+        while node:
+            left = 2 * node
+            top_end = max_end[left]
+            if max_end[left + 1] > top_end:
+                top_end = max_end[left + 1]
+            top_len = max_len[left]
+            if max_len[left + 1] > top_len:
+                top_len = max_len[left + 1]
+            if max_end[node] == top_end and max_len[node] == top_len:
+                # nothing changes further up
+                break
+            max_end[node] = top_end
+            max_len[node] = top_len
+            node >>= 1
+
+    def _prefix_max_end(self, pos: int) -> int:
+        """max end of free periods starting at positions [0, pos]"""
+        result = 0
+        lo = self.size
+        hi = pos + self.size + 1
+        while lo < hi:
+            if lo & 1:
+                result = max(result, self.max_end[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                result = max(result, self.max_end[hi])
+            lo >>= 1
+            hi >>= 1
+        return result
+
+    def _first_long(self, pos: int, duration: int) -> int | None:
+        """first position not before pos with a free period of at least duration"""
+        tree = self.max_len
+        node = pos + self.size
+        while tree[node] < duration:
+            # climb while we are the right child, then step to the next subtree
+            while node & 1:
+                node >>= 1
+            if node == 0:
+                return None
+            node += 1
+        while node < self.size:
+            node = 2 * node if tree[2 * node] >= duration else 2 * node + 1
+        return node - self.size
+
+    def earliest_fit(self, start: int, duration: int) -> int | None:
+        """
+        returns the earliest time not before start at which
+        some court can fit duration, or None
+        """
+        pos = max(start - self.origin, 0)
+        if pos >= self.size:
+            return None
+        start = pos + self.origin
+        # a free period starting not after start and ending late enough covers it
+        if self._prefix_max_end(pos) >= start + duration:
+            return start
+        if pos + 1 >= self.size:
+            return None
+        pos = self._first_long(pos + 1, duration)
+        return None if pos is None else pos + self.origin
+
+    def courts_starting_at(self, start: int, duration: int) -> list[int]:
+        """returns indices of courts with a long enough free period starting exactly at start"""
+        gaps = self.gaps[start - self.origin]
+        if gaps is None:
+            return []
+        end = start + duration
+        return sorted(court_idx for court_idx, gap_end in gaps.items() if gap_end >= end)
+
+    def courts_fitting(self, start: int, duration: int) -> list[int]:
+        """
+        returns indices of courts that can take [start, start + duration), in order
+        those are courts with a free period starting not after start and ending late enough,
+        the descent only enters nodes of the prefix holding such a period, so it costs
+        O(k log T) for k fitting courts instead of a look at every court
+        """
+        pos = start - self.origin
+        if pos < 0:
+            return []
+        end = start + duration
+        size = self.size
+        max_end = self.max_end
+        gaps = self.gaps
+        # nodes covering positions [0, pos], like in _prefix_max_end
+        nodes: list[int] = []
+        lo = size
+        hi = min(pos, size - 1) + size + 1
+        while lo < hi:
+            if lo & 1:
+                nodes.append(lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                nodes.append(hi)
+            lo >>= 1
+            hi >>= 1
+        fitting: list[int] = []
+        while nodes:
+            node = nodes.pop()
+            if max_end[node] < end:
+                continue
+            if node < size:
+                nodes.append(2 * node)
+                nodes.append(2 * node + 1)
+                continue
+            for court_idx, gap_end in (gaps[node - size] or {}).items():
+                if gap_end >= end:
+                    fitting.append(court_idx)
+        # periods are found by the minute they start, callers try courts in index order
+        fitting.sort()
+        return fitting
 
-        insert: TimePeriod = period
-        if idx > 0 and self.time_available[idx - 1].end >= period.start:
-            insert.start = self.time_available[idx - 1].start
-            self.time_available.pop(idx - 1)
-            idx -= 1
+    def book(self, court_idx: int, start: int, end: int) -> bool:
+        court = self.courts[court_idx]
+        idx = bisect_right(court.starts, start) - 1
+        if idx < 0 or court.ends[idx] < end:
+            return False
+        free_start = court.starts[idx]
+        free_end = court.ends[idx]
+        court.book(start, end)
+        self._set_gap(court_idx, free_start, start if free_start < start else None)
+        if end < free_end:
+            self._set_gap(court_idx, end, free_end)
+        return True
+
+    def unbook(self, court_idx: int, start: int, end: int) -> None:
+        court = self.courts[court_idx]
+        # free periods starting within [start, end] are glued to the one
+        # containing start by unbooking, they no longer start anywhere
+        lo = bisect_left(court.starts, start)
+        hi = bisect_right(court.starts, end)
+        for idx in range(lo, hi):
+            self._set_gap(court_idx, court.starts[idx], None)
+        court.unbook(start, end)
+        idx = bisect_right(court.starts, start) - 1
+        self._set_gap(court_idx, court.starts[idx], court.ends[idx])
+
+
+class BitmapIndex:
+    """
+    free minutes of all courts as rows of one boolean numpy array over [origin, origin + size),
+    where a period of given duration fits on every court at every start of a block of minutes
+    is one sliding window sum over the block, blocks double until a fit is found
+    same interface as CourtIndex, all bookings have to go through it to keep it in sync with the courts
+    """
+    __slots__ = ('courts', 'origin', 'size', 'free', 'last_fit')
+    courts: list[Court]
+    origin: int
+    size: int
+    free: Any
+    # (start, duration, courts) of the last earliest_fit, the caller asks for those courts next
+    last_fit: tuple[int, int, list[int]] | None
+
+    def __init__(self, courts: list[Court]) -> None:
+        if np is None:
+            raise ImportError("the bitmap court index needs numpy")
+        self.courts = courts
+        first = min((court.starts[0] for court in courts if court.starts), default=0)
+        last = max((court.ends[-1] for court in courts if court.ends), default=first + 1)
+        self.origin = first
+        self.size = last - first
+        self.free = np.zeros((len(courts), self.size), dtype=np.bool_)
+        for court_idx, court in enumerate(courts):
+            for start, end in zip(court.starts, court.ends):
+                self.free[court_idx, start - first:end - first] = True
+        self.last_fit = None
+
+    def earliest_fit(self, start: int, duration: int) -> int | None:
+        """
+        returns the earliest time not before start at which
+        some court can fit duration, or None
+        """
+        pos = max(start - self.origin, 0)
+        width = BITMAP_BLOCK
+        while pos + duration <= self.size:
+            block = self.free[:, pos:pos + width + duration - 1]
+            # free minutes before every column, windows are differences duration apart
+            sums = np.zeros((block.shape[0], block.shape[1] + 1), dtype=np.int32)
+            np.cumsum(block, axis=1, out=sums[:, 1:])
+            fits = sums[:, duration:] - sums[:, :-duration] == duration
+            columns = np.flatnonzero(fits.any(axis=0))
+            if columns.size:
+                column = int(columns[0])
+                best = pos + column + self.origin
+                self.last_fit = (best, duration, np.flatnonzero(fits[:, column]).tolist())
+                return best
+            pos += fits.shape[1]
+            width *= 2
+        return None
+
+    def courts_fitting(self, start: int, duration: int) -> list[int]:
+        """returns indices of courts that can take [start, start + duration), in order"""
+        if self.last_fit is not None and self.last_fit[0] == start and self.last_fit[1] == duration:
+            return self.last_fit[2]
+        pos = start - self.origin
+        if pos < 0 or pos + duration > self.size:
+            return []
+        return np.flatnonzero(self.free[:, pos:pos + duration].all(axis=1)).tolist()
+
+    def courts_starting_at(self, start: int, duration: int) -> list[int]:
+        """
+        returns indices of courts with a long enough free period starting exactly at start,
+        asked for where nothing earlier fits, so those are all courts that fit there
+        """
+        return self.courts_fitting(start, duration)
+
+    def book(self, court_idx: int, start: int, end: int) -> bool:
+        if not self.courts[court_idx].book(start, end):
+            return False
+        self.free[court_idx, start - self.origin:end - self.origin] = False
+        self.last_fit = None
+        return True
 
-        while (
-            idx < len(self.time_available)
-            and self.time_available[idx].end <= insert.end
-        ):
-            self.time_available.pop(idx)
+    def unbook(self, court_idx: int, start: int, end: int) -> None:
+        self.courts[court_idx].unbook(start, end)
+        self.free[court_idx, start - self.origin:end - self.origin] = True
+        self.last_fit = None
 
-        self.time_available.insert(idx, insert)
+
+# venues with fewer courts are searched without CourtIndex
+COURT_INDEX_MIN_COURTS = 24
+# minutes BitmapIndex looks at first for a fit
+BITMAP_BLOCK = 256
+# how free court time is looked up: CourtIndex on large venues and courts directly on small ones,
+# or BitmapIndex on any venue
+COURT_INDEXES = ('tree', 'bitmap')
+
+# orders in which groups are placed: as in the input, least room to move first,
+# longest performance first
+GROUP_ORDERS = ('rows', 'tightest', 'longest')
+# orders in which courts are tried at one start: by index, smallest free period first
+COURT_ORDERS = ('index', 'best_fit')
+# what the search minimizes after the first timetable: the time from the first court opening
+# to the end of the last stage, or the number of clock hours of courts with some stage in them
+OBJECTIVES = ('makespan', 'court_hours')
+# stages nogoods are kept for when they are on, the least recently matched stage is forgotten first,
+# sets of windows kept for one stage, and free court times kept for one set, least recently matched first
+NOGOOD_LIMIT = 10000
+NOGOODS_PER_STAGE = 8
+FREE_STATES_PER_NOGOOD = 32
 
 
 class TimetableEntry(NamedTuple):
@@ -114,6 +501,174 @@ class TimetableEntry(NamedTuple):
     period: TimePeriod
 
 
+class SearchStats:
+    __slots__ = (
+        'nodes', 'probes', 'backtracks', 'books', 'unbooks', 'max_depth', 'jumps', 'seconds', 'out_of_budget',
+        'solutions', 'objective', 'bound', 'optimal', 'nogoods', 'nogood_checks', 'nogood_hits',
+        'twin_groups', 'twin_courts',
+    )
+    nodes: int
+    probes: int
+    backtracks: int
+    books: int
+    unbooks: int
+    max_depth: int
+    jumps: dict[int, int]
+    seconds: float
+    out_of_budget: bool
+    solutions: int
+    objective: int | None
+    bound: int | None
+    optimal: bool
+    nogoods: int
+    nogood_checks: int
+    nogood_hits: int
+    twin_groups: int
+    twin_courts: int
+
+    def __init__(self) -> None:
+        self.nodes = 0
+        # number of availability checks, successful or not
+        self.probes = 0
+        # number of placements undone
+        self.backtracks = 0
+        # calls to book a court, successful or not, and to free it
+        self.books = 0
+        self.unbooks = 0
+        # most stages placed at once
+        self.max_depth = 0
+        # dead ends by how many placements were undone to get out of them,
+        # 1 is a plain backtrack, more is a backjump
+        self.jumps = {}
+        self.seconds = 0.0
+        # search stopped by time or node limit
+        self.out_of_budget = False
+        # with an objective: timetables found, each better than the one before,
+        # objective of the last one and a lower bound of it, in minutes or court hours,
+        # optimal once search has shown that no timetable is better
+        self.solutions = 0
+        self.objective = None
+        self.bound = None
+        self.optimal = False
+        # dead ends remembered, stages pushed with nogoods to compare against
+        # and those skipped because one of them matched
+        self.nogoods = 0
+        self.nogood_checks = 0
+        self.nogood_hits = 0
+        # groups that start no earlier than an identical group before them in the order,
+        # courts not tried at a start because an identical court was free the same way
+        self.twin_groups = 0
+        self.twin_courts = 0
+
+    def as_tuple(self) -> tuple:
+        """plain values to send from a worker process, from_tuple reads them back"""
+        return tuple(getattr(self, name) for name in SearchStats.__slots__)
+
+    @staticmethod
+    def from_tuple(values: tuple) -> 'SearchStats':
+        stats = SearchStats()
+        for name, value in zip(SearchStats.__slots__, values):
+            setattr(stats, name, value)
+        return stats
+
+
+class SearchHooks:
+    """
+    told by Solver about every step of the search, subclasses override what they need
+    group indices are those of the solver's groups, stages count from 0,
+    times are in steps of the solver's grid
+    """
+
+    def place(self, group_idx: int, stage: int, court_idx: int, start: int, end: int) -> None:
+        """the stage is booked at [start, end) on the court"""
+
+    def undo(self, group_idx: int, stage: int, court_idx: int, start: int, end: int) -> None:
+        """the placement is taken back"""
+
+    def backjump(self, group_idx: int, distance: int) -> None:
+        """no place for the group, distance placements were undone at once to get out of it"""
+
+
+class Solution(NamedTuple):
+    timetable: list[TimetableEntry]
+    # indices of groups with all stages in timetable and of the rest
+    placed: list[int]
+    unplaced: list[int]
+    # False if the budget ran out and timetable is the best partial one
+    complete: bool
+
+
+class InputError(ValueError):
+    """input, deltas or options the planner can't read or use, the same request fails the same way"""
+
+
+class InfeasibleInputError(InputError):
+    """input that can't have a timetable, found before searching for one"""
+
+
+@contextmanager
+def _reading(what: str) -> Iterator[None]:
+    """ValueError of values that don't fit, raised while reading what, becomes InputError"""
+    try:
+        yield
+    except InputError:
+        raise
+    except ValueError as e:
+        raise InputError(f"{what}: {e}") from e
+
+
+class _Frame:
+    """
+    a group stage on the search stack: where it is placed now, what to restore
+    when that placement is undone and which placements are left to try
+    frames are reused by the next stage pushed at the same depth
+    """
+    __slots__ = (
+        'position', 'group_idx', 'stage', 'duration', 'latest_start', 'has_next',
+        'next_start', 'start', 'end', 'courts', 'court_pos', 'court_idx', 'prev_next_available',
+        'twin', 'prev_twin_available', 'conflicts',
+    )
+    # place of the group in the search order
+    position: int
+    group_idx: int
+    # number of the stage in the group's chain of stages
+    stage: int
+    duration: int
+    latest_start: int
+    # False for the last stage of the group
+    has_next: bool
+    # where to look for the next start, None when there are no more
+    next_start: int | None
+    # placement currently tried, courts at the same start are courts[court_pos:]
+    start: int
+    end: int
+    courts: list[int]
+    court_pos: int
+    court_idx: int
+    prev_next_available: int
+    # identical group next in the order that may not start before the first stage of this one,
+    # -1 for none or a later stage, and when it could start before
+    twin: int
+    prev_twin_available: int
+    # why stages above failed and came back here, by group: the window in which the group
+    # could not be placed, bookings of frames below that overlap it are what blocked it
+    conflicts: dict[int, tuple[int, int]] | None
+
+    def __init__(self) -> None:
+        # filled in place for every start, the frame keeps its list
+        self.courts = []
+
+
+def _merge_windows(windows: dict[int, tuple[int, int]], other: dict[int, tuple[int, int]]) -> None:
+    """adds windows of other to windows, two windows of one group become one covering both"""
+    for group_idx, (start, end) in other.items():
+        if group_idx in windows:
+            known_start, known_end = windows[group_idx]
+            windows[group_idx] = (min(known_start, start), max(known_end, end))
+        else:
+            windows[group_idx] = (start, end)
+
+
 class Solver:
     groups: list[Group]
     courts: list[Court]
@@ -121,6 +676,86 @@ class Solver:
     evaluate_time: int
     stage_limits: list[int]
     activity_durations: dict[str, float]
+    minute_scan: bool
+    group_order: str
+    court_order: str
+    index: CourtIndex | BitmapIndex | None
+    # stages of all groups one after another, built once from the input:
+    # stages of group g are at stage_offsets[g] up to stage_offsets[g + 1]
+    stage_offsets: array
+    stage_counts: array
+    stage_durations: array
+    stage_has_next: array
+    # latest start of every stage, set by propagation
+    stage_latest: array
+    # search state of groups, by group index: when the next stage may start,
+    # limits stay as they are in groups
+    next_available: array
+    limit_ends: array
+    # indices of groups in the order they are placed
+    order: list[int]
+    # shuffles groups before ordering them, None keeps the input order for ties
+    seed: int | None
+    # seconds and nodes the search may take, None for no limit
+    time_limit: float | None
+    node_limit: int | None
+    # asked along with the clock, search stops as out of budget once it says so
+    should_stop: Callable[[], bool] | None
+    # told along with the clock how many nodes are searched and groups placed so far
+    progress: Callable[[int, int], None] | None
+    # told about every placement, undo and backjump
+    hooks: SearchHooks | None
+    # minutes in a step of the search, groups, courts and rest above are in steps,
+    # rounded inwards from the input ones, which are kept for turning the timetable back into minutes
+    grid: int
+    input_groups: list[Group]
+    input_courts: list[Court]
+    input_rest_time: int
+    # real minutes of stages, stage_durations are rounded up to steps
+    stage_minutes: array
+    # move stages of the timetable as early as they fit at minute resolution
+    compact: bool
+    # one of OBJECTIVES to keep searching for better timetables after the first one
+    # until the budget runs out, None stops at the first one
+    objective: str | None
+    # steps from the start of every stage to the end of the last stage of its group
+    stage_tail: array
+    # best timetable so far and its objective in steps or court hours,
+    # the objective no timetable can go below
+    incumbent: list[TimetableEntry] | None
+    best_value: float
+    lower_bound: int
+    # court work in steps left from every place in the order and
+    # placed before every stage of its group
+    suffix_work: list[int]
+    stage_done: array
+    # no stage from every place in the order on starts before it
+    suffix_start: list[int]
+    # free court steps in [start, end) before anything is booked,
+    # the first minute any input court opens at
+    free_within: Callable[[int, int], int]
+    origin: int
+    # court hours: free minutes of every (court, hour) before anything is booked,
+    # stages booked in the ones in use, how many of them there are and how many minutes are still free there
+    cell_open: dict[tuple[int, int], int]
+    cell_bookings: dict[tuple[int, int], int]
+    cells_used: int
+    cells_spare: int
+    # dead ends to skip when they come again, by flat index of the stage at the root of the failed subtree:
+    # (group, no earlier start, window end) of every group that failed in it, and the free court time
+    # in those windows it failed with, see _free_key; stages they are kept for, 0 keeps none
+    nogood_limit: int
+    nogoods: OrderedDict[int, dict[tuple[tuple[int, int, int], ...], OrderedDict[tuple, None]]]
+    # identical groups and courts are tried one way only: by group index the next group
+    # in the order with the same stages and limits, -1 for none; by court index the first court
+    # with the same free time before search, -1 for a court like no other
+    symmetry: bool
+    group_twins: array
+    court_classes: array
+    court_twins: bool
+    # timetable of fully placed groups at the deepest point search got to
+    best_partial: list[TimetableEntry]
+    stats: SearchStats
 
     def __init__(
         self,
@@ -130,104 +765,1329 @@ class Solver:
         evaluate_time: int,
         stage_limits: list[int],
         activity_durations: dict[str, float],
+        minute_scan: bool = False,
+        group_order: str = 'rows',
+        court_order: str = 'index',
+        seed: int | None = None,
+        time_limit: float | None = None,
+        node_limit: int | None = None,
+        should_stop: Callable[[], bool] | None = None,
+        progress: Callable[[int, int], None] | None = None,
+        hooks: SearchHooks | None = None,
+        grid: int = 1,
+        compact: bool = False,
+        court_index: str = 'tree',
+        objective: str | None = None,
+        nogood_limit: int = 0,
+        symmetry: bool = True,
     ) -> None:
+        if group_order not in GROUP_ORDERS:
+            raise InputError(f"unknown group order '{group_order}', expected one of {GROUP_ORDERS}")
+        if court_order not in COURT_ORDERS:
+            raise InputError(f"unknown court order '{court_order}', expected one of {COURT_ORDERS}")
+        if court_index not in COURT_INDEXES:
+            raise InputError(f"unknown court index '{court_index}', expected one of {COURT_INDEXES}")
+        if objective is not None and objective not in OBJECTIVES:
+            raise InputError(f"unknown objective '{objective}', expected one of {OBJECTIVES}")
+        if grid < 1:
+            raise InputError(f"grid must be at least one minute, got {grid}")
+        self.grid = grid
+        self.compact = compact
+        self.input_groups = groups
+        self.input_courts = courts
+        self.input_rest_time = rest_time
+        if grid > 1:
+            # stages start on the grid and take whole steps, all within the input limits
+            for group in groups:
+                if -(-group.limit.start // grid) >= group.limit.end // grid:
+                    raise InfeasibleInputError(
+                        f"time limits of group '{group.name}' hold no whole step of {grid} minutes"
+                    )
+            groups = [
+                Group(group.name, group.count, group.activity, TimePeriod(
+                    -(-group.limit.start // grid), group.limit.end // grid))
+                for group in groups
+            ]
+            courts = [
+                Court(court.name, [
+                    TimePeriod(-(-start // grid), end // grid)
+                    for start, end in zip(court.starts, court.ends) if -(-start // grid) < end // grid
+                ])
+                for court in courts
+            ]
+            rest_time = -(-rest_time // grid)
         self.groups = groups
         self.courts = courts
         self.rest_time = rest_time
         self.evaluate_time = evaluate_time
         self.stage_limits = stage_limits
         self.activity_durations = activity_durations
+        # reference mode: probe every court at every minute
+        self.minute_scan = minute_scan
+        self.group_order = group_order
+        self.court_order = court_order
+        self.index = None
+        if court_index == 'bitmap':
+            self.index = BitmapIndex(courts)
+        elif len(courts) >= COURT_INDEX_MIN_COURTS:
+            # below that many courts asking every court directly is cheaper
+            self.index = CourtIndex(courts)
+        self.stage_offsets = array('i')
+        self.stage_counts = array('i')
+        self.stage_durations = array('i')
+        self.stage_minutes = array('i')
+        self.stage_has_next = array('b')
+        self.stage_latest = array('i')
+        self.next_available = array('i')
+        self.limit_ends = array('i')
+        self._build_stage_table()
+        self.order = []
+        self.seed = seed
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.should_stop = should_stop
+        self.progress = progress
+        self.hooks = hooks
+        self.objective = objective
+        self.stage_tail = array('i')
+        self.incumbent = None
+        self.best_value = inf
+        self.lower_bound = 0
+        self.suffix_work = []
+        self.stage_done = array('i')
+        self.suffix_start = []
+        self.origin = 0
+        self.cell_open = {}
+        self.cell_bookings = {}
+        self.cells_used = 0
+        self.cells_spare = 0
+        self.nogood_limit = nogood_limit
+        self.nogoods = OrderedDict()
+        self.symmetry = symmetry
+        self.group_twins = array('i')
+        self.court_classes = array('i')
+        self.court_twins = False
+        self.best_partial = []
+        self.stats = SearchStats()
 
     def find_timetable(self) -> list[TimetableEntry] | None:
+        """
+        returns None if search finds no timetable or runs out of budget,
+        raises InfeasibleInputError if propagation proves there is none
+        """
+        solution = self.solve()
+        if solution is None or not solution.complete:
+            return None
+        return solution.timetable
+
+    def solve(self) -> Solution | None:
+        """
+        full timetable, or the best partial one if time or node limit is hit first,
+        with an objective the best full timetable found within the limits
+        returns None if search finds no timetable,
+        raises InfeasibleInputError if propagation proves there is none
+        """
         if len(self.courts) == 0 or len(self.groups) == 0:
             return None
 
+        started = monotonic()
+        self.next_available = array('i', [group.limit.start for group in self.groups])
+        self.limit_ends = array('i', [group.limit.end for group in self.groups])
+        self._propagate()
+        self.order = self._group_order()
+        if self.symmetry:
+            self._find_twins()
+        if self.objective is not None:
+            self._prepare_bounds()
         timetable: list[TimetableEntry] = []
-        if self._find_timetable_recursive(0, timetable) is not None:
+        result = self._search(timetable, started)
+        self.stats.seconds = monotonic() - started
+        if self.incumbent is not None:
+            timetable = self.incumbent
+            # search ended without running out of budget, nothing is left that could be better
+            self.stats.optimal = not self.stats.out_of_budget
+        elif self.stats.out_of_budget:
+            timetable = self.best_partial
+        elif result is not None or self.objective is not None:
             return None
-        return timetable
+        if self.grid > 1:
+            timetable = self._in_minutes(timetable)
+        if self.incumbent is not None:
+            self._report_objective(timetable)
 
-    def _get_performace_time(self, group: Group) -> int:
-        if group.activity not in self.activity_durations:
-            raise ValueError(
-                f"unknown activity '{group.activity}'")
-        elif group.count <= 0:
-            raise ValueError(f"performer count must be positive, got {group.count}")
-        return ceil(
-            group.count * self.activity_durations[group.activity]
-            + self.evaluate_time
+        placed = {entry.group_idx for entry in timetable}
+        return Solution(
+            timetable=timetable,
+            placed=sorted(placed),
+            unplaced=[idx for idx in range(0, len(self.groups)) if idx not in placed],
+            complete=self.incumbent is not None or not self.stats.out_of_budget,
         )
 
-    def _find_timetable_recursive(
-        self, idx: int, timetable: list[TimetableEntry]
-    ) -> TimetableEntry | None:
+    def _report_objective(self, timetable: list[TimetableEntry]) -> None:
+        """objective of the timetable in minutes and its lower bound go to stats"""
+        if self.objective == 'makespan':
+            value = max(entry.period.end for entry in timetable) - self.origin
+            bound = self.lower_bound * self.grid - self.origin
+        else:
+            value = len({
+                (entry.court_idx, hour)
+                for entry in timetable for hour in range(entry.period.start // 60, (entry.period.end - 1) // 60 + 1)
+            })
+            bound = self.lower_bound
+        self.stats.objective = value
+        # the bound is of the search on the grid, compaction may get below it
+        self.stats.bound = value if self.stats.optimal else min(bound, value)
+
+    def _in_minutes(self, timetable: list[TimetableEntry]) -> list[TimetableEntry]:
         """
-        recursively builds timetable, records it on success
-        returns None on success, or information about group that couldn't get a place in timetable
+        timetable found on the grid in minutes, stages keep their steps,
+        with compact each stage in the order they start moves as early as it fits on its court,
+        which never takes a place a later stage still has or breaks rest between stages of a group
         """
-        if idx >= len(self.groups):
-            # everyone placed, we got a valid timetable
-            return None
+        grid = self.grid
+        entries = sorted(timetable, key=lambda entry: (entry.period.start, entry.court_idx))
+        if not self.compact:
+            return [
+                TimetableEntry(
+                    period=TimePeriod(entry.period.start * grid, entry.period.end * grid),
+                    group_idx=entry.group_idx, court_idx=entry.court_idx,
+                )
+                for entry in entries
+            ]
+
+        courts = [Court(court.name, court.time_available) for court in self.input_courts]
+        next_start = [group.limit.start for group in self.input_groups]
+        stages = [0] * len(self.input_groups)
+        compacted: list[TimetableEntry] = []
+        for entry in entries:
+            group_idx = entry.group_idx
+            duration = self.stage_minutes[self.stage_offsets[group_idx] + stages[group_idx]]
+            stages[group_idx] += 1
+            fit = courts[entry.court_idx].earliest_fit(next_start[group_idx], duration)
+            start = entry.period.start * grid
+            if fit is not None and fit < start:
+                start = fit
+            booked = courts[entry.court_idx].book(start, start + duration)
+            assert booked
+            next_start[group_idx] = start + duration + self.input_rest_time
+            compacted.append(TimetableEntry(
+                period=TimePeriod(start, start + duration), group_idx=group_idx, court_idx=entry.court_idx,
+            ))
+        return compacted
 
-        group: Group = self.groups[idx]
+    def _get_performace_time(self, activity: str, count: int) -> int:
+        if activity not in self.activity_durations:
+            raise InputError(
+                f"unknown activity '{activity}'")
+        elif count <= 0:
+            raise InputError(f"performer count must be positive, got {count}")
+        return ceil(
+            count * self.activity_durations[activity]
+            + self.evaluate_time
+        )
+
+    def _next_stage_count(self, count: int) -> int | None:
+        """count of the stage after one with count performers, None if it was the last one"""
         stage_idx: int = len(self.stage_limits)
         for i in range(0, len(self.stage_limits)):
-            if self.stage_limits[i] < group.count:
+            if self.stage_limits[i] < count:
                 stage_idx = i
-        has_next_stage: bool = stage_idx == len(self.stage_limits)
+        if stage_idx == len(self.stage_limits):
+            return None
+        return self.stage_limits[stage_idx]
 
-        duration: int = self._get_performace_time(group)
+    def _build_stage_table(self) -> None:
+        """
+        expands every group into its chain of stages, so that search only reads them
+        raises InputError for unknown activities and counts that aren't positive
+        """
+        self.stage_offsets.append(0)
+        for group in self.groups:
+            count: int | None = group.count
+            while count is not None:
+                self.stage_counts.append(count)
+                minutes = self._get_performace_time(group.activity, count)
+                self.stage_minutes.append(minutes)
+                self.stage_durations.append(-(-minutes // self.grid))
+                count = self._next_stage_count(count)
+                self.stage_has_next.append(count is not None)
+            self.stage_offsets.append(len(self.stage_counts))
 
-        fail_result = TimetableEntry(
-            period=TimePeriod(group.next_available, group.limit.end), group_idx=idx, court_idx=0
-        )
-        for start in range(group.next_available, group.limit.end):
-            if start + duration > group.limit.end:
-                return fail_result
-            booked_period: TimePeriod = TimePeriod(start, start + duration)
+    def _free_minutes(self) -> Callable[[int, int], int]:
+        """returns a function telling how many free court minutes all courts have within [start, end)"""
+        slopes: dict[int, int] = {}
+        for court in self.courts:
+            for start, end in zip(court.starts, court.ends):
+                slopes[start] = slopes.get(start, 0) + 1
+                slopes[end] = slopes.get(end, 0) - 1
+        # free minutes before every point where the number of free courts changes
+        points = sorted(slopes)
+        before: list[int] = [0]
+        free_courts: list[int] = [0]
+        for i in range(1, len(points)):
+            free_courts.append(free_courts[-1] + slopes[points[i - 1]])
+            before.append(before[-1] + free_courts[-1] * (points[i] - points[i - 1]))
+
+        def free_before(time: int) -> int:
+            i = bisect_right(points, time) - 1
+            if i < 0:
+                return 0
+            return before[i] + (free_courts[i] + slopes[points[i]]) * (time - points[i])
+
+        return lambda start, end: free_before(end) - free_before(start)
+
+    def _propagate(self) -> None:
+        """
+        finds for every stage of every group the earliest start and the latest start
+        that still leaves time for the following stages on empty courts,
+        checks that stages which have to be played within a window fit into free court time there
+        moves next_available to the earliest start of groups and fills stage_latest
+        raises InfeasibleInputError if some group can't be placed even alone
+        """
+        # courts are free of bookings yet, groups of one day mostly ask the same questions
+        earliest_fits: dict[tuple[int, int], int | None] = {}
+        latest_fits: dict[tuple[int, int], int | None] = {}
+
+        def earliest_fit(start: int, duration: int) -> int | None:
+            if (start, duration) not in earliest_fits:
+                fits = [court.earliest_fit(start, duration) for court in self.courts]
+                earliest_fits[start, duration] = min((fit for fit in fits if fit is not None), default=None)
+            return earliest_fits[start, duration]
+
+        def latest_fit(end: int, duration: int) -> int | None:
+            if (end, duration) not in latest_fits:
+                fits = [court.latest_fit(end, duration) for court in self.courts]
+                latest_fits[end, duration] = max((fit for fit in fits if fit is not None), default=None)
+            return latest_fits[end, duration]
+
+        windows: list[tuple[int, int, int, int]] = []
+        self.stage_latest = array('i', [0]) * len(self.stage_durations)
+        for group_idx, group in enumerate(self.groups):
+            first = self.stage_offsets[group_idx]
+            counts = self.stage_counts[first:self.stage_offsets[group_idx + 1]]
+            durations = self.stage_durations[first:self.stage_offsets[group_idx + 1]]
+
+            earliest: list[int] = []
+            start = self.next_available[group_idx]
+            for stage, duration in enumerate(durations):
+                fit = earliest_fit(start, duration)
+                if fit is None or fit + duration > group.limit.end:
+                    raise InfeasibleInputError(
+                        f"group '{group.name}': stage {stage + 1} of {len(durations)}"
+                        f" ({counts[stage]} performers, {duration * self.grid} min) can't be placed on any court"
+                        f" between {timedelta(minutes=start * self.grid)}"
+                        f" and {timedelta(minutes=group.limit.end * self.grid)}"
+                    )
+                earliest.append(fit)
+                start = fit + duration + self.rest_time
+
+            # placing every stage as early as possible is a valid chain,
+            # so a latest start exists for every stage and is not before the earliest one
+            latest: list[int] = [0] * len(durations)
+            end = group.limit.end
+            for stage in range(len(durations) - 1, -1, -1):
+                fit = latest_fit(end, durations[stage])
+                assert fit is not None and fit >= earliest[stage]
+                latest[stage] = fit
+                self.stage_latest[first + stage] = fit
+                end = fit - self.rest_time
+
+            self.next_available[group_idx] = earliest[0]
+            for stage, duration in enumerate(durations):
+                windows.append((earliest[stage], latest[stage] + duration, duration, group_idx))
+
+        self._check_capacity(windows)
+
+    def _check_capacity(self, windows: list[tuple[int, int, int, int]]) -> None:
+        """
+        windows are (earliest start, latest end, court minutes needed, group index) of every stage
+        all stages with windows inside a window of some stage have to fit into free court minutes of it
+        """
+        free_minutes = self._free_minutes()
+        ends = sorted({end for _, end, _, _ in windows})
+        # fenwick tree over window ends: court minutes needed by stages added so far
+        needed = [0] * (len(ends) + 1)
+        inside = [0] * (len(ends) + 1)
+        # stages are added from the latest start on, so that those starting
+        # not before a window are already there when it is checked
+        windows = sorted(windows, key=lambda window: -window[0])
+        i = 0
+        while i < len(windows):
+            j = i
+            while j < len(windows) and windows[j][0] == windows[i][0]:
+                pos = bisect_left(ends, windows[j][1]) + 1
+                while pos <= len(ends):
+                    needed[pos] += windows[j][2]
+                    inside[pos] += 1
+                    pos += pos & -pos
+                j += 1
+            for start, end, _, group_idx in windows[i:j]:
+                total = 0
+                count = 0
+                pos = bisect_left(ends, end) + 1
+                while pos > 0:
+                    total += needed[pos]
+                    count += inside[pos]
+                    pos -= pos & -pos
+                free = free_minutes(start, end)
+                if total > free:
+                    raise InfeasibleInputError(
+                        f"{count} stages have to be played between {timedelta(minutes=start * self.grid)}"
+                        f" and {timedelta(minutes=end * self.grid)} (window of a stage of group '{self.groups[group_idx].name}'),"
+                        f" they need {total * self.grid} court minutes, courts are free for {free * self.grid}"
+                    )
+            i = j
+
+    def _group_order(self) -> list[int]:
+        """ties keep the input order, bounds from propagation have to be known"""
+        order = list(range(0, len(self.groups)))
+        if self.seed is not None:
+            random.Random(self.seed).shuffle(order)
+        if self.group_order == 'tightest':
+            order.sort(key=lambda idx: self.stage_latest[self.stage_offsets[idx]] - self.next_available[idx])
+        elif self.group_order == 'longest':
+            order.sort(key=lambda idx: -self.stage_durations[self.stage_offsets[idx]])
+        return order
+
+    def _best_fit_first(self, court_indices: list[int], start: int) -> None:
+        """sorts courts in place, those whose free period around start is the shortest come first"""
+        def free_period(court_idx: int) -> float:
+            court = self.courts[court_idx]
+            idx = bisect_right(court.starts, start) - 1
+            if idx < 0:
+                return inf
+            return court.ends[idx] - court.starts[idx]
+        court_indices.sort(key=free_period)
+
+    def _find_twins(self) -> None:
+        """
+        fills group_twins and court_classes, swapping the places of two identical groups
+        or the bookings of two courts free at the same times gives an equally good timetable,
+        so the first of identical groups starts first and one of such courts is tried
+        """
+        offsets = self.stage_offsets
+        self.group_twins = array('i', [-1] * len(self.groups))
+        last: dict[tuple, int] = {}
+        for group_idx in self.order:
+            lo, hi = offsets[group_idx], offsets[group_idx + 1]
+            key = (
+                self.next_available[group_idx], self.limit_ends[group_idx],
+                tuple(self.stage_durations[lo:hi]), tuple(self.stage_minutes[lo:hi]), tuple(self.stage_latest[lo:hi]),
+            )
+            if key in last:
+                self.group_twins[last[key]] = group_idx
+                self.stats.twin_groups += 1
+            last[key] = group_idx
+
+        first: dict[tuple, int] = {}
+        self.court_classes = array('i', [-1] * len(self.courts))
+        for court_idx, court in enumerate(self.courts):
+            key = (tuple(court.starts), tuple(court.ends))
+            if key in first:
+                self.court_classes[first[key]] = first[key]
+                self.court_classes[court_idx] = first[key]
+            else:
+                first[key] = court_idx
+        self.court_twins = len(first) < len(self.courts)
+
+    def _distinct_courts(self, court_indices: list[int]) -> None:
+        """drops in place courts free at the same times as one before them of their class, keeps the order"""
+        courts = self.courts
+        classes = self.court_classes
+        kept: dict[int, list[Court]] = {}
+        distinct = 0
+        for court_idx in court_indices:
+            court_class = classes[court_idx]
+            if court_class >= 0:
+                court = courts[court_idx]
+                same = kept.setdefault(court_class, [])
+                if any(other.starts == court.starts and other.ends == court.ends for other in same):
+                    self.stats.twin_courts += 1
+                    continue
+                same.append(court)
+            court_indices[distinct] = court_idx
+            distinct += 1
+        del court_indices[distinct:]
+
+    def _next_start(self, frame: _Frame) -> bool:
+        """
+        moves the frame to the next start not before frame.next_start at which some court
+        can fit its duration, in the order a minute by minute scan would find them,
+        fills frame.courts with courts that can, returns False when there are no more
+        """
+        start = frame.next_start
+        if start is None:
+            return False
+        duration = frame.duration
+        courts = frame.courts
+        if self.minute_scan:
+            best = start
+            courts[:] = range(0, len(self.courts))
+        # courts are not touched between starts, bookings made by the caller
+        # are always undone before the next start is asked for
+        elif self.index is not None:
+            self.stats.probes += 1
+            best = self.index.earliest_fit(start, duration)
+            if best is None:
+                frame.next_start = None
+                return False
+            if best > start:
+                # nothing starting earlier was long enough, so only
+                # free periods starting right at best can take it
+                courts[:] = self.index.courts_starting_at(best, duration)
+            else:
+                courts[:] = self.index.courts_fitting(best, duration)
+        else:
+            best = None
+            fitting = 0
             for court_idx in range(0, len(self.courts)):
-                court = self.courts[court_idx]
-                if not court.book_period(booked_period):
+                self.stats.probes += 1
+                fit = self.courts[court_idx].earliest_fit(start, duration)
+                if fit is None or (best is not None and fit > best):
                     continue
-                prev_count = group.count
-                prev_next_available = group.next_available
-                if has_next_stage:
-                    group.count = self.stage_limits[stage_idx]
-                group.next_available = start + duration + self.rest_time
-                result = self._find_timetable_recursive(
-                    idx + 1 if has_next_stage else idx, timetable
+                if best is None or fit < best:
+                    best = fit
+                    fitting = 0
+                if fitting < len(courts):
+                    courts[fitting] = court_idx
+                else:
+                    courts.append(court_idx)
+                fitting += 1
+            if best is None:
+                frame.next_start = None
+                return False
+            del courts[fitting:]
+        frame.start = best
+        frame.end = best + duration
+        frame.court_pos = 0
+        frame.next_start = best + 1
+        return True
+
+    def _book(self, court_idx: int, start: int, end: int) -> bool:
+        if self.index is not None:
+            return self.index.book(court_idx, start, end)
+        return self.courts[court_idx].book(start, end)
+
+    def _unbook(self, court_idx: int, start: int, end: int) -> None:
+        if self.index is not None:
+            self.index.unbook(court_idx, start, end)
+        else:
+            self.courts[court_idx].unbook(start, end)
+
+    def _keep_best(self, frames: list[_Frame], depth: int) -> None:
+        """remembers placed stages of fully placed groups if there are more of them than before"""
+        placed = depth
+        if depth > 0 and frames[depth - 1].has_next:
+            # the group on top still has stages to place
+            placed -= frames[depth - 1].stage + 1
+        if placed > len(self.best_partial):
+            self.best_partial = [
+                TimetableEntry(
+                    period=TimePeriod(frame.start, frame.end),
+                    group_idx=frame.group_idx, court_idx=frame.court_idx,
                 )
+                for frame in frames[:placed]
+            ]
 
-                if result is None:
-                    timetable.append(
-                        TimetableEntry(period=booked_period, group_idx=idx, court_idx=court_idx)
-                    )
+    def _prepare_bounds(self) -> None:
+        """
+        fills what search with an objective needs to tell that a placement can't lead to
+        a better timetable, and the lower bound of the objective
+        order has to be known, courts have to be free of bookings yet
+        """
+        durations = self.stage_durations
+        self.stage_tail = array('i', durations)
+        self.stage_done = array('i', [0]) * len(durations)
+        for group_idx in range(0, len(self.groups)):
+            first = self.stage_offsets[group_idx]
+            last = self.stage_offsets[group_idx + 1]
+            for flat in range(last - 2, first - 1, -1):
+                self.stage_tail[flat] += self.rest_time + self.stage_tail[flat + 1]
+            for flat in range(first + 1, last):
+                self.stage_done[flat] = self.stage_done[flat - 1] + durations[flat - 1]
+
+        self.suffix_work = [0] * len(self.order)
+        self.suffix_start = [0] * len(self.order)
+        work = 0
+        start = None
+        for position in range(len(self.order) - 1, -1, -1):
+            group_idx = self.order[position]
+            work += sum(durations[self.stage_offsets[group_idx]:self.stage_offsets[group_idx + 1]])
+            start = self.next_available[group_idx] if start is None else min(start, self.next_available[group_idx])
+            self.suffix_work[position] = work
+            self.suffix_start[position] = start
+        self.free_within = self._free_minutes()
+        self.origin = min((court.starts[0] for court in self.input_courts if court.starts), default=0)
+
+        grid = self.grid
+        if self.objective == 'makespan':
+            # every group plays its stages one after another from its earliest start,
+            # and all stages need that much free court time from the first opening on
+            chain = max(
+                self.next_available[group_idx] + self.stage_tail[self.stage_offsets[group_idx]]
+                for group_idx in range(0, len(self.groups))
+            )
+            low = min(court.starts[0] for court in self.courts if court.starts)
+            high = max(court.ends[-1] for court in self.courts if court.ends)
+            opening = low
+            while low < high:
+                middle = (low + high) // 2
+                if self.free_within(opening, middle) >= work:
+                    high = middle
+                else:
+                    low = middle + 1
+            self.lower_bound = max(chain, low)
+        else:
+            # a court hour takes 60 minutes of stages at most
+            self.lower_bound = -(-work * grid // 60)
+            for court_idx, court in enumerate(self.courts):
+                for start, end in zip(court.starts, court.ends):
+                    for hour in range(start * grid // 60, (end * grid - 1) // 60 + 1):
+                        cell = (court_idx, hour)
+                        self.cell_open[cell] = self.cell_open.get(cell, 0) + (
+                            min(end * grid, hour * 60 + 60) - max(start * grid, hour * 60))
+
+    def _may_improve(self, idx: int, stage: int) -> bool:
+        """False if stages from the stage of the group at idx in the order on can't make a better timetable"""
+        if self.incumbent is None:
+            return True
+        remaining = self.suffix_work[idx] - self.stage_done[self.stage_offsets[self.order[idx]] + stage]
+        if self.objective == 'makespan':
+            # they all have to end before the last stage of the best timetable does
+            return remaining <= self.free_within(self.suffix_start[idx], int(self.best_value) - 1)
+        # free minutes of court hours in use are taken first, the rest needs new ones
+        needed = remaining * self.grid - self.cells_spare
+        return self.cells_used + max(0, -(-needed // 60)) < self.best_value
+
+    def _record_incumbent(self, frames: list[_Frame], depth: int) -> int:
+        """
+        keeps the timetable of placed frames if it is better than the best one,
+        returns the depth of the lowest frame that has to move to get a better one,
+        or -1 if none can be better than the lower bound
+        """
+        if self.objective == 'makespan':
+            value = max(frame.end for frame in frames[:depth])
+        else:
+            value = self.cells_used
+        if value >= self.best_value:
+            return depth - 1
+        self.incumbent = [
+            TimetableEntry(
+                period=TimePeriod(frame.start, frame.end),
+                group_idx=frame.group_idx, court_idx=frame.court_idx,
+            )
+            for frame in reversed(frames[:depth])
+        ]
+        self.best_value = value
+        self.stats.solutions += 1
+        if value <= self.lower_bound:
+            return -1
+        if self.objective != 'makespan':
+            return depth - 1
+
+        # from now on every stage leaves time for the rest of its group to end before value
+        stage_latest = self.stage_latest
+        stage_tail = self.stage_tail
+        for flat in range(0, len(stage_latest)):
+            stage_latest[flat] = min(stage_latest[flat], value - 1 - stage_tail[flat])
+        retry = depth - 1
+        for position in range(depth - 1, -1, -1):
+            frame = frames[position]
+            frame.latest_start = min(frame.latest_start, stage_latest[self.stage_offsets[frame.group_idx] + frame.stage])
+            if frame.start > frame.latest_start:
+                retry = position
+        return retry
+
+    def _book_cells(self, court_idx: int, start: int, end: int) -> bool:
+        """_book that keeps count of court hours in use and their free minutes"""
+        if not self._book(court_idx, start, end):
+            return False
+        grid = self.grid
+        for hour in range(start * grid // 60, (end * grid - 1) // 60 + 1):
+            cell = (court_idx, hour)
+            count = self.cell_bookings.get(cell, 0)
+            if count == 0:
+                self.cells_used += 1
+                self.cells_spare += self.cell_open[cell]
+            self.cell_bookings[cell] = count + 1
+            self.cells_spare -= min(end * grid, hour * 60 + 60) - max(start * grid, hour * 60)
+        return True
+
+    def _unbook_cells(self, court_idx: int, start: int, end: int) -> None:
+        self._unbook(court_idx, start, end)
+        grid = self.grid
+        for hour in range(start * grid // 60, (end * grid - 1) // 60 + 1):
+            cell = (court_idx, hour)
+            self.cells_spare += min(end * grid, hour * 60 + 60) - max(start * grid, hour * 60)
+            count = self.cell_bookings[cell] - 1
+            self.cell_bookings[cell] = count
+            if count == 0:
+                self.cells_used -= 1
+                self.cells_spare -= self.cell_open[cell]
+
+    def _free_key(self, windows: tuple[tuple[int, int, int], ...], taken: _Frame | None) -> tuple:
+        """
+        free periods of every court within the windows, with the placement of taken booked as well,
+        courts in sorted order: the groups fail the same way on courts that only trade places
+        """
+        rows: list[tuple[int, ...]] = []
+        for court_idx, court in enumerate(self.courts):
+            starts = court.starts
+            ends = court.ends
+            row: list[int] = []
+            for _, start, end in windows:
+                for idx in range(bisect_right(ends, start), len(starts)):
+                    if starts[idx] >= end:
+                        break
+                    period_start = max(starts[idx], start)
+                    period_end = min(ends[idx], end)
+                    if (
+                        taken is not None and court_idx == taken.court_idx
+                        and taken.start < period_end and taken.end > period_start
+                    ):
+                        # taken is undone on the way down, it is still part of what blocked the groups
+                        if period_start < taken.start:
+                            row.extend((period_start, taken.start))
+                        if taken.end < period_end:
+                            row.extend((taken.end, period_end))
+                    else:
+                        row.extend((period_start, period_end))
+                # windows are told apart in the row
+                row.append(-1)
+            rows.append(tuple(row))
+        rows.sort()
+        return tuple(rows)
+
+    def _learn(self, root: _Frame, windows: dict[int, tuple[int, int]], taken: _Frame) -> None:
+        """
+        remembers that the subtree from root on failed, so that it is skipped when root is pushed again
+        with the groups not starting earlier and the same free court time in their windows
+        taken is the frame search goes back to, the frames above it are undone already
+        """
+        flat = self.stage_offsets[root.group_idx] + root.stage
+        key = tuple((group_idx, start, end) for group_idx, (start, end) in sorted(windows.items()))
+        free = self._free_key(key, taken)
+        known = self.nogoods.get(flat)
+        if known is None:
+            known = self.nogoods[flat] = {}
+            if len(self.nogoods) > self.nogood_limit:
+                self.nogoods.popitem(last=False)
+        else:
+            self.nogoods.move_to_end(flat)
+        if key not in known:
+            if len(known) >= NOGOODS_PER_STAGE:
+                # the windows seen first go first
+                del known[next(iter(known))]
+            known[key] = OrderedDict()
+        states = known[key]
+        if free in states:
+            states.move_to_end(free)
+            return
+        if len(states) >= FREE_STATES_PER_NOGOOD:
+            states.popitem(last=False)
+        states[free] = None
+        self.stats.nogoods += 1
+
+    def _known_failure(self, flat: int) -> dict[int, tuple[int, int]] | None:
+        """windows of a nogood of the stage that matches now, None if none does"""
+        self.stats.nogood_checks += 1
+        next_available = self.next_available
+        for key, states in self.nogoods[flat].items():
+            # starting later the groups fail all the same
+            if not all(next_available[group_idx] >= start for group_idx, start, _ in key):
+                continue
+            free = self._free_key(key, None)
+            if free in states:
+                self.stats.nogood_hits += 1
+                self.nogoods.move_to_end(flat)
+                states.move_to_end(free)
+                return {group_idx: (start, end) for group_idx, start, end in key}
+        return None
+
+    def _search(self, timetable: list[TimetableEntry], started: float) -> TimetableEntry | None:
+        """
+        depth first search over group stages, keeps placed stages on an explicit stack
+        instead of recursing, records timetable on success
+        returns None on success, or information about group that couldn't get a place in timetable
+        when out of budget sets stats.out_of_budget and returns None, best_partial is all there is
+        with an objective goes on after every timetable as if it were a dead end, keeps the best one
+        in incumbent and returns once no better one is left or the budget is out
+        """
+        stage_offsets = self.stage_offsets
+        stage_durations = self.stage_durations
+        stage_has_next = self.stage_has_next
+        stage_latest = self.stage_latest
+        next_available = self.next_available
+        limit_ends = self.limit_ends
+        order = self.order
+        best_fit = self.court_order == 'best_fit'
+        rest_time = self.rest_time
+        minute_scan = self.minute_scan
+        stats = self.stats
+        objective = self.objective
+        nogoods = self.nogoods
+        group_twins = self.group_twins if self.symmetry else None
+        court_twins = self.court_twins
+        book = self._book_cells if objective == 'court_hours' else self._book
+        unbook = self._unbook_cells if objective == 'court_hours' else self._unbook
+        node_limit = self.node_limit
+        deadline = None if self.time_limit is None else started + self.time_limit
+        should_stop = self.should_stop
+        progress = self.progress
+        hooks = self.hooks
+        # frames[:depth] is the stack, frames above it wait to be reused
+        frames: list[_Frame] = []
+        depth = 0
+        idx = 0
+        stage = 0
+        while True:
+            stats.nodes += 1
+            if progress is not None and stats.nodes % 256 == 0:
+                # groups before idx in the order are placed
+                progress(stats.nodes, idx)
+            if (
+                node_limit is not None and stats.nodes > node_limit
+                # asking the clock on every node is too slow
+                or stats.nodes % 256 == 0 and (
+                    deadline is not None and monotonic() > deadline
+                    or should_stop is not None and should_stop()
+                )
+            ):
+                self._keep_best(frames, depth)
+                stats.out_of_budget = True
+                # frames are only added on the way down, never dropped
+                stats.max_depth = len(frames)
+                return None
+            if idx >= len(order) or objective is not None and not self._may_improve(idx, stage):
+                if objective is None:
+                    # everyone placed, we got a valid timetable
+                    for frame in reversed(frames[:depth]):
+                        timetable.append(TimetableEntry(
+                            period=TimePeriod(frame.start, frame.end),
+                            group_idx=frame.group_idx, court_idx=frame.court_idx,
+                        ))
+                    stats.max_depth = len(frames)
+                    return None
+                # a timetable, or stages left that can't beat the best one:
+                # undo placements down to the one that has to move and try its next one
+                retry = self._record_incumbent(frames, depth) if idx >= len(order) else depth - 1
+                if retry < 0:
+                    stats.max_depth = len(frames)
                     return None
+                while depth > retry:
+                    frame = frames[depth - 1]
+                    next_available[frame.group_idx] = frame.prev_next_available
+                    if frame.twin >= 0:
+                        next_available[frame.twin] = frame.prev_twin_available
+                    unbook(frame.court_idx, frame.start, frame.end)
+                    stats.backtracks += 1
+                    stats.unbooks += 1
+                    if hooks is not None:
+                        hooks.undo(frame.group_idx, frame.stage, frame.court_idx, frame.start, frame.end)
+                    depth -= 1
+                depth += 1
+                frame = frames[depth - 1]
+                if frame.start > frame.latest_start:
+                    # the bound moved below this start, other courts at it won't do either
+                    frame.court_pos = len(frame.courts)
+            else:
+                group_idx = order[idx]
+                flat = stage_offsets[group_idx] + stage
+                if depth == len(frames):
+                    frames.append(_Frame())
+                frame = frames[depth]
+                depth += 1
+                frame.position = idx
+                frame.group_idx = group_idx
+                frame.stage = stage
+                frame.duration = stage_durations[flat]
+                frame.latest_start = stage_latest[flat]
+                frame.has_next = stage_has_next[flat]
+                # no start yet, no courts left at it
+                frame.court_pos = len(frame.courts)
+                frame.conflicts = None
+                known = self._known_failure(flat) if nogoods and flat in nogoods else None
+                if known is None:
+                    frame.next_start = next_available[group_idx]
+                else:
+                    # the stage failed like this before, the same groups are blocked in the same windows
+                    frame.next_start = None
+                    frame.conflicts = known
+
+            # find the next placement for the frame on top, backtracking while there is none
+            while True:
+                courts = frame.courts
+                court_pos = frame.court_pos
+                while court_pos < len(courts):
+                    court_idx = courts[court_pos]
+                    court_pos += 1
+                    if minute_scan:
+                        stats.probes += 1
+                    stats.books += 1
+                    if book(court_idx, frame.start, frame.end):
+                        frame.court_pos = court_pos
+                        break
+                else:
+                    # a later start would leave no time for the next stages of the group
+                    if self._next_start(frame) and frame.start <= frame.latest_start:
+                        if best_fit:
+                            self._best_fit_first(courts, frame.start)
+                        if court_twins:
+                            self._distinct_courts(courts)
+                        continue
+
+                    # nothing found, the group is blocked from where it may start
+                    # up to its limit, rest after the previous stage may already
+                    # push it out of the window, groups that failed above and came
+                    # back here were blocked in their windows too
+                    fail_idx = frame.group_idx
+                    fail_start = next_available[fail_idx]
+                    windows = frame.conflicts or {}
+                    _merge_windows(windows, {fail_idx: (fail_start, max(limit_ends[fail_idx], fail_start + 1))})
+                    # timetables and bounds below were dead ends too, the failed groups
+                    # alone don't tell which placements may be skipped
+                    chronological = objective is not None and self.incumbent is not None
+                    depth -= 1
+                    self._keep_best(frames, depth)
+                    failed_at = depth
+                    while depth > 0:
+                        frame = frames[depth - 1]
+                        group_idx = frame.group_idx
+                        next_available[group_idx] = frame.prev_next_available
+                        if frame.twin >= 0:
+                            next_available[frame.twin] = frame.prev_twin_available
+                        unbook(frame.court_idx, frame.start, frame.end)
+                        stats.backtracks += 1
+                        stats.unbooks += 1
+                        if hooks is not None:
+                            hooks.undo(group_idx, frame.stage, frame.court_idx, frame.start, frame.end)
+                        if chronological:
+                            break
+                        blocking = False
+                        for window_idx, (start, end) in windows.items():
+                            if window_idx != group_idx and frame.end >= start and frame.start < end:
+                                blocking = True
+                                break
+                        if blocking:
+                            # booked within the window of a failed group, try other values
+                            break
+                        if group_idx in windows:
+                            # we are blocking ourselves, can't solve this by moving forward
+                            # someone else down the stack has to move, and what failed
+                            # above the earlier placements of this stage has to move as well
+                            fail_start = next_available[group_idx]
+                            _merge_windows(windows, {group_idx: (fail_start, max(limit_ends[group_idx], fail_start + 1))})
+                            if frame.conflicts:
+                                _merge_windows(windows, frame.conflicts)
+                        # otherwise we are not the ones blocking, skip to the last group that booked
+                        # a relevant period
+                        depth -= 1
+                    else:
+                        stats.max_depth = len(frames)
+                        return TimetableEntry(
+                            period=TimePeriod(*windows[fail_idx]), group_idx=fail_idx, court_idx=0
+                        )
+                    if not chronological:
+                        # the failures stay with the frame until it runs out of placements
+                        if frame.conflicts is None:
+                            frame.conflicts = windows
+                        else:
+                            _merge_windows(frame.conflicts, windows)
+                        if self.nogood_limit > 0:
+                            self._learn(frames[depth], windows, frame)
+                    distance = failed_at - depth + 1
+                    stats.jumps[distance] = stats.jumps.get(distance, 0) + 1
+                    if hooks is not None and distance > 1:
+                        hooks.backjump(fail_idx, distance)
+                    continue
+                break
+
+            group_idx = frame.group_idx
+            frame.court_idx = court_idx
+            if hooks is not None:
+                hooks.place(group_idx, frame.stage, court_idx, frame.start, frame.end)
+            frame.prev_next_available = next_available[group_idx]
+            next_available[group_idx] = frame.end + rest_time
+            frame.twin = -1 if group_twins is None or frame.stage else group_twins[group_idx]
+            if frame.twin >= 0:
+                # the identical group starts here at the earliest, the other way round is the same timetable
+                frame.prev_twin_available = next_available[frame.twin]
+                next_available[frame.twin] = max(frame.prev_twin_available, frame.start)
+            if not frame.has_next:
+                idx = frame.position + 1
+                stage = 0
+            else:
+                # the next stage of the same group goes right above
+                idx = frame.position
+                stage = frame.stage + 1
+
+# (group order, court order, seed) of portfolio workers, the first ones are tried
+# without shuffling, the rest shuffle groups with seeds 1, 2, ...
+PORTFOLIO_ORDERS = [
+    ('tightest', 'index'),
+    ('rows', 'index'),
+    ('tightest', 'best_fit'),
+    ('longest', 'index'),
+    ('rows', 'best_fit'),
+    ('longest', 'best_fit'),
+]
+
+# portfolios running at once at most, each has a stop flag shared with all workers
+PORTFOLIO_SLOTS = 64
+# workers of solve_portfolio are spawned by the first portfolio and kept for the next ones,
+# starting one and importing this module takes most of a second
+_portfolio_pool: ProcessPoolExecutor | None = None
+_portfolio_pool_workers = 0
+# workers asked for by portfolios running now, the pool grows to fit all of them,
+# workers left to stop after a portfolio returned are busy for a few more nodes at most
+_portfolio_busy = 0
+# stop flags by slot, a slot is free again once no worker of its portfolio runs
+_portfolio_stops: Any = None
+_portfolio_free: list[int] = []
+# portfolios are started from several threads of the api
+_portfolio_lock = threading.Condition()
+
+
+def _pack_input(
+    groups: list[Group],
+    courts: list[Court],
+    rest_time: int,
+    evaluate_time: int,
+    stage_limits: list[int],
+    activity_durations: dict[str, float],
+) -> tuple:
+    """plain lists and int arrays, much cheaper to pickle than Group and Court objects"""
+    activities = list(activity_durations)
+    return (
+        [group.name for group in groups],
+        array('i', [group.count for group in groups]),
+        # groups with an activity that isn't known fail the same way in every worker
+        [group.activity for group in groups],
+        array('i', [group.limit.start for group in groups]),
+        array('i', [group.limit.end for group in groups]),
+        [court.name for court in courts],
+        [court.starts for court in courts],
+        [court.ends for court in courts],
+        rest_time,
+        evaluate_time,
+        list(stage_limits),
+        activities,
+        [activity_durations[activity] for activity in activities],
+    )
+
+
+def _unpack_input(
+    packed: tuple,
+) -> tuple[list[Group], list[Court], int, int, list[int], dict[str, float]]:
+    """groups, courts, rest time, evaluate time, stage limits and activity durations"""
+    (
+        group_names, counts, group_activities, limit_starts, limit_ends,
+        court_names, court_starts, court_ends,
+        rest_time, evaluate_time, stage_limits, activities, durations,
+    ) = packed
+    groups = [
+        Group(name, count, activity, TimePeriod(start, end))
+        for name, count, activity, start, end
+        in zip(group_names, counts, group_activities, limit_starts, limit_ends)
+    ]
+    courts = [
+        Court(name, [TimePeriod(start, end) for start, end in zip(starts, ends)])
+        for name, starts, ends in zip(court_names, court_starts, court_ends)
+    ]
+    return groups, courts, rest_time, evaluate_time, stage_limits, dict(zip(activities, durations))
+
+
+def _portfolio_init(stops: Any) -> None:
+    global _portfolio_stops
+    _portfolio_stops = stops
+
+
+def _portfolio_run(
+    packed: tuple,
+    slot: int,
+    group_order: str,
+    court_order: str,
+    seed: int | None,
+    time_limit: float | None,
+    node_limit: int | None,
+    grid: int,
+    compact: bool,
+    objective: str | None,
+    nogood_limit: int,
+    symmetry: bool,
+) -> tuple | None:
+    """runs in a worker until the stop flag of slot is set, returns solution and stats as plain tuples"""
+    stops = _portfolio_stops
+    solver = Solver(
+        *_unpack_input(packed),
+        group_order=group_order, court_order=court_order, seed=seed,
+        time_limit=time_limit, node_limit=node_limit, should_stop=lambda: stops[slot] != 0,
+        grid=grid, compact=compact, objective=objective, nogood_limit=nogood_limit, symmetry=symmetry,
+    )
+    solution = solver.solve()
+    if solution is None:
+        return None
+    return (
+        [(entry.group_idx, entry.court_idx, entry.period.start, entry.period.end) for entry in solution.timetable],
+        solution.placed,
+        solution.unplaced,
+        solution.complete,
+        solver.stats.as_tuple(),
+    )
+
+
+def _portfolio_better(result: tuple, best: tuple) -> bool:
+    """full timetables beat partial ones, then lower objective, then more placed stages"""
+    if result[3] != best[3]:
+        return result[3]
+    objective = SearchStats.from_tuple(result[4]).objective
+    best_objective = SearchStats.from_tuple(best[4]).objective
+    if objective is not None and best_objective is not None and objective != best_objective:
+        return objective < best_objective
+    return len(result[0]) > len(best[0])
+
+
+def _portfolio_start(workers: int, tasks: list[tuple]) -> tuple[ProcessPoolExecutor, int, set[Future]]:
+    """
+    submits _portfolio_run for every task to the shared pool, grown to fit workers more
+    than running portfolios use, with a free stop slot, waits for one when all are taken
+    returns the pool, the slot and the futures
+    """
+    global _portfolio_pool, _portfolio_pool_workers, _portfolio_busy, _portfolio_stops
+    with _portfolio_lock:
+        context = multiprocessing.get_context('spawn')
+        if _portfolio_stops is None:
+            _portfolio_stops = context.RawArray('b', PORTFOLIO_SLOTS)
+            _portfolio_free.extend(range(PORTFOLIO_SLOTS))
+            # a process started by multiprocessing, like a job worker of the api, joins its children
+            # when it exits, before atexit would shut the pool down, so it has to be done earlier,
+            # and before the finalizers of the pool's queues, priority 10, close them
+            multiprocessing.util.Finalize(None, _portfolio_close, exitpriority=100)
+        while not _portfolio_free:
+            _portfolio_lock.wait()
+        slot = _portfolio_free.pop()
+        _portfolio_stops[slot] = 0
+        _portfolio_busy += workers
+        retried = False
+        while True:
+            if _portfolio_pool is None or _portfolio_pool_workers < _portfolio_busy:
+                if _portfolio_pool is not None:
+                    # workers of the old pool finish the tasks they have and exit
+                    _portfolio_pool.shutdown(wait=False)
+                _portfolio_pool = ProcessPoolExecutor(
+                    max_workers=_portfolio_busy, mp_context=context,
+                    initializer=_portfolio_init, initargs=(_portfolio_stops,),
+                )
+                _portfolio_pool_workers = _portfolio_busy
+            pool = _portfolio_pool
+            try:
+                # under the lock, so that no other portfolio replaces the pool in between
+                return pool, slot, {pool.submit(_portfolio_run, task[0], slot, *task[1:]) for task in tasks}
+            except BrokenProcessPool:
+                # a worker died since the last portfolio, try once more with new ones
+                _portfolio_pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+                if retried:
+                    _portfolio_busy -= workers
+                    _portfolio_free.append(slot)
+                    raise
+                retried = True
+
+
+def _portfolio_done(workers: int) -> None:
+    global _portfolio_busy
+    with _portfolio_lock:
+        _portfolio_busy -= workers
+
+
+def _portfolio_release(slot: int) -> None:
+    with _portfolio_lock:
+        _portfolio_free.append(slot)
+        _portfolio_lock.notify()
+
+
+def _portfolio_close() -> None:
+    """stops the workers, the next portfolio spawns new ones"""
+    global _portfolio_pool
+    with _portfolio_lock:
+        pool = _portfolio_pool
+        _portfolio_pool = None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _portfolio_reset(pool: ProcessPoolExecutor) -> None:
+    """drops the pool after a worker died, the next portfolio spawns a new one"""
+    global _portfolio_pool
+    with _portfolio_lock:
+        if _portfolio_pool is pool:
+            _portfolio_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def solve_portfolio(
+    groups: list[Group],
+    courts: list[Court],
+    rest_time: int,
+    evaluate_time: int,
+    stage_limits: list[int],
+    activity_durations: dict[str, float],
+    workers: int,
+    time_limit: float | None = None,
+    node_limit: int | None = None,
+    should_stop: Callable[[], bool] | None = None,
+    grid: int = 1,
+    compact: bool = False,
+    objective: str | None = None,
+    nogood_limit: int = 0,
+    symmetry: bool = True,
+) -> tuple[Solution, SearchStats] | None:
+    """
+    searches with differently ordered solvers in worker processes,
+    the first full timetable wins and stops the others,
+    with an objective every worker searches until its budget is out or its timetable
+    is shown optimal, which stops the others, the full timetable with the best objective wins
+    if none is found returns the largest partial one with stats of its search,
+    None as soon as a worker proves there is no timetable, which stops the others
+    workers are spawned, not forked, so they don't inherit locks held by other threads of the caller,
+    and are kept for the next portfolio, see _portfolio_start
+    raises InfeasibleInputError if propagation proves there is none
+    """
+    configs: list[tuple[str, str, int | None]] = []
+    for worker in range(0, workers):
+        if worker < len(PORTFOLIO_ORDERS):
+            configs.append((*PORTFOLIO_ORDERS[worker], None))
+        else:
+            # shuffled groups, ordered the same ways as the first workers
+            group_order, court_order = PORTFOLIO_ORDERS[worker % len(PORTFOLIO_ORDERS)]
+            configs.append((group_order, court_order, worker - len(PORTFOLIO_ORDERS) + 1))
+
+    packed = _pack_input(groups, courts, rest_time, evaluate_time, stage_limits, activity_durations)
+    pool, slot, pending = _portfolio_start(workers, [
+        (packed, group_order, court_order, seed, time_limit, node_limit, grid, compact, objective, nogood_limit, symmetry)
+        for group_order, court_order, seed in configs
+    ])
+    stops = _portfolio_stops
+    left = len(pending)
+
+    def finished(_: Future) -> None:
+        nonlocal left
+        with _portfolio_lock:
+            left -= 1
+            if left:
+                return
+        # no worker looks at the flag any more, the slot may go to another portfolio
+        _portfolio_release(slot)
+
+    for future in pending:
+        future.add_done_callback(finished)
+
+    best: tuple | None = None
+    infeasible = False
+    try:
+        while pending:
+            done, pending = wait(
+                pending, timeout=None if should_stop is None else 0.25, return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    _portfolio_reset(pool)
+                    raise
+                if result is None:
+                    # the whole search space is exhausted, the other orders can't do better
+                    infeasible = True
+                elif best is None or _portfolio_better(result, best):
+                    best = result
+            if infeasible:
+                break
+            if best is not None and best[3] and (
+                objective is None or SearchStats.from_tuple(best[4]).optimal
+            ):
+                break
+            if should_stop is not None and should_stop():
+                # workers stop as out of budget and still return their best partial timetables
+                stops[slot] = 1
+    finally:
+        # running workers see it on their next clock check
+        stops[slot] = 1
+        for future in pending:
+            future.cancel()
+        _portfolio_done(workers)
+
+    if infeasible or best is None:
+        return None
+    timetable, placed, unplaced, complete, stats_values = best
+    stats = SearchStats.from_tuple(stats_values)
+    solution = Solution(
+        timetable=[
+            TimetableEntry(period=TimePeriod(start, end), group_idx=group_idx, court_idx=court_idx)
+            for group_idx, court_idx, start, end in timetable
+        ],
+        placed=placed,
+        unplaced=unplaced,
+        complete=complete,
+    )
+    return solution, stats
+
+
+class InputInfo(NamedTuple):
+    activity_durations: dict[str, float]
+    courts: list[Court]
+    groups: list[Group]
+    stage_limits: list[int]
 
-                group.count = prev_count
-                group.next_available = prev_next_available
-                court.unbook_period(booked_period)
-                if result.group_idx == idx:
-                    # we are blocking ourselves, can't solve this by moving forward
-                    # someone else up the stack has to move
-                    return fail_result
-                elif (
-                    booked_period.end < result.period.start
-                    or booked_period.start >= result.period.end
-                ):
-                    # we are not the ones blocking, skip to the last group that booked
-                    # a relevant period
-                    return result
-                # otherwise, try other values
-        # nothing found
-        return fail_result
-
-
-def generate_schedule(args: dict) -> dict[str, Any] | None:
+
+# seconds generate_schedule searches before returning the best partial timetable
+DEFAULT_TIME_LIMIT = 30.0
+# group order of generate_schedule without 'groupOrder', input order backtracks for minutes on dense days
+DEFAULT_GROUP_ORDER = 'tightest'
+# functions in the profile report of generate_schedule
+PROFILE_LINES = 30
+
+
+def generate_schedule(
+    args: dict,
+    should_stop: Callable[[], bool] | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> dict[str, Any] | None:
+    """
+    with 'deltas' in args applies them to the input in order, see apply_delta,
+    with 'timetable' as well, slots returned for the input before the last delta,
+    keeps them where it can and lists groups whose slots differ in 'changedGroups'
+    should_stop and progress are passed to Solver, a portfolio only asks should_stop
+    with 'profile' in options the search runs under cProfile, the report goes to stats,
+    a portfolio is profiled in this process only, where it mostly waits for the workers
+    'slotMinutes' in args is the grid stages start on, see Solver, with 'coarseToFine' in options
+    the timetable found on it is compacted at minute resolution; if the grid leaves no room
+    for a timetable the search is repeated minute by minute
+    'objective' in options is one of OBJECTIVES, search goes on for better timetables until
+    the time limit and reports the best objective with its lower bound in stats,
+    the previous timetable with 'timetable' is repaired without it
+    'nogoods' in options turns on remembering dead ends, true for NOGOOD_LIMIT stages or a number,
+    'symmetry' false in options tries identical groups and courts in every order, see Solver
+    """
     OPTIONS_KEY = 'options'
     LAST_UPLOAD_KEY = 'lastUploadPath'
+    # sha256 of the file if the caller already knows it, saves reading the file again
+    LAST_UPLOAD_DIGEST_KEY = 'lastUploadDigest'
+    GROUP_ORDER_KEY = 'groupOrder'
+    COURT_ORDER_KEY = 'courtOrder'
+    COURT_INDEX_KEY = 'courtIndex'
+    TIME_LIMIT_KEY = 'timeLimit'
+    NODE_LIMIT_KEY = 'nodeLimit'
+    PORTFOLIO_KEY = 'portfolio'
     WINDOW_KEY = 'window'
     DATE_KEY = 'date'
+    DELTAS_KEY = 'deltas'
+    TIMETABLE_KEY = 'timetable'
+    PROFILE_KEY = 'profile'
+    SLOT_MINUTES_KEY = 'slotMinutes'
+    COARSE_TO_FINE_KEY = 'coarseToFine'
+    OBJECTIVE_KEY = 'objective'
+    NOGOODS_KEY = 'nogoods'
+    SYMMETRY_KEY = 'symmetry'
 
     if OPTIONS_KEY not in args or not isinstance(args[OPTIONS_KEY], dict):
         return None
@@ -242,62 +2102,578 @@ def generate_schedule(args: dict) -> dict[str, Any] | None:
         return None
 
     date = window[DATE_KEY]
-    rest_time = int(args.get('restTime', 0))
-    evaluate_time = int(args.get('evaluateTime', 0))
+    with _reading('options'):
+        rest_time = int(args.get('restTime', 0))
+        evaluate_time = int(args.get('evaluateTime', 0))
+
+        time_limit = float(options.get(TIME_LIMIT_KEY, DEFAULT_TIME_LIMIT))
+        node_limit = None if options.get(NODE_LIMIT_KEY) is None else int(options[NODE_LIMIT_KEY])
+        workers = int(options.get(PORTFOLIO_KEY, 0))
+        grid = max(1, int(args.get(SLOT_MINUTES_KEY) or 1))
+        nogoods = options.get(NOGOODS_KEY)
+        nogood_limit = NOGOOD_LIMIT if nogoods is True else int(nogoods or 0)
+    compact = bool(options.get(COARSE_TO_FINE_KEY))
+    objective = options.get(OBJECTIVE_KEY) or None
+    symmetry = options.get(SYMMETRY_KEY) is not False
+
+    started = monotonic()
+    info = load_input(options[LAST_UPLOAD_KEY], options.get(LAST_UPLOAD_DIGEST_KEY))
+    deltas = args.get(DELTAS_KEY) or []
+    for number, delta in enumerate(deltas, 1):
+        with _reading(f'delta {number}'):
+            info = apply_delta(info, delta)
+    parse_seconds = monotonic() - started
 
-    info = parse_excel(options[LAST_UPLOAD_KEY])
-    planner = Solver(info.groups, info.courts, rest_time, evaluate_time, info.stage_limits, info.activity_durations)
+    started = monotonic()
+    profiler = cProfile.Profile() if options.get(PROFILE_KEY) else None
+    if profiler is not None:
+        profiler.enable()
 
-    timetable = planner.find_timetable()
-    if timetable is None:
+    previous: list[tuple[str, str, int, int]] | None = None
+    if isinstance(args.get(TIMETABLE_KEY), list):
+        with _reading('timetable'):
+            previous = [
+                (str(slot['groupId']), str(slot['courtId']), _to_minutes(slot['start']), _to_minutes(slot['end']))
+                for slot in args[TIMETABLE_KEY]
+            ]
+    changed = {edit['name'] for edit in deltas[-1].get('addGroups', []) + deltas[-1].get('modifyGroups', [])} if deltas else set()
+
+    def time_left() -> float:
+        """a search after one that found nothing gets only what is left of the time limit"""
+        return max(0.0, time_limit - (monotonic() - started))
+
+    def search(grid: int) -> tuple[tuple[Solution, SearchStats] | None, bool]:
+        """timetable with stats or None, and whether it is the previous one repaired"""
+        if previous is not None:
+            found = repair_timetable(
+                info, previous, changed, rest_time, evaluate_time,
+                time_limit=time_left(), node_limit=node_limit, grid=grid, compact=compact,
+            )
+            if found is not None:
+                return found, True
+        if workers > 1:
+            return solve_portfolio(
+                info.groups, info.courts, rest_time, evaluate_time, info.stage_limits, info.activity_durations,
+                workers, time_limit=time_left(), node_limit=node_limit, should_stop=should_stop,
+                grid=grid, compact=compact, objective=objective, nogood_limit=nogood_limit, symmetry=symmetry,
+            ), False
+        planner = Solver(
+            info.groups, info.courts, rest_time, evaluate_time, info.stage_limits, info.activity_durations,
+            group_order=options.get(GROUP_ORDER_KEY, DEFAULT_GROUP_ORDER),
+            court_order=options.get(COURT_ORDER_KEY, 'index'),
+            court_index=options.get(COURT_INDEX_KEY, 'tree'),
+            time_limit=time_left(),
+            node_limit=node_limit,
+            should_stop=should_stop,
+            progress=progress,
+            grid=grid,
+            compact=compact,
+            objective=objective,
+            nogood_limit=nogood_limit,
+            symmetry=symmetry,
+        )
+        solution = planner.solve()
+        return (None if solution is None else (solution, planner.stats)), False
+
+    found: tuple[Solution, SearchStats] | None = None
+    repaired = False
+    if grid > 1:
+        # a grid search books copies of courts, info stays as loaded for the search by minutes
+        try:
+            found, repaired = search(grid)
+        except InfeasibleInputError:
+            pass
+        if found is None:
+            grid = 1
+    if found is None:
+        found, repaired = search(grid)
+    if profiler is not None:
+        profiler.disable()
+    solve_seconds = monotonic() - started
+    if found is None:
         return None
+    solution, stats = found
 
-    result: dict[str, Any] = {'date': date, 'slots': []}
-    for slot in timetable:
+    started = monotonic()
+
+    result: dict[str, Any] = {
+        'date': date,
+        'slots': [],
+        'complete': solution.complete,
+        'placedGroups': [info.groups[idx].name for idx in solution.placed],
+        'unplacedGroups': [info.groups[idx].name for idx in solution.unplaced],
+        'stats': {
+            'nodes': stats.nodes,
+            'backtracks': stats.backtracks,
+            'seconds': round(stats.seconds, 3),
+            'probes': stats.probes,
+            'books': stats.books,
+            'unbooks': stats.unbooks,
+            'maxDepth': stats.max_depth,
+            # keys are numbers of placements undone at once, as strings for json
+            'jumps': {str(distance): count for distance, count in sorted(stats.jumps.items())},
+            'twinGroups': stats.twin_groups,
+            'twinCourts': stats.twin_courts,
+            'parseSeconds': round(parse_seconds, 3),
+            'solveSeconds': round(solve_seconds, 3),
+            # 1 if the grid left no room and the timetable is found minute by minute
+            'slotMinutes': grid,
+        },
+    }
+    for slot in solution.timetable:
         result['slots'].append({
             'start': str(timedelta(minutes=slot.period.start)),
             'end': str(timedelta(minutes=slot.period.end)),
-            'courtId': planner.courts[slot.court_idx].name,
-            'groupId': planner.groups[slot.group_idx].name,
-            'item': planner.groups[slot.group_idx].activity,
+            'courtId': info.courts[slot.court_idx].name,
+            'groupId': info.groups[slot.group_idx].name,
+            'item': info.groups[slot.group_idx].activity,
             'judge': '',
             'comment': ''
         })
+
+    if stats.objective is not None:
+        result['stats']['objective'] = objective
+        # minutes from the first court opening to the end of the last stage, or court hours
+        result['stats']['objectiveValue'] = stats.objective
+        result['stats']['objectiveBound'] = stats.bound
+        # share of the value the optimum may still be below it
+        result['stats']['gap'] = round((stats.objective - stats.bound) / stats.objective, 4) if stats.objective else 0.0
+        result['stats']['optimal'] = stats.optimal
+        result['stats']['solutions'] = stats.solutions
+    if nogood_limit > 0:
+        result['stats']['nogoods'] = stats.nogoods
+        result['stats']['nogoodChecks'] = stats.nogood_checks
+        result['stats']['nogoodHits'] = stats.nogood_hits
+        # share of checks that cut a subtree
+        result['stats']['nogoodHitRate'] = round(stats.nogood_hits / stats.nogood_checks, 4) if stats.nogood_checks else 0.0
+    if previous is not None:
+        result['stats']['repaired'] = repaired
+        before: dict[str, set[tuple[str, int, int]]] = {}
+        for group_name, court_name, start, end in previous:
+            before.setdefault(group_name, set()).add((court_name, start, end))
+        after: dict[str, set[tuple[str, int, int]]] = {}
+        for slot in solution.timetable:
+            after.setdefault(info.groups[slot.group_idx].name, set()).add(
+                (info.courts[slot.court_idx].name, slot.period.start, slot.period.end))
+        # removed groups lose their slots, they count as changed too
+        names = [group.name for group in info.groups]
+        names.extend(name for name in before if name not in after and name not in names)
+        result['changedGroups'] = [name for name in names if before.get(name) != after.get(name)]
+    result['stats']['serializeSeconds'] = round(monotonic() - started, 3)
+    if profiler is not None:
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        result['stats']['profile'] = report.getvalue()
     return result
 
-class InputInfo(NamedTuple):
-    activity_durations: dict[str, float]
-    courts: list[Court]
-    groups: list[Group]
-    stage_limits: list[int]
 
+def apply_delta(info: InputInfo, delta: dict[str, Any]) -> InputInfo:
+    """
+    returns a copy of info with edits of delta, applied in this order:
+    'closeCourts' and 'openCourts', lists of {'court', 'start', 'end'}, take the period
+    from the court's free time or add it there, opening creates courts that aren't there yet;
+    'removeGroups', list of names; 'modifyGroups', {'name'} with any of 'count', 'activity',
+    'minStart', 'maxEnd'; 'addGroups', {'name', 'count', 'activity'} with optional limits
+    times are read as in input files, raises InputError for unknown or duplicate names
+    """
+    courts: dict[str, Court] = {court.name: Court(court.name, court.time_available) for court in info.courts}
+    for window in delta.get('closeCourts', []):
+        court = courts.get(window['court'])
+        if court is None:
+            raise InputError(f"no court '{window['court']}' to close")
+        start = _to_minutes(window['start'])
+        end = _to_minutes(window['end'], round_up=True)
+        # every free period overlapping the closed one loses the overlap
+        overlaps = [
+            (max(free_start, start), min(free_end, end))
+            for free_start, free_end in zip(court.starts, court.ends)
+            if free_start < end and free_end > start
+        ]
+        for overlap_start, overlap_end in overlaps:
+            court.book(overlap_start, overlap_end)
+    for window in delta.get('openCourts', []):
+        start = _to_minutes(window['start'], round_up=True)
+        end = _to_minutes(window['end'])
+        if start >= end:
+            raise InputError(f"court '{window['court']}' can't open at {window['start']} until {window['end']}")
+        if window['court'] in courts:
+            courts[window['court']].unbook(start, end)
+        else:
+            courts[window['court']] = Court(window['court'], [TimePeriod(start, end)])
+
+    # dicts keep the order, modified groups stay where they were
+    groups: dict[str, Group] = {group.name: group for group in info.groups}
+    for name in delta.get('removeGroups', []):
+        if name not in groups:
+            raise InputError(f"no group '{name}' to remove")
+        del groups[name]
+    for edit in delta.get('modifyGroups', []):
+        group = groups.get(edit['name'])
+        if group is None:
+            raise InputError(f"no group '{edit['name']}' to modify")
+        groups[group.name] = Group(
+            group.name,
+            group.count if edit.get('count') is None else _to_int(edit['count']),
+            group.activity if edit.get('activity') is None else str(edit['activity']),
+            TimePeriod(
+                group.limit.start if edit.get('minStart') is None else _to_minutes(edit['minStart']),
+                group.limit.end if edit.get('maxEnd') is None else _to_minutes(edit['maxEnd']),
+            ),
+        )
+    # groups without limits may use any time courts are open, as in input files
+    min_start = min((court.starts[0] for court in courts.values() if court.starts), default=0)
+    max_end = max((court.ends[-1] for court in courts.values() if court.ends), default=0)
+    for edit in delta.get('addGroups', []):
+        if edit['name'] in groups:
+            raise InputError(f"group '{edit['name']}' is already there")
+        groups[edit['name']] = Group(
+            str(edit['name']),
+            _to_int(edit['count']),
+            str(edit['activity']),
+            TimePeriod(
+                min_start if edit.get('minStart') is None else _to_minutes(edit['minStart']),
+                max_end if edit.get('maxEnd') is None else _to_minutes(edit['maxEnd']),
+            ),
+        )
+
+    return InputInfo(
+        groups=list(groups.values()),
+        courts=list(courts.values()),
+        activity_durations=info.activity_durations,
+        stage_limits=info.stage_limits,
+    )
+
+
+def repair_timetable(
+    info: InputInfo,
+    previous: list[tuple[str, str, int, int]],
+    changed: set[str],
+    rest_time: int,
+    evaluate_time: int,
+    time_limit: float | None = None,
+    node_limit: int | None = None,
+    grid: int = 1,
+    compact: bool = False,
+) -> tuple[Solution, SearchStats] | None:
+    """
+    previous is (group name, court name, start, end) of slots of a timetable for an earlier version of info,
+    books slots of groups that aren't in changed and still fit where they were,
+    then searches places for the other groups only, around those slots
+    returns None if that finds no full timetable, the caller may solve from scratch then
+    """
+    group_indices = {group.name: idx for idx, group in enumerate(info.groups)}
+    court_indices = {court.name: idx for idx, court in enumerate(info.courts)}
+    # booked here, input courts stay free
+    courts = [Court(court.name, court.time_available) for court in info.courts]
+
+    slots: dict[int, list[TimetableEntry]] = {}
+    for group_name, court_name, start, end in previous:
+        if group_name in group_indices and group_name not in changed and court_name in court_indices:
+            slots.setdefault(group_indices[group_name], []).append(TimetableEntry(
+                period=TimePeriod(start, end),
+                group_idx=group_indices[group_name], court_idx=court_indices[court_name],
+            ))
+    kept: list[TimetableEntry] = []
+    for entries in slots.values():
+        booked = 0
+        while booked < len(entries) and courts[entries[booked].court_idx].book_period(entries[booked].period):
+            booked += 1
+        if booked == len(entries):
+            kept.extend(entries)
+            continue
+        # a slot of the group is gone, say with a closed court, all of them are placed anew
+        for entry in entries[:booked]:
+            courts[entry.court_idx].unbook_period(entry.period)
+
+    placed = {entry.group_idx for entry in kept}
+    rest = [idx for idx in range(0, len(info.groups)) if idx not in placed]
+    stats = SearchStats()
+    timetable = list(kept)
+    if rest:
+        solver = Solver(
+            [info.groups[idx] for idx in rest], courts, rest_time, evaluate_time,
+            info.stage_limits, info.activity_durations,
+            group_order='tightest', time_limit=time_limit, node_limit=node_limit, grid=grid, compact=compact,
+        )
+        try:
+            solution = solver.solve()
+        except InfeasibleInputError:
+            # kept slots may take time the rest needs
+            return None
+        if solution is None or not solution.complete:
+            return None
+        stats = solver.stats
+        timetable.extend(
+            TimetableEntry(period=entry.period, group_idx=rest[entry.group_idx], court_idx=entry.court_idx)
+            for entry in solution.timetable
+        )
+
+    timetable.sort(key=lambda entry: (entry.period.start, entry.court_idx))
+    return Solution(
+        timetable=timetable,
+        placed=list(range(0, len(info.groups))),
+        unplaced=[],
+        complete=True,
+    ), stats
 
-def parse_excel(path: str) -> InputInfo:
-    books = pd.read_excel(path, sheet_name=None)
 
-    activity_durations: dict[str, float] = { str(getattr(row, 'Название')): int(getattr(row, 'Длительность')) for row in books['Упражнения'].itertuples() }
-    stage_limits: list[int] = [ int(getattr(row[1], 'МаксимумУчастников')) for row in books['Этапы'].iterrows() ]
+# columns read from every sheet of the input, in the order rows are yielded
+INPUT_SHEETS: dict[str, tuple[str, ...]] = {
+    'Упражнения': ('Название', 'Длительность'),
+    'Этапы': ('МаксимумУчастников',),
+    'Корты': ('Корт', 'Открытие', 'Закрытие'),
+    'Группы': ('ИмяГруппы', 'КоличествоУчастников', 'Упражнение', 'МинимальноеВремяНачала', 'МаксимальноеВремяОкончания'),
+}
+# columns that may be missing or left empty
+OPTIONAL_COLUMNS = ('МинимальноеВремяНачала', 'МаксимальноеВремяОкончания')
 
-    min_start: float = inf
-    max_end: int = 0
+# day zero of excel dates, times after 24:00 are read as datetimes since it
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or isinstance(value, str) and value.strip() == ''
+
+
+def _to_int(value: Any) -> int:
+    if isinstance(value, str):
+        # decimal comma from russian locale
+        return int(float(value.strip().replace(',', '.')))
+    return int(value)
+
+
+def _to_minutes(value: Any, round_up: bool = False) -> int:
+    """
+    numbers are minutes, strings are HH:MM or HH:MM:SS, hours may go past 24,
+    with 'N days, ' before them as str(timedelta) writes them
+    """
+    if isinstance(value, datetime):
+        seconds = (value - _EXCEL_EPOCH).total_seconds()
+    elif isinstance(value, time):
+        seconds = value.hour * 3600 + value.minute * 60 + value.second
+    elif isinstance(value, timedelta):
+        seconds = value.total_seconds()
+    elif isinstance(value, str) and ':' in value:
+        days, _, clock = value.strip().rpartition(',')
+        parts = [int(part) for part in clock.strip().split(':')]
+        if len(parts) not in (2, 3):
+            raise InputError(f"can't read time '{value}', expected HH:MM or HH:MM:SS")
+        seconds = parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) == 3 else 0)
+        if days:
+            seconds += int(days.split()[0]) * 24 * 3600
+    else:
+        return _to_int(value)
+    return ceil(seconds / 60) if round_up else floor(seconds / 60)
+
+
+def _sheet_rows(name: str, rows: Iterator[Sequence[Any]]) -> Iterator[tuple]:
+    """
+    finds the columns of INPUT_SHEETS[name] by the header row, the first one,
+    and yields their values from the rest, None for empty cells, skipping empty rows
+    """
+    header = [None if _is_empty(cell) else str(cell).strip() for cell in next(rows, ())]
+    positions: list[int | None] = []
+    for column in INPUT_SHEETS[name]:
+        if column in header:
+            positions.append(header.index(column))
+        elif column in OPTIONAL_COLUMNS:
+            positions.append(None)
+        else:
+            raise InputError(f"sheet '{name}' has no column '{column}'")
+    for row in rows:
+        values = tuple(
+            None if pos is None or pos >= len(row) or _is_empty(row[pos]) else row[pos]
+            for pos in positions
+        )
+        if any(value is not None for value in values):
+            yield values
+
+
+def _build_input(sheets: Iterable[tuple[str, Iterator[Sequence[Any]]]]) -> InputInfo:
+    """builds solver input from rows of sheets in one pass, sheets may come in any order"""
+    activity_durations: dict[str, float] = {}
+    stage_limits: list[int] = []
     courts_dict: dict[str, list[TimePeriod]] = {}
-    for row in books['Корты'].itertuples():
-        id = str(getattr(row, 'Корт'))
-        start = ceil(pd.to_timedelta(getattr(row, 'Открытие')).total_seconds() / 60)
-        end = int(pd.to_timedelta(getattr(row, 'Закрытие')).total_seconds() / 60)
-        courts_dict.setdefault(id, []).append(TimePeriod(start, end))
-        min_start = min(min_start, start)
-        max_end = max(max_end, end)
-    courts = [Court(name, periods) for name, periods in courts_dict.items()]
+    group_rows: list[tuple] = []
+    seen: set[str] = set()
+    for name, rows in sheets:
+        if name not in INPUT_SHEETS or name in seen:
+            continue
+        seen.add(name)
+        for row in _sheet_rows(name, rows):
+            if name == 'Упражнения':
+                activity_durations[str(row[0])] = _to_int(row[1])
+            elif name == 'Этапы':
+                stage_limits.append(_to_int(row[0]))
+            elif name == 'Корты':
+                start = _to_minutes(row[1], round_up=True)
+                end = _to_minutes(row[2])
+                courts_dict.setdefault(str(row[0]), []).append(TimePeriod(start, end))
+            else:
+                group_rows.append(row)
+    missing = [name for name in INPUT_SHEETS if name not in seen]
+    if missing:
+        raise InputError(f"input has no sheets {missing}")
 
-    books['Группы'] = books['Группы'].fillna({'МинимальноеВремяНачала': int(min_start), 'МаксимальноеВремяОкончания': max_end})
+    courts = [Court(name, periods) for name, periods in courts_dict.items()]
+    # groups without limits may use any time courts are open
+    min_start = min((court.starts[0] for court in courts if court.starts), default=0)
+    max_end = max((court.ends[-1] for court in courts if court.ends), default=0)
     groups: list[Group] = []
-    for row in books['Группы'].itertuples():
-        name = str(getattr(row, 'ИмяГруппы'))
-        count = int(getattr(row, 'КоличествоУчастников'))
-        activity = str(getattr(row, 'Упражнение'))
-        start = int(getattr(row, 'МинимальноеВремяНачала'))
-        end = int(getattr(row, 'МаксимальноеВремяОкончания'))
-        groups.append(Group(name, count, activity, TimePeriod(start, end)))
+    for name, count, activity, start, end in group_rows:
+        groups.append(Group(
+            str(name),
+            _to_int(count),
+            str(activity),
+            TimePeriod(
+                min_start if start is None else _to_minutes(start),
+                max_end if end is None else _to_minutes(end),
+            ),
+        ))
+
+    return InputInfo(groups=groups, courts=courts, activity_durations=activity_durations, stage_limits=stage_limits)
+
+
+def parse_excel(path: str) -> InputInfo:
+    """streams rows of the input sheets, others are not read at all"""
+    try:
+        workbook = load_workbook(path, read_only=True, data_only=True)
+    except (BadZipFile, InvalidFileException, KeyError) as e:
+        # not a zip at all, or a zip without the parts of a workbook
+        raise InputError(f"not an excel workbook: {e}") from e
+    try:
+        return _build_input(
+            (name, workbook[name].iter_rows(values_only=True))
+            for name in INPUT_SHEETS if name in workbook.sheetnames
+        )
+    finally:
+        workbook.close()
+
+
+def parse_csv(path: str) -> InputInfo:
+    """
+    sheets go one after another, each starts with a row holding only its name,
+    cells are separated by commas or semicolons
+    """
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        # csv.Sniffer gets lost on rows of one cell, of which every sheet has a few
+        sample = file.read(64 * 1024)
+        file.seek(0)
+        reader = csv.reader(file, delimiter=';' if sample.count(';') > sample.count(',') else ',')
+        title: str | None = None
+
+        def title_of(row: list[str]) -> str | None:
+            if not row or row[0].strip() not in INPUT_SHEETS or any(cell.strip() for cell in row[1:]):
+                return None
+            return row[0].strip()
+
+        def rows_until_title() -> Iterator[list[str]]:
+            nonlocal title
+            title = None
+            for row in reader:
+                title = title_of(row)
+                if title is not None:
+                    return
+                yield row
+
+        def sheets() -> Iterator[tuple[str, Iterator[Sequence[Any]]]]:
+            # rows before the first sheet name are skipped
+            for _ in rows_until_title():
+                pass
+            while title is not None:
+                rows = rows_until_title()
+                yield title, rows
+                # the sheet may be left unread, the next name is still to be found
+                for _ in rows:
+                    pass
+
+        return _build_input(sheets())
+
+
+def parse_input(path: str) -> InputInfo:
+    """reads .csv files as csv, anything else as an excel workbook, values it can't read raise InputError"""
+    with _reading('input'):
+        if path.lower().endswith('.csv'):
+            return parse_csv(path)
+        return parse_excel(path)
+
+
+# parsed inputs by sha256 of the file, packed as for the portfolio and kept as json, which can't
+# run code when read, so every load gets fresh courts to book and equal files share an entry
+INPUT_CACHE_SIZE = 32
+# next to uploads of the api, Storage.cleanup removes old entries
+INPUT_CACHE_DIR = os.path.join(os.environ.get('PLANNER_DATA_DIR', os.path.join(os.getcwd(), 'planner-data')), 'inputs')
+# bump when parsing or packing changes, entries of other versions are never read
+_INPUT_CACHE_VERSION = 2
+# least recently used first
+_input_cache: OrderedDict[str, bytes] = OrderedDict()
+# the api serves plans from several threads at once
+_input_cache_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _private_dir(path: str) -> bool:
+    """creates path for this user only, False if it is someone else's or others may write to it"""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        status = os.stat(path)
+    except OSError:
+        return False
+    if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+        return False
+    return not status.st_mode & 0o022
+
+
+def load_input(path: str, digest: str | None = None) -> InputInfo:
+    """
+    parse_input through the cache: memory first, then INPUT_CACHE_DIR,
+    parses the file only if neither has it and stores the result in both
+    digest is sha256 of the file, read from it when not given
+    """
+    key = f'{digest or file_digest(path)}-{_INPUT_CACHE_VERSION}'
+    with _input_cache_lock:
+        data = _input_cache.get(key)
+    disk_path = os.path.join(INPUT_CACHE_DIR, f'{key}.json')
+    private = data is None and _private_dir(INPUT_CACHE_DIR)
+    if data is None and private:
+        try:
+            with open(disk_path, 'rb') as file:
+                data = file.read()
+            # cleanup removes the least recently used entries first
+            os.utime(disk_path)
+        except OSError:
+            pass
+    if data is None:
+        info = parse_input(path)
+        packed = _pack_input(info.groups, info.courts, 0, 0, info.stage_limits, info.activity_durations)
+        data = json.dumps([
+            [item.tolist() if isinstance(item, array) else item for item in value] if isinstance(value, list)
+            else value.tolist() if isinstance(value, array) else value
+            for value in packed
+        ], ensure_ascii=False).encode()
+        if private:
+            try:
+                # written aside and renamed, so that readers never see half of it
+                fd, tmp_path = tempfile.mkstemp(dir=INPUT_CACHE_DIR)
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(data)
+                os.replace(tmp_path, disk_path)
+            except OSError:
+                # no disk cache then, memory still has it
+                pass
+
+    with _input_cache_lock:
+        _input_cache[key] = data
+        _input_cache.move_to_end(key)
+        while len(_input_cache) > INPUT_CACHE_SIZE:
+            _input_cache.popitem(last=False)
 
+    groups, courts, _, _, stage_limits, activity_durations = _unpack_input(tuple(json.loads(data)))
     return InputInfo(groups=groups, courts=courts, activity_durations=activity_durations, stage_limits=stage_limits)
@@ -2,6 +2,8 @@ import axios from "axios";
 import type { PlanRequest, PlanResponse } from "./types";
 
 const API_BASE = import.meta.env.VITE_API_BASE ?? "http://localhost:8000";
+// последний загруженный в этой вкладке файл: расписание строится по нему, а не по чужой загрузке
+const UPLOAD_ID_KEY = "planner.uploadId";
 
 export async function health() {
   const { data } = await axios.get(`${API_BASE}/health`);
@@ -14,11 +16,13 @@ export async function uploadFile(file: File) {
   const { data } = await axios.post(`${API_BASE}/upload`, form, {
     headers: { "Content-Type": "multipart/form-data" },
   });
+  sessionStorage.setItem(UPLOAD_ID_KEY, data.uploadId);
   return data as { uploadId: string; filename: string; path: string };
 }
 
 export async function planSchedule(payload: PlanRequest) {
-  const { data } = await axios.post(`${API_BASE}/schedule/plan`, payload, {
+  const uploadId = payload.uploadId ?? sessionStorage.getItem(UPLOAD_ID_KEY) ?? undefined;
+  const { data } = await axios.post(`${API_BASE}/schedule/plan`, { ...payload, uploadId }, {
     headers: { "Content-Type": "application/json" },
   });
   return data as PlanResponse;
@@ -1,12 +1,17 @@
 export type TimeWindow = { date: string; startTime: string; endTime: string; };
 export type PlanRequest = {
   window: TimeWindow;
-  slotMinutes: number;
+  slotMinutes?: number;
   parallelLimit: number;
+  uploadId?: string;
   options?: Record<string, any>;
 };
 export type Slot = {
   start: string; end: string; courtId: string; groupId: string;
   item?: string; judge?: string; comment?: string;
 };
-export type PlanResponse = { id: string; date: string; slots: Slot[]; };
+export type PlanResponse = {
+  id: string; date: string; slots: Slot[];
+  complete?: boolean; placedGroups?: string[]; unplacedGroups?: string[];
+  stats?: Record<string, any>;
+};
@@ -6,7 +6,7 @@ import ErrorBanner from "../components/ErrorBanner";
 
 const defaultReq: PlanRequest = {
   window: { date: "2025-10-04", startTime: "09:30", endTime: "17:00" },
-  slotMinutes: 15,
+  slotMinutes: 1,
   parallelLimit: 2,
   options: {}
 };
@@ -44,7 +44,7 @@ export default function ConstraintsForm({onPlanned}:{onPlanned:(id:string)=>void
           <input type="time" value={req.window.endTime} onChange={e=>setReq({...req, window:{...req.window, endTime:e.target.value}})} />
         </label>
         <label>Длительность слота (мин)
-          <input type="number" min={5} max={180} value={req.slotMinutes} onChange={e=>setReq({...req, slotMinutes:+e.target.value})}/>
+          <input type="number" min={1} max={180} value={req.slotMinutes} onChange={e=>setReq({...req, slotMinutes:+e.target.value})}/>
         </label>
         <label>Параллельных потоков
           <input type="number" min={1} max={10} value={req.parallelLimit} onChange={e=>setReq({...req, parallelLimit:+e.target.value})}/>
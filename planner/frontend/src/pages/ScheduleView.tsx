@@ -26,6 +26,12 @@ export default function ScheduleView({planId}:{planId:string|null}) {
   return (
     <div>
       <h2>Расписание на {data.date}</h2>
+      {data.complete === false && (
+        <div style={{background:"#fff4e0", padding:8, border:"1px solid #fc6", marginBottom:8}}>
+          Планировщик не уложился в лимит времени, показано частичное расписание.
+          Не размещены: {(data.unplacedGroups ?? []).join(", ")}
+        </div>
+      )}
       <ScheduleTable slots={data.slots} courts={courts} groups={groups} />
     </div>
   );
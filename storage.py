@@ -0,0 +1,297 @@
+"""
+Хранилище загрузок, расписаний и фоновых задач адаптера в локальном файле SQLite.
+
+Общее для всех процессов uvicorn, запущенных в одном каталоге, переживает перезапуск.
+Старые загрузки, расписания и завершённые задачи удаляются по сроку жизни и по числу записей,
+файлы загрузок — вместе с ними. Незавершённые задачи не удаляются: процесс-владелец отмечается в heartbeat,
+а задачи, о которых он давно молчит (процесс умер), помечаются неудавшимися.
+Там же, в inputs/, планировщик хранит разобранные файлы (planner.INPUT_CACHE_DIR), их чистит cleanup.
+"""
+from __future__ import annotations
+import json, os, sqlite3, threading, time
+from typing import Any, Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_created ON uploads (created);
+CREATE TABLE IF NOT EXISTS plans (
+    id TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plans_created ON plans (created);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    progress TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    finished REAL,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+"""
+
+JOB_ACTIVE = ("queued", "running")
+JOB_STALE_ERROR = "Процесс сервера, выполнявший задачу, перестал отвечать"
+
+class Storage:
+    def __init__(
+        self,
+        data_dir: str,
+        upload_ttl: float,
+        plan_ttl: float,
+        max_uploads: int,
+        max_plans: int,
+        job_ttl: float,
+        max_jobs: int,
+        job_stale: float,
+    ) -> None:
+        self.data_dir = data_dir
+        self.upload_dir = os.path.join(data_dir, "uploads")
+        self.input_dir = os.path.join(data_dir, "inputs")
+        self.db_path = os.path.join(data_dir, "planner.sqlite3")
+        self.upload_ttl = upload_ttl
+        self.plan_ttl = plan_ttl
+        self.max_uploads = max_uploads
+        self.max_plans = max_plans
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+        self.job_stale = job_stale
+        # у каждого потока своё соединение: sqlite3 не разрешает делить их между потоками
+        self._local = threading.local()
+        os.makedirs(self.upload_dir, exist_ok=True)
+        # планировщик читает отсюда разобранные файлы, писать сюда может только владелец
+        os.makedirs(self.input_dir, mode=0o700, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # базы, созданные до появления heartbeat
+            if "heartbeat" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # ждём, пока другой процесс допишет, а не падаем с "database is locked"
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            # WAL: читатели не ждут писателя
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    # ЗАГРУЗКИ
+    def upload_path(self, upload_id: str, filename: str) -> str:
+        """Куда записать файл загрузки, от имени файла остаётся только последняя часть пути."""
+        return os.path.join(self.upload_dir, f"{upload_id}_{os.path.basename(filename or 'upload')}")
+
+    def add_upload(self, upload_id: str, path: str, filename: str, digest: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO uploads (id, path, filename, digest, created) VALUES (?, ?, ?, ?, ?)",
+                (upload_id, path, filename, digest, time.time()),
+            )
+            # лишние сверх max_uploads, самые старые
+            evicted = conn.execute(
+                "SELECT path FROM uploads ORDER BY created DESC LIMIT -1 OFFSET ?", (self.max_uploads,)
+            ).fetchall()
+            conn.execute(
+                "DELETE FROM uploads WHERE id IN (SELECT id FROM uploads ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_uploads,),
+            )
+        self._remove_files([row["path"] for row in evicted])
+
+    def get_upload(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT * FROM uploads WHERE id = ? AND created >= ?", (upload_id, time.time() - self.upload_ttl)
+        ).fetchone()
+        return None if row is None else dict(row)
+
+    # РАСПИСАНИЯ
+    def save_plan(self, response: Dict[str, Any], source: Dict[str, Any]) -> None:
+        """source — параметры запроса и правки, по которым построено расписание, для /replan."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO plans (id, response, source, created) VALUES (?, ?, ?, ?)",
+                (
+                    response["id"],
+                    json.dumps(response, ensure_ascii=False),
+                    json.dumps(source, ensure_ascii=False),
+                    time.time(),
+                ),
+            )
+            conn.execute(
+                "DELETE FROM plans WHERE id IN (SELECT id FROM plans ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_plans,),
+            )
+
+    def get_plan(self, plan_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT response FROM plans WHERE id = ? AND created >= ?", (plan_id, time.time() - self.plan_ttl)
+        ).fetchone()
+        return None if row is None else json.loads(row["response"])
+
+    def get_plan_source(self, plan_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT source FROM plans WHERE id = ? AND created >= ?", (plan_id, time.time() - self.plan_ttl)
+        ).fetchone()
+        return None if row is None else json.loads(row["source"])
+
+    # ЗАДАЧИ
+    def add_job(
+        self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None
+    ) -> None:
+        """Новая задача в очереди или, с другим статусом, сразу завершённая — ответ из кэша."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, progress, result, error, created, finished, heartbeat)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, status, "{}",
+                    None if result is None else json.dumps(result, ensure_ascii=False), error,
+                    now, None if status in JOB_ACTIVE else now, now,
+                ),
+            )
+        if status not in JOB_ACTIVE:
+            self._evict_jobs()
+
+    def start_job(self, job_id: str) -> bool:
+        """False — задачу отменили, пока она ждала очереди, считать её не нужно."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'running', heartbeat = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            ).rowcount > 0
+
+    def set_job_progress(self, job_id: str, progress: Dict[str, Any]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET progress = ?, heartbeat = ? WHERE id = ?", (json.dumps(progress), time.time(), job_id)
+            )
+
+    def touch_jobs(self, job_ids: List[str]) -> None:
+        """Процесс-владелец жив: его незавершённые задачи, в том числе ждущие в очереди, не считаются брошенными."""
+        if not job_ids:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND finished IS NULL",
+                [(time.time(), job_id) for job_id in job_ids],
+            )
+
+    def cancel_job(self, job_id: str) -> bool:
+        """
+        Просит остановить задачу, False — если её нет.
+        Ждущая очереди задача отменяется сразу: пул мог уже взять её в работу, но start_job её не начнёт.
+        """
+        with self._connect() as conn:
+            if conn.execute("UPDATE jobs SET cancel = 1 WHERE id = ?", (job_id,)).rowcount == 0:
+                return False
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+        self._evict_jobs()
+        return True
+
+    def job_cancelled(self, job_id: str) -> bool:
+        row = self._connect().execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and bool(row["cancel"])
+
+    def finish_job(
+        self, job_id: str, status: str, result: Optional[Dict[str, Any]], error: Optional[str]
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                (status, None if result is None else json.dumps(result, ensure_ascii=False), error, time.time(), job_id),
+            )
+        self._evict_jobs()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["progress"] = json.loads(job["progress"])
+        job["result"] = None if job["result"] is None else json.loads(job["result"])
+        return job
+
+    def count_jobs(self) -> Dict[str, int]:
+        """Задачи всех процессов по статусу."""
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def _evict_jobs(self) -> None:
+        """Завершённые задачи сверх max_jobs, самые старые."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE finished IS NOT NULL"
+                " ORDER BY finished DESC LIMIT -1 OFFSET ?)",
+                (self.max_jobs,),
+            )
+
+    # ОЧИСТКА
+    def cleanup(self) -> None:
+        """Удаляет просроченные записи, их файлы и файлы в каталоге загрузок, о которых база не знает."""
+        now = time.time()
+        with self._connect() as conn:
+            expired = conn.execute(
+                "SELECT path FROM uploads WHERE created < ?", (now - self.upload_ttl,)
+            ).fetchall()
+            conn.execute("DELETE FROM uploads WHERE created < ?", (now - self.upload_ttl,))
+            conn.execute("DELETE FROM plans WHERE created < ?", (now - self.plan_ttl,))
+            # задачи, о которых владелец молчит дольше job_stale, сам он их уже не завершит
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished = ?"
+                " WHERE finished IS NULL AND COALESCE(heartbeat, created) < ?",
+                (JOB_STALE_ERROR, now, now - self.job_stale),
+            )
+            # незавершённые не трогаем: долгая очередь или долгий поиск — ещё не повод терять результат
+            conn.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (now - self.job_ttl,))
+            known = {row["path"] for row in conn.execute("SELECT path FROM uploads")}
+        self._remove_files([row["path"] for row in expired])
+
+        # файлы, оставшиеся после падения между записью файла и записью в базу
+        orphans: List[str] = []
+        for name in os.listdir(self.upload_dir):
+            path = os.path.join(self.upload_dir, name)
+            try:
+                if path not in known and os.path.getmtime(path) < now - self.upload_ttl:
+                    orphans.append(path)
+            except OSError:
+                pass
+        self._remove_files(orphans)
+
+        # разобранные файлы: просроченные и лишние сверх max_uploads, давно не читанные первыми
+        inputs: List[tuple] = []
+        for name in os.listdir(self.input_dir):
+            path = os.path.join(self.input_dir, name)
+            try:
+                inputs.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        inputs.sort(reverse=True)
+        self._remove_files([
+            path for idx, (mtime, path) in enumerate(inputs)
+            if idx >= self.max_uploads or mtime < now - self.upload_ttl
+        ])
+
+    def _remove_files(self, paths: List[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                # уже удалён другим процессом
+                pass
@@ -0,0 +1,473 @@
+"""
+The api through TestClient on the inputs of test_input: uploads, plans and their cache, replans,
+background jobs, the planner entry point and metrics, with uploads, plans and jobs kept in a temporary PLANNER_DATA_DIR
+"""
+import os
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import types
+
+# read when api_adapter is imported, and by the processes of its pools
+os.environ['PLANNER_DATA_DIR'] = tempfile.mkdtemp(prefix='planner-test-')
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api_adapter
+import benchmark
+import planner
+from storage import Storage
+from test_input import SHEETS, write_csv, write_xlsx
+
+WINDOW = {'date': '2026-01-01', 'startTime': '09:00', 'endTime': '18:00'}
+# g1 can't finish its stages in three minutes
+INFEASIBLE = dict(SHEETS, **{'Группы': [SHEETS['Группы'][0], ('g1', 3, 'a', '09:00', '09:03')]})
+
+
+@pytest.fixture(scope='module')
+def client():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # planner may be imported before PLANNER_DATA_DIR is set
+        monkeypatch.setattr(planner, 'INPUT_CACHE_DIR', api_adapter.STORAGE.input_dir)
+        with TestClient(api_adapter.app) as client:
+            yield client
+            # processes of the job pool open the storage when they start, the server doesn't wait for them
+            api_adapter.job_pool().shutdown(wait=True)
+    shutil.rmtree(api_adapter.DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def empty_plan_cache():
+    api_adapter.PLAN_CACHE.clear()
+
+
+def upload(client, tmp_path, sheets: dict = SHEETS, name: str = 'input.csv') -> str:
+    path = write_csv(tmp_path / name, sheets)
+    with open(path, 'rb') as file:
+        response = client.post('/upload', files={'file': (name, file)})
+    assert response.status_code == 200, response.text
+    return response.json()['uploadId']
+
+
+def plan(client, upload_id: str, **options):
+    return client.post('/schedule/plan', json={'window': WINDOW, 'uploadId': upload_id, 'options': options})
+
+
+def upload_hard(client, tmp_path) -> str:
+    """an input searched in rows order until the time limit"""
+    path = str(tmp_path / 'hard.csv')
+    benchmark.write_csv(benchmark.generate_input(300, 12, 3), path)
+    with open(path, 'rb') as file:
+        return client.post('/upload', files={'file': ('hard.csv', file)}).json()['uploadId']
+
+
+def start_job(client, upload_id: str, **options) -> dict:
+    response = client.post('/schedule/jobs', json={'window': WINDOW, 'uploadId': upload_id, 'options': options})
+    assert response.status_code == 202, response.text
+    return response.json()
+
+
+def wait_job(client, job_id: str, until=lambda job: job['status'] not in ('queued', 'running')) -> dict:
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        job = client.get(f'/schedule/jobs/{job_id}').json()
+        if until(job):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f'job {job_id} is still {job["status"]}')
+
+
+def test_plan_cache(client, tmp_path):
+    upload_id = upload(client, tmp_path)
+    first = plan(client, upload_id)
+    assert first.status_code == 200 and first.headers['X-Plan-Cache'] == 'miss'
+    assert first.json()['complete'] and first.json()['placedGroups'] == ['g1', 'g2']
+    second = plan(client, upload_id)
+    assert second.headers['X-Plan-Cache'] == 'hit'
+    # a hit is a plan of its own
+    assert second.json()['id'] != first.json()['id']
+    assert second.json()['slots'] == first.json()['slots']
+    assert client.get(f"/schedule/{second.json()['id']}").json() == second.json()
+    # other options are another plan
+    assert plan(client, upload_id, timeLimit=10).headers['X-Plan-Cache'] == 'miss'
+
+
+def test_plan_cache_by_content(client, tmp_path):
+    plan(client, upload(client, tmp_path))
+    # the same file uploaded again, under another name
+    response = plan(client, upload(client, tmp_path, name='again.csv'))
+    assert response.headers['X-Plan-Cache'] == 'hit'
+    # a different file
+    sheets = dict(SHEETS, **{'Этапы': [('МаксимумУчастников',), (2,)]})
+    assert plan(client, upload(client, tmp_path, sheets, 'other.csv')).headers['X-Plan-Cache'] == 'miss'
+
+
+def test_plan_cache_keeps_refusals(client, tmp_path):
+    upload_id = upload(client, tmp_path, INFEASIBLE)
+    first = plan(client, upload_id)
+    assert first.status_code == 400 and first.headers['X-Plan-Cache'] == 'miss'
+    second = plan(client, upload_id)
+    assert second.status_code == 400 and second.headers['X-Plan-Cache'] == 'hit'
+    assert second.json() == first.json()
+
+
+def test_plan_cache_skips_partial_timetables(client, tmp_path):
+    upload_id = upload(client, tmp_path)
+    first = plan(client, upload_id, nodeLimit=1)
+    assert first.status_code == 200 and not first.json()['complete']
+    assert plan(client, upload_id, nodeLimit=1).headers['X-Plan-Cache'] == 'miss'
+
+
+def test_plan_cache_expires(client, tmp_path, monkeypatch):
+    upload_id = upload(client, tmp_path)
+    monkeypatch.setattr(api_adapter, 'PLAN_CACHE_TTL', -1.0)
+    plan(client, upload_id)
+    assert plan(client, upload_id).headers['X-Plan-Cache'] == 'miss'
+
+
+def test_replan(client, tmp_path):
+    original = plan(client, upload(client, tmp_path)).json()
+    added = client.post(f"/schedule/{original['id']}/replan", json={
+        'addGroups': [{'name': 'g3', 'count': 2, 'activity': 'a'}],
+    })
+    assert added.status_code == 200, added.text
+    assert added.json()['changedGroups'] == ['g3'] and added.json()['stats']['repaired']
+    kept = [slot for slot in added.json()['slots'] if slot['groupId'] != 'g3']
+    assert sorted(kept, key=str) == sorted(original['slots'], key=str)
+    # the original plan stays as it was
+    assert client.get(f"/schedule/{original['id']}").json() == original
+
+    # edits of a replan apply after the ones it was built with
+    removed = client.post(f"/schedule/{added.json()['id']}/replan", json={'removeGroups': ['g3']})
+    assert removed.json()['changedGroups'] == ['g3']
+    assert sorted(removed.json()['slots'], key=str) == sorted(original['slots'], key=str)
+
+
+def test_replan_refused(client, tmp_path):
+    assert client.post('/schedule/no-such-plan/replan', json={}).status_code == 404
+    original = plan(client, upload(client, tmp_path)).json()
+    response = client.post(f"/schedule/{original['id']}/replan", json={'removeGroups': ['g9']})
+    assert response.status_code == 400 and 'g9' in response.json()['detail']
+
+
+def test_replan_after_upload_removed(client, tmp_path):
+    upload_id = upload(client, tmp_path)
+    original = plan(client, upload_id).json()
+    os.remove(api_adapter.STORAGE.get_upload(upload_id)['path'])
+    assert client.post(f"/schedule/{original['id']}/replan", json={}).status_code == 410
+
+
+def test_job(client, tmp_path):
+    upload_id = upload(client, tmp_path)
+    job = start_job(client, upload_id)
+    assert job['status'] in ('queued', 'running')
+    job = wait_job(client, job['jobId'])
+    assert job['status'] == 'done' and job['result']['complete'] and job['error'] is None
+    assert client.get(f"/schedule/{job['result']['id']}").json() == job['result']
+    # a finished job is forgotten by this process, its row stays in the storage
+    assert job['jobId'] not in api_adapter.JOBS
+    # the same request again is done at once from the plan cache
+    again = start_job(client, upload_id)
+    assert again['status'] == 'done' and again['result']['slots'] == job['result']['slots']
+    assert plan(client, upload_id).headers['X-Plan-Cache'] == 'hit'
+
+
+def test_job_refused(client, tmp_path):
+    upload_id = upload(client, tmp_path, INFEASIBLE)
+    job = wait_job(client, start_job(client, upload_id)['jobId'])
+    assert job['status'] == 'failed' and job['result'] is None and job['error']
+    # refusals are cached as well
+    assert start_job(client, upload_id)['status'] == 'failed'
+    assert plan(client, upload_id).status_code == 400
+
+
+def test_job_cancel(client, tmp_path):
+    upload_id = upload_hard(client, tmp_path)
+    job = start_job(client, upload_id, groupOrder='rows', timeLimit=60)
+    wait_job(client, job['jobId'], until=lambda job: job['progress'].get('nodes', 0) > 0)
+    started = time.monotonic()
+    assert client.delete(f"/schedule/jobs/{job['jobId']}").status_code == 200
+    job = wait_job(client, job['jobId'])
+    assert time.monotonic() - started < 10
+    # a job stopped while searching keeps the best partial timetable
+    assert job['status'] == 'cancelled' and not job['result']['complete'] and job['result']['placedGroups']
+    assert job['jobId'] not in api_adapter.JOBS
+
+
+def test_job_cancel_while_queued(client, tmp_path):
+    upload_id = upload_hard(client, tmp_path)
+    # both workers busy, the third job waits
+    busy = [start_job(client, upload_id, groupOrder='rows', timeLimit=60, nodeLimit=10**9 + idx) for idx in range(2)]
+    for job in busy:
+        wait_job(client, job['jobId'], until=lambda job: job['status'] == 'running')
+    queued = start_job(client, upload_id, groupOrder='rows', timeLimit=60)
+    # the pool may have taken it already, it is cancelled at once all the same
+    assert client.delete(f"/schedule/jobs/{queued['jobId']}").json()['status'] == 'cancelled'
+    for job in busy:
+        client.delete(f"/schedule/jobs/{job['jobId']}")
+        assert wait_job(client, job['jobId'])['status'] == 'cancelled'
+    # and never runs
+    queued = wait_job(client, queued['jobId'], until=lambda job: queued['jobId'] not in api_adapter.JOBS)
+    assert queued['status'] == 'cancelled' and queued['result'] is None and queued['progress'] == {}
+
+
+def other_process() -> Storage:
+    """the storage as another uvicorn process with the same PLANNER_DATA_DIR sees it"""
+    store = api_adapter.STORAGE
+    return Storage(
+        store.data_dir, store.upload_ttl, store.plan_ttl, store.max_uploads, store.max_plans,
+        store.job_ttl, store.max_jobs, store.job_stale,
+    )
+
+
+def test_job_of_another_process(client):
+    other = other_process()
+    other.add_job('elsewhere', 'queued')
+    assert client.get('/schedule/jobs/elsewhere').json()['status'] == 'queued'
+    assert client.delete('/schedule/jobs/elsewhere').json()['status'] == 'cancelled'
+    assert other.get_job('elsewhere')['status'] == 'cancelled'
+
+
+def test_job_cancelled_by_another_process(client, tmp_path):
+    job = start_job(client, upload_hard(client, tmp_path), groupOrder='rows', timeLimit=60)
+    wait_job(client, job['jobId'], until=lambda job: job['status'] == 'running')
+    # the worker searching learns of it from the storage
+    assert other_process().cancel_job(job['jobId'])
+    job = wait_job(client, job['jobId'])
+    assert job['status'] == 'cancelled' and not job['result']['complete']
+
+
+def test_job_queue_full(client, tmp_path, monkeypatch):
+    upload_id = upload(client, tmp_path)
+    monkeypatch.setattr(api_adapter, 'JOB_WORKERS', 0)
+    monkeypatch.setattr(api_adapter, 'JOB_QUEUE_LIMIT', 0)
+    response = client.post('/schedule/jobs', json={'window': WINDOW, 'uploadId': upload_id, 'options': {}})
+    assert response.status_code == 429
+
+
+def test_unknown_job(client):
+    assert client.get('/schedule/jobs/no-such-job').status_code == 404
+    assert client.delete('/schedule/jobs/no-such-job').status_code == 404
+
+
+def test_plan_needs_its_upload(client, tmp_path):
+    first = upload(client, tmp_path)
+    # uploaded later by someone else
+    upload(client, tmp_path, dict(SHEETS, **{'Группы': [SHEETS['Группы'][0], ('other', 1, 'a', None, None)]}), 'other.csv')
+    for body in ({}, {'uploadId': None}, {'uploadId': ''}):
+        response = client.post('/schedule/plan', json={'window': WINDOW, 'options': {}, **body})
+        assert response.status_code == 400
+        assert client.post('/schedule/jobs', json={'window': WINDOW, 'options': {}, **body}).status_code == 400
+    assert plan(client, 'no-such-upload').status_code == 404
+    assert plan(client, first).json()['placedGroups'] == ['g1', 'g2']
+
+
+def test_plan_after_upload_expired(client, tmp_path, monkeypatch):
+    upload_id = upload(client, tmp_path)
+    monkeypatch.setattr(api_adapter.STORAGE, 'upload_ttl', -1.0)
+    assert plan(client, upload_id).status_code == 404
+
+
+def post_file(client, name: str, content: bytes):
+    return client.post('/upload', files={'file': (name, content)})
+
+
+def uploaded_files() -> list[str]:
+    return sorted(os.listdir(api_adapter.STORAGE.upload_dir))
+
+
+def test_upload_xlsx(client, tmp_path):
+    with open(write_xlsx(tmp_path / 'input.xlsx', SHEETS), 'rb') as file:
+        response = post_file(client, 'input.xlsx', file.read())
+    assert response.status_code == 200
+    assert plan(client, response.json()['uploadId']).json()['placedGroups'] == ['g1', 'g2']
+
+
+@pytest.mark.parametrize('name, content', [
+    ('input.txt', b'anything'),
+    ('input.xlsx', b'not a zip'),
+    # looks like a zip up front only
+    ('input.xlsx', b'PK\x03\x04' + b'\0' * 100),
+    ('input.csv', 'Упражнения\nНазвание,Длительность\n'.encode()),
+    ('input.csv', 'Упражнения'.encode('cp1251')),
+])
+def test_upload_refused(client, name, content):
+    before = uploaded_files()
+    response = post_file(client, name, content)
+    assert response.status_code == 400, response.text
+    # nothing is left behind
+    assert uploaded_files() == before
+
+
+def test_upload_failing_planner(client, tmp_path, monkeypatch):
+    def warm_input(path, digest):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(api_adapter, 'warm_input', warm_input)
+    before = uploaded_files()
+    with open(write_csv(tmp_path / 'input.csv', SHEETS), 'rb') as file:
+        response = post_file(client, 'input.csv', file.read())
+    assert response.status_code == 500 and 'disk full' in response.json()['detail']
+    assert uploaded_files() == before
+
+
+def test_upload_hashed_once(client, tmp_path, monkeypatch):
+    def file_digest(path):
+        raise AssertionError('read again')
+
+    monkeypatch.setattr(planner, 'file_digest', file_digest)
+    assert plan(client, upload(client, tmp_path, name='once.csv')).status_code == 200
+
+
+def multipart(name: str, size: int) -> tuple[bytes, str]:
+    """form with a csv file of size bytes, and its content type"""
+    boundary = 'test-boundary'
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+        'Content-Type: text/csv\r\n\r\n'
+    ).encode() + b'x' * size + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+@pytest.mark.parametrize('size, chunked, read_by_route', [
+    # refused by the middleware, by the length declared or by the bytes read
+    (1 << 20, False, False),
+    (1 << 20, True, False),
+    # within the room left for the form, refused while reading the file
+    (2000, False, True),
+    (2000, True, True),
+])
+def test_upload_too_large(client, monkeypatch, size, chunked, read_by_route):
+    monkeypatch.setattr(api_adapter, 'UPLOAD_MAX_BYTES', 1000)
+    checks = []
+    upload_check = api_adapter.UploadCheck
+    monkeypatch.setattr(api_adapter, 'UploadCheck', lambda name: checks.append(name) or upload_check(name))
+    before = uploaded_files()
+    body, content_type = multipart('big.csv', size)
+    # a generator is sent chunked, without Content-Length
+    content = (body[idx:idx + 4096] for idx in range(0, len(body), 4096)) if chunked else body
+    response = client.post('/upload', content=content, headers={'Content-Type': content_type})
+    assert response.status_code == 413, response.text
+    assert bool(checks) == read_by_route
+    assert uploaded_files() == before
+
+
+@pytest.fixture
+def entry_point(monkeypatch):
+    """planner_module resolves the entry point of a fake planner, returns it to fill"""
+    module = types.ModuleType('planner')
+    monkeypatch.setitem(sys.modules, 'planner', module)
+    monkeypatch.setattr(api_adapter, '_planner', None)
+    monkeypatch.setattr(api_adapter, '_planner_fn', None)
+    return module
+
+
+def test_entry_point_order(entry_point):
+    entry_point.main = lambda params: {'from': 'main'}
+    entry_point.run = lambda params: {'from': 'run'}
+    entry_point.plan = 'not callable'
+    assert api_adapter.run_planner({}) == {'from': 'run'}
+    # resolved once
+    entry_point.generate_schedule = lambda params: {'from': 'generate_schedule'}
+    assert api_adapter.run_planner({}) == {'from': 'run'}
+
+
+def test_entry_point_missing(entry_point):
+    with pytest.raises(RuntimeError, match='generate_schedule'):
+        api_adapter.planner_module()
+
+
+@pytest.mark.parametrize('result, status', [
+    (planner.InputError('no such court'), 400),
+    (KeyError('slots'), 500),
+    (None, 400),
+    ('[1, 2]', 500),
+])
+def test_entry_point_failures(entry_point, result, status):
+    entry_point.InputError = planner.InputError
+
+    def generate_schedule(params):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    entry_point.generate_schedule = generate_schedule
+    with pytest.raises(api_adapter.HTTPException) as failure:
+        api_adapter.run_planner({})
+    assert failure.value.status_code == status
+
+
+def test_entry_point_json(entry_point):
+    entry_point.generate_schedule = lambda params: '{"slots": []}'
+    assert api_adapter.run_planner({}) == {'slots': []}
+
+
+@pytest.fixture
+def isolated(monkeypatch):
+    monkeypatch.setattr(api_adapter, 'PLANNER_ISOLATED', True)
+    yield
+    if api_adapter._isolated_pool is not None:
+        # its process opens the storage when it starts
+        api_adapter._isolated_pool.shutdown(wait=True)
+    api_adapter.reset_isolated_pool()
+
+
+def test_isolated_planner(client, tmp_path, isolated):
+    upload_id = upload(client, tmp_path)
+    assert plan(client, upload_id).status_code == 200
+    # the planner process survives requests
+    [pid] = api_adapter.isolated_pool()._processes
+    assert pid != os.getpid()
+    assert plan(client, upload_id, timeLimit=10).status_code == 200
+    assert list(api_adapter.isolated_pool()._processes) == [pid]
+
+    # a crash of the planner fails its request only
+    os.kill(pid, signal.SIGKILL)
+    response = plan(client, upload_id, timeLimit=20)
+    assert response.status_code == 500 and 'planner process failed' in response.json()['detail']
+    assert plan(client, upload_id, timeLimit=20).status_code == 200
+
+
+def samples(client) -> dict[str, float]:
+    """samples of /metrics by name with labels, every line checked against the text format"""
+    response = client.get('/metrics')
+    assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+    found = {}
+    for line in response.text.splitlines():
+        if line.startswith('#'):
+            assert re.fullmatch(r'# (HELP \w+ .+|TYPE \w+ (counter|gauge))', line), line
+            continue
+        match = re.fullmatch(r'(\w+(?:\{\w+="[^"]*"(?:,\w+="[^"]*")*\})?) (\S+)', line)
+        assert match, line
+        found[match.group(1)] = float(match.group(2))
+    return found
+
+
+def test_metrics(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(api_adapter, 'METRICS', {})
+    before = samples(client)
+    # counters without labels are there before the first event
+    assert before['planner_search_nodes_total'] == 0 and before['planner_plan_cache_hits_total'] == 0
+    assert 'planner_plans_total{complete="true"}' not in before
+
+    upload_id = upload(client, tmp_path)
+    done = plan(client, upload_id).json()
+    plan(client, upload_id)
+    plan(client, upload(client, tmp_path, INFEASIBLE, 'infeasible.csv'))
+    after = samples(client)
+    assert after['planner_plans_total{complete="true"}'] == 1
+    assert after['planner_plan_cache_hits_total'] == 1
+    assert after['planner_plan_failures_total{status="400"}'] == 1
+    assert after['planner_search_nodes_total'] == done['stats']['nodes'] > 0
+    assert after['planner_search_max_depth'] == done['stats']['maxDepth']
+    for distance, count in done['stats']['jumps'].items():
+        assert after[f'planner_search_jumps_total{{distance="{distance}"}}'] == count
+    assert after['planner_plan_cache_entries'] == len(api_adapter.PLAN_CACHE) == 2
+    # jobs of every process, from the storage
+    jobs = api_adapter.STORAGE.count_jobs()
+    for status in ('queued', 'running', 'done', 'failed', 'cancelled'):
+        assert after[f'planner_jobs{{status="{status}"}}'] == jobs.get(status, 0)
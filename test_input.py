@@ -0,0 +1,302 @@
+"""
+Input files: csv and xlsx with the same sheets read to the same input,
+values of every kind read as minutes, files that can't be read fail with InputError;
+edits of replans applied to inputs and timetables repaired after them
+"""
+import json
+import zipfile
+from collections import OrderedDict
+from datetime import time, timedelta
+
+import pytest
+from openpyxl import Workbook
+
+import planner
+from planner import InputError, InputInfo, Solver
+
+SHEETS = {
+    'Упражнения': [('Название', 'Длительность'), ('a', 2), ('b', '3,0')],
+    'Этапы': [('МаксимумУчастников',), (4,), (2,)],
+    'Корты': [('Корт', 'Открытие', 'Закрытие'), ('c1', '09:00', '12:00'), ('c1', '13:00', '18:00'), ('c2', 540, 1020)],
+    'Группы': [
+        ('ИмяГруппы', 'КоличествоУчастников', 'Упражнение', 'МинимальноеВремяНачала', 'МаксимальноеВремяОкончания'),
+        ('g1', 3, 'a', '09:30', None),
+        ('g2', '5,0', 'b', None, '17:00'),
+    ],
+}
+# as read from SHEETS: groups without limits get the first opening and the last closing
+EXPECTED = {
+    'groups': [('g1', 3, 'a', 570, 1080), ('g2', 5, 'b', 540, 1020)],
+    'courts': [('c1', [540, 780], [720, 1080]), ('c2', [540], [1020])],
+    'activity_durations': {'a': 2, 'b': 3},
+    'stage_limits': [4, 2],
+}
+
+
+def summary(info: InputInfo) -> dict:
+    """input as plain values to compare"""
+    return {
+        'groups': [(g.name, g.count, g.activity, g.limit.start, g.limit.end) for g in info.groups],
+        'courts': [(c.name, list(c.starts), list(c.ends)) for c in info.courts],
+        'activity_durations': info.activity_durations,
+        'stage_limits': info.stage_limits,
+    }
+
+
+def write_csv(path, sheets: dict, delimiter: str = ',') -> str:
+    """every sheet starts with a row of its name, cells with the delimiter in them are quoted"""
+    lines = []
+    for name, rows in sheets.items():
+        lines.append(name)
+        for row in rows:
+            cells = ['' if cell is None else str(cell) for cell in row]
+            lines.append(delimiter.join(f'"{cell}"' if delimiter in cell else cell for cell in cells))
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def write_xlsx(path, sheets: dict) -> str:
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in sheets.items():
+        sheet = workbook.create_sheet(name)
+        for row in rows:
+            sheet.append(list(row))
+    workbook.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize('delimiter', [',', ';'])
+def test_csv_reads_as_expected(tmp_path, delimiter):
+    info = planner.parse_input(write_csv(tmp_path / 'input.csv', SHEETS, delimiter))
+    assert summary(info) == EXPECTED
+
+
+def test_xlsx_reads_as_csv(tmp_path):
+    info = planner.parse_input(write_xlsx(tmp_path / 'input.xlsx', SHEETS))
+    assert summary(info) == EXPECTED
+
+
+@pytest.mark.parametrize('suffix', ['csv', 'xlsx'])
+def test_sheet_order_other_sheets_and_missing_optional_columns(tmp_path, suffix):
+    sheets = {
+        'Заметки': [('что угодно', 1)],
+        'Группы': [('Упражнение', 'ИмяГруппы', 'КоличествоУчастников'), ('a', 'g1', 3), (None, None, None)],
+        **{name: rows for name, rows in SHEETS.items() if name != 'Группы'},
+    }
+    write = write_csv if suffix == 'csv' else write_xlsx
+    info = planner.parse_input(write(tmp_path / f'input.{suffix}', sheets))
+    assert summary(info)['groups'] == [('g1', 3, 'a', 540, 1080)]
+
+
+def test_csv_skips_rows_before_the_first_sheet(tmp_path):
+    path = tmp_path / 'input.csv'
+    write_csv(path, SHEETS)
+    path.write_text('выгрузка от 01.01\n\n' + path.read_text(encoding='utf-8'), encoding='utf-8')
+    assert summary(planner.parse_input(str(path))) == EXPECTED
+
+
+def test_xlsx_times_of_every_kind(tmp_path):
+    # time cells, durations past 24:00, minutes as numbers and str(timedelta)
+    sheets = dict(SHEETS, **{'Корты': [
+        ('Корт', 'Открытие', 'Закрытие'),
+        ('c1', time(9, 0, 30), timedelta(hours=25)),
+        ('c2', 540, '1 day, 2:00:00'),
+    ]})
+    info = planner.parse_input(write_xlsx(tmp_path / 'input.xlsx', sheets))
+    # openings round up to a whole minute, closings down
+    assert summary(info)['courts'] == [('c1', [541], [1500]), ('c2', [540], [1560])]
+
+
+@pytest.mark.parametrize('suffix', ['csv', 'xlsx'])
+def test_missing_sheet(tmp_path, suffix):
+    sheets = {name: rows for name, rows in SHEETS.items() if name != 'Этапы'}
+    write = write_csv if suffix == 'csv' else write_xlsx
+    with pytest.raises(InputError, match='Этапы'):
+        planner.parse_input(write(tmp_path / f'input.{suffix}', sheets))
+
+
+@pytest.mark.parametrize('suffix', ['csv', 'xlsx'])
+def test_missing_column(tmp_path, suffix):
+    sheets = dict(SHEETS, **{'Корты': [('Корт', 'Открытие'), ('c1', '09:00')]})
+    write = write_csv if suffix == 'csv' else write_xlsx
+    with pytest.raises(InputError, match='Закрытие'):
+        planner.parse_input(write(tmp_path / f'input.{suffix}', sheets))
+
+
+@pytest.mark.parametrize('value', ['девять', '9:00:00:00'])
+def test_unreadable_value(tmp_path, value):
+    sheets = dict(SHEETS, **{'Корты': [('Корт', 'Открытие', 'Закрытие'), ('c1', value, '12:00')]})
+    with pytest.raises(InputError):
+        planner.parse_input(write_csv(tmp_path / 'input.csv', sheets))
+
+
+def test_not_a_workbook(tmp_path):
+    junk = tmp_path / 'junk.xlsx'
+    junk.write_bytes(b'PK\x03\x04 not really a zip')
+    with pytest.raises(InputError):
+        planner.parse_input(str(junk))
+    # a zip, but without the parts of a workbook
+    empty = tmp_path / 'empty.xlsx'
+    with zipfile.ZipFile(empty, 'w') as archive:
+        archive.writestr('readme.txt', 'nothing here')
+    with pytest.raises(InputError):
+        planner.parse_input(str(empty))
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """an empty cache in memory and on disk, parse_input counts its calls"""
+    monkeypatch.setattr(planner, 'INPUT_CACHE_DIR', str(tmp_path / 'inputs'))
+    monkeypatch.setattr(planner, '_input_cache', OrderedDict())
+    parsed = []
+    parse_input = planner.parse_input
+    monkeypatch.setattr(planner, 'parse_input', lambda path: parsed.append(path) or parse_input(path))
+    return tmp_path / 'inputs', parsed
+
+
+def test_cache_parses_once(tmp_path, cache_dir):
+    inputs, parsed = cache_dir
+    path = write_csv(tmp_path / 'input.csv', SHEETS)
+    assert summary(planner.load_input(path)) == EXPECTED
+    assert summary(planner.load_input(path)) == EXPECTED
+    assert len(parsed) == 1
+    # kept as json, which can't run code when read
+    [entry] = inputs.iterdir()
+    assert entry.name == f'{planner.file_digest(path)}-{planner._INPUT_CACHE_VERSION}.json'
+    json.loads(entry.read_bytes())
+    assert inputs.stat().st_mode & 0o777 == 0o700
+
+    # another process starts with an empty memory and reads the disk
+    planner._input_cache.clear()
+    assert summary(planner.load_input(path)) == EXPECTED
+    assert len(parsed) == 1
+
+
+def test_cache_by_content(tmp_path, cache_dir):
+    _, parsed = cache_dir
+    path = write_csv(tmp_path / 'input.csv', SHEETS)
+    digest = planner.file_digest(path)
+    planner.load_input(path, digest)
+    copy = tmp_path / 'copy.csv'
+    copy.write_bytes((tmp_path / 'input.csv').read_bytes())
+    assert summary(planner.load_input(str(copy))) == EXPECTED
+    # with the digest given the file isn't read at all
+    (tmp_path / 'input.csv').unlink()
+    assert summary(planner.load_input(path, digest)) == EXPECTED
+    assert len(parsed) == 1
+
+
+def test_cache_gives_fresh_courts(tmp_path, cache_dir):
+    path = write_csv(tmp_path / 'input.csv', SHEETS)
+    info = planner.load_input(path)
+    assert info.courts[0].book(540, 600)
+    assert summary(planner.load_input(path)) == EXPECTED
+
+
+def test_cache_dir_others_may_write_to(tmp_path, cache_dir):
+    inputs, parsed = cache_dir
+    path = write_csv(tmp_path / 'input.csv', SHEETS)
+    inputs.mkdir(mode=0o777)
+    inputs.chmod(0o777)
+    # an entry planted by someone else is not read, nothing is written there
+    planted = inputs / f'{planner.file_digest(path)}-{planner._INPUT_CACHE_VERSION}.json'
+    other = planner.parse_input(write_csv(tmp_path / 'other.csv', dict(SHEETS, **{'Этапы': [('МаксимумУчастников',)]})))
+    planted.write_text(json.dumps(planner._pack_input(
+        other.groups, other.courts, 0, 0, other.stage_limits, other.activity_durations,
+    ), default=list))
+    parsed.clear()
+    assert summary(planner.load_input(path)) == EXPECTED
+    assert len(parsed) == 1
+    assert [entry.name for entry in inputs.iterdir()] == [planted.name]
+    # memory still has it
+    assert summary(planner.load_input(path)) == EXPECTED
+    assert len(parsed) == 1
+
+
+def read(tmp_path, sheets: dict = SHEETS) -> InputInfo:
+    return planner.parse_input(write_csv(tmp_path / 'input.csv', sheets))
+
+
+def test_delta_courts(tmp_path):
+    info = read(tmp_path)
+    edited = planner.apply_delta(info, {
+        'closeCourts': [{'court': 'c1', 'start': '10:00', 'end': '11:00'}, {'court': 'c1', 'start': 700, 'end': 800}],
+        'openCourts': [{'court': 'c2', 'start': '17:00', 'end': '19:00'}, {'court': 'c3', 'start': 600, 'end': 660}],
+    })
+    assert summary(edited)['courts'] == [('c1', [540, 660, 800], [600, 700, 1080]), ('c2', [540], [1140]), ('c3', [600], [660])]
+    # a copy, the input is as read
+    assert summary(info) == EXPECTED
+
+
+def test_delta_groups(tmp_path):
+    edited = planner.apply_delta(read(tmp_path), {
+        'openCourts': [{'court': 'c3', 'start': '08:00', 'end': '20:00'}],
+        'removeGroups': ['g1'],
+        'modifyGroups': [{'name': 'g2', 'count': 2, 'minStart': '10:00'}],
+        'addGroups': [{'name': 'g3', 'count': 1, 'activity': 'a'}, {'name': 'g4', 'count': '2', 'activity': 'b', 'maxEnd': 900}],
+    })
+    # added groups without limits get the courts as edited
+    assert summary(edited)['groups'] == [('g2', 2, 'b', 600, 1020), ('g3', 1, 'a', 480, 1200), ('g4', 2, 'b', 480, 900)]
+
+
+@pytest.mark.parametrize('delta', [
+    {'closeCourts': [{'court': 'c9', 'start': 600, 'end': 660}]},
+    {'openCourts': [{'court': 'c1', 'start': '12:00', 'end': '11:00'}]},
+    {'removeGroups': ['g9']},
+    {'modifyGroups': [{'name': 'g9', 'count': 1}]},
+    {'addGroups': [{'name': 'g1', 'count': 1, 'activity': 'a'}]},
+])
+def test_delta_refused(tmp_path, delta):
+    with pytest.raises(InputError):
+        planner.apply_delta(read(tmp_path), delta)
+
+
+def slots_of(info: InputInfo, solution) -> dict[str, list[tuple[str, int, int]]]:
+    """slots by group name as (court name, start, end)"""
+    slots: dict[str, list[tuple[str, int, int]]] = {}
+    for entry in solution.timetable:
+        slots.setdefault(info.groups[entry.group_idx].name, []).append(
+            (info.courts[entry.court_idx].name, entry.period.start, entry.period.end))
+    return {name: sorted(periods) for name, periods in sorted(slots.items())}
+
+
+def repair(tmp_path, delta: dict, changed: set[str], sheets: dict = SHEETS):
+    """timetable of the input, then the one repaired after delta, by group name"""
+    info = read(tmp_path, sheets)
+    solution = Solver(info.groups, info.courts, 1, 0, info.stage_limits, info.activity_durations).solve()
+    before = slots_of(info, solution)
+    previous = [(name, court, start, end) for name, periods in before.items() for court, start, end in periods]
+    edited = planner.apply_delta(read(tmp_path, sheets), delta)
+    found = planner.repair_timetable(edited, previous, changed, 1, 0)
+    return before, None if found is None else slots_of(edited, found[0])
+
+
+def test_repair_keeps_other_groups(tmp_path):
+    before, after = repair(tmp_path, {'addGroups': [{'name': 'g3', 'count': 2, 'activity': 'a'}]}, {'g3'})
+    assert {name: after[name] for name in before} == before
+    assert len(after['g3']) == 1
+
+
+def test_repair_moves_groups_off_closed_courts(tmp_path):
+    info = read(tmp_path)
+    solution = Solver(info.groups, info.courts, 1, 0, info.stage_limits, info.activity_durations).solve()
+    court, start, end = slots_of(info, solution)['g1'][0]
+    before, after = repair(tmp_path, {'closeCourts': [{'court': court, 'start': start, 'end': end}]}, set())
+    assert after['g2'] == before['g2']
+    assert (court, start, end) not in after['g1'] and len(after['g1']) == len(before['g1'])
+
+
+def test_repair_gives_up_without_room(tmp_path):
+    # g1 takes 09:00-09:06 and 09:07-09:11, g3 only fits if g1 moves
+    sheets = dict(SHEETS, **{
+        'Корты': [SHEETS['Корты'][0], ('c1', '09:00', '09:20')],
+        'Группы': [SHEETS['Группы'][0], ('g1', 3, 'a', None, None)],
+    })
+    delta = {'addGroups': [{'name': 'g3', 'count': 1, 'activity': 'a', 'minStart': '09:00', 'maxEnd': '09:08'}]}
+    before, after = repair(tmp_path, delta, {'g3'}, sheets)
+    assert before == {'g1': [('c1', 540, 546), ('c1', 547, 551)]}
+    assert after is None
+    # from scratch there is a timetable
+    edited = planner.apply_delta(read(tmp_path, sheets), delta)
+    assert Solver(edited.groups, edited.courts, 1, 0, edited.stage_limits, edited.activity_durations).solve().complete
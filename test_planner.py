@@ -0,0 +1,263 @@
+"""
+Solver against exhaustive search on random tiny inputs: a timetable is found exactly when one exists,
+it keeps every rule, and with an objective nothing better exists
+"""
+import random
+from math import ceil
+
+import pytest
+
+import planner
+from planner import NOGOOD_LIMIT, Court, Group, InfeasibleInputError, Solver, TimePeriod
+
+REST_TIME = 1
+EVALUATE_TIME = 1
+STAGE_LIMITS = [2]
+ACTIVITY_DURATIONS = {'a': 2, 'b': 3}
+SEEDS = range(40)
+# odd stage minutes take a step more on it
+GRID = 2
+
+
+def tiny_input(seed: int, grid: int = 1) -> tuple[list[Group], list[Court]]:
+    """
+    a few groups and courts in steps of grid, moved off it by a few minutes when grid > 1,
+    with identical groups and courts now and then for symmetry to fold
+    """
+    rnd = random.Random(seed)
+
+    def minutes(steps: int) -> int:
+        # inputs cross an hour, court hours differ from the number of courts used
+        return 50 + steps * grid + (rnd.randint(-grid // 2, grid // 2) if grid > 1 else 0)
+
+    courts: list[Court] = []
+    for idx in range(rnd.choice([1, 2, 2, 3])):
+        if courts and rnd.random() < 0.3:
+            courts.append(Court(f'c{idx}', courts[-1].time_available))
+            continue
+        opens = rnd.choice([0, 2, 4])
+        if rnd.random() < 0.3:
+            periods = [TimePeriod(minutes(opens), minutes(opens + 8)), TimePeriod(minutes(opens + 11), minutes(opens + 24))]
+        else:
+            periods = [TimePeriod(minutes(opens), minutes(opens + rnd.choice([14, 20, 26])))]
+        courts.append(Court(f'c{idx}', periods))
+    groups: list[Group] = []
+    for idx in range(rnd.choice([2, 3, 3])):
+        if groups and rnd.random() < 0.3:
+            twin = groups[-1]
+            groups.append(Group(f'g{idx}', twin.count, twin.activity, TimePeriod(twin.limit.start, twin.limit.end)))
+            continue
+        start = rnd.choice([0, 2, 5])
+        groups.append(Group(
+            f'g{idx}', rnd.randint(1, 3), rnd.choice(['a', 'b']),
+            TimePeriod(minutes(start), minutes(start + rnd.choice([12, 18, 26]))),
+        ))
+    return groups, courts
+
+
+def stage_minutes(group: Group) -> list[int]:
+    """minutes of every stage of the group, each stage goes on with the largest limit below its count"""
+    stages: list[int] = []
+    count: int | None = group.count
+    while count is not None:
+        stages.append(ceil(count * ACTIVITY_DURATIONS[group.activity] + EVALUATE_TIME))
+        smaller = [limit for limit in STAGE_LIMITS if limit < count]
+        count = smaller[-1] if smaller else None
+    return stages
+
+
+def objective_value(objective: str, entries: list[tuple[int, int, int]]) -> int:
+    """entries are (court, start, end) in minutes, makespan is the last end"""
+    if objective == 'makespan':
+        return max(end for _, _, end in entries)
+    return len({(court, hour) for court, start, end in entries for hour in range(start // 60, (end - 1) // 60 + 1)})
+
+
+def exhaustive(groups: list[Group], courts: list[Court], grid: int = 1, objective: str | None = None) -> int | None:
+    """
+    tries every start on the grid on every court for every stage in turn,
+    returns the best objective, 0 without one, None if there is no timetable
+    """
+    free = [[(-(-start // grid), end // grid) for start, end in zip(court.starts, court.ends)] for court in courts]
+    rest = -(-REST_TIME // grid)
+    stages = [
+        (group_idx, -(-group.limit.start // grid), group.limit.end // grid, -(-minutes // grid))
+        for group_idx, group in enumerate(groups) for minutes in stage_minutes(group)
+    ]
+    booked: list[list[tuple[int, int]]] = [[] for _ in courts]
+    placed: list[tuple[int, int, int]] = []
+    best: int | None = None
+
+    def value() -> int:
+        return objective_value(objective, [(court, start * grid, end * grid) for court, start, end in placed])
+
+    def fits(court: int, start: int, end: int) -> bool:
+        return any(a <= start and end <= b for a, b in free[court]) and all(
+            end <= a or start >= b for a, b in booked[court]
+        )
+
+    def extend(idx: int, ready: dict[int, int]) -> bool:
+        nonlocal best
+        # both objectives only grow with every stage placed
+        if objective is not None and best is not None and placed and value() >= best:
+            return False
+        if idx == len(stages):
+            best = 0 if objective is None else value()
+            return objective is None
+        group_idx, first, last, steps = stages[idx]
+        for start in range(ready.get(group_idx, first), last - steps + 1):
+            for court in range(len(courts)):
+                if not fits(court, start, start + steps):
+                    continue
+                booked[court].append((start, start + steps))
+                placed.append((court, start, start + steps))
+                done = extend(idx + 1, {**ready, group_idx: start + steps + rest})
+                placed.pop()
+                booked[court].pop()
+                if done:
+                    return True
+        return False
+
+    extend(0, {})
+    return best
+
+
+def check_timetable(
+    groups: list[Group], courts: list[Court], timetable: list, placed: list[int] | None = None,
+    grid: int = 1, compact: bool = False,
+) -> None:
+    """
+    every stage of every placed group, all groups by default, in order within the group limits
+    with rest between, on free court time, nothing overlaps
+    """
+    by_court: dict[int, list[tuple[int, int]]] = {}
+    by_group: dict[int, list[TimePeriod]] = {}
+    for entry in timetable:
+        by_court.setdefault(entry.court_idx, []).append((entry.period.start, entry.period.end))
+        by_group.setdefault(entry.group_idx, []).append(entry.period)
+        court = courts[entry.court_idx]
+        assert any(
+            start <= entry.period.start and entry.period.end <= end for start, end in zip(court.starts, court.ends)
+        ), entry
+    for periods in by_court.values():
+        periods.sort()
+        assert all(periods[idx][1] <= periods[idx + 1][0] for idx in range(len(periods) - 1)), periods
+    assert sorted(by_group) == (list(range(len(groups))) if placed is None else sorted(placed))
+    for group_idx, periods in by_group.items():
+        group = groups[group_idx]
+        periods.sort()
+        minutes = stage_minutes(group)
+        assert len(periods) == len(minutes)
+        for period, length in zip(periods, minutes):
+            # off the grid stages keep whole steps unless compacted
+            assert period.end - period.start == (length if compact or grid == 1 else -(-length // grid) * grid)
+        assert periods[0].start >= group.limit.start and periods[-1].end <= group.limit.end
+        assert all(periods[idx].end + REST_TIME <= periods[idx + 1].start for idx in range(len(periods) - 1))
+
+
+def solve(seed: int, grid: int = 1, **options) -> tuple[list[Group], list[Court], object]:
+    """the solver books courts as it goes, every run gets its own input"""
+    groups, courts = tiny_input(seed, grid)
+    solver = Solver(
+        groups, courts, REST_TIME, EVALUATE_TIME, STAGE_LIMITS, ACTIVITY_DURATIONS, grid=grid, time_limit=60, **options,
+    )
+    try:
+        solution = solver.solve()
+    except InfeasibleInputError:
+        solution = None
+    assert not solver.stats.out_of_budget
+    fresh_groups, fresh_courts = tiny_input(seed, grid)
+    return fresh_groups, fresh_courts, solution
+
+
+OPTIONS = {
+    'plain': {},
+    'minute scan': {'minute_scan': True},
+    # the default index, see the fixture
+    'tree': {},
+    'bitmap': {'court_index': 'bitmap'},
+    'tightest': {'group_order': 'tightest'},
+    'longest': {'group_order': 'longest'},
+    'best fit': {'court_order': 'best_fit'},
+    'tightest best fit': {'group_order': 'tightest', 'court_order': 'best_fit'},
+    'nogoods': {'nogood_limit': NOGOOD_LIMIT},
+    'bitmap nogoods': {'court_index': 'bitmap', 'nogood_limit': NOGOOD_LIMIT},
+    'no symmetry': {'symmetry': False},
+    'nogoods no symmetry': {'nogood_limit': NOGOOD_LIMIT, 'symmetry': False},
+}
+
+
+@pytest.fixture(params=sorted(OPTIONS))
+def options(request, monkeypatch):
+    if request.param == 'tree':
+        # below that many courts the tree is not built at all
+        monkeypatch.setattr(planner, 'COURT_INDEX_MIN_COURTS', 1)
+    return OPTIONS[request.param]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_finds_timetable_exactly_when_one_exists(seed, options):
+    groups, courts, solution = solve(seed, **options)
+    expected = exhaustive(groups, courts)
+    assert (solution is not None and solution.complete) == (expected is not None)
+    if solution is not None:
+        check_timetable(groups, courts, solution.timetable)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_rejects_up_front_only_inputs_without_timetable(seed):
+    groups, courts = tiny_input(seed)
+    solver = Solver(groups, courts, REST_TIME, EVALUATE_TIME, STAGE_LIMITS, ACTIVITY_DURATIONS)
+    try:
+        solver.solve()
+    except InfeasibleInputError:
+        assert exhaustive(*tiny_input(seed)) is None
+
+
+@pytest.mark.parametrize('node_limit', [1, 3, 10])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_partial_timetable_keeps_the_rules(seed, node_limit):
+    groups, courts = tiny_input(seed)
+    solver = Solver(groups, courts, REST_TIME, EVALUATE_TIME, STAGE_LIMITS, ACTIVITY_DURATIONS, node_limit=node_limit)
+    try:
+        solution = solver.solve()
+    except InfeasibleInputError:
+        return
+    if solution is None:
+        return
+    assert solution.complete != solver.stats.out_of_budget
+    assert sorted(solution.placed + solution.unplaced) == list(range(len(groups)))
+    check_timetable(*tiny_input(seed), solution.timetable, placed=solution.placed)
+
+
+@pytest.mark.parametrize('objective', planner.OBJECTIVES)
+@pytest.mark.parametrize('seed', SEEDS)
+def test_objective_is_optimal(seed, objective, options):
+    groups, courts, solution = solve(seed, objective=objective, **options)
+    expected = exhaustive(groups, courts, objective=objective)
+    if expected is None:
+        assert solution is None
+        return
+    check_timetable(groups, courts, solution.timetable)
+    entries = [(entry.court_idx, entry.period.start, entry.period.end) for entry in solution.timetable]
+    assert objective_value(objective, entries) == expected
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('objective', [None, *planner.OBJECTIVES])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_grid(seed, objective, compact, options):
+    groups, courts, solution = solve(seed, GRID, objective=objective, compact=compact, **options)
+    expected = exhaustive(groups, courts, GRID, objective)
+    assert (solution is not None and solution.complete) == (expected is not None)
+    if solution is None:
+        return
+    check_timetable(groups, courts, solution.timetable, grid=GRID, compact=compact)
+    if objective is not None:
+        entries = [(entry.court_idx, entry.period.start, entry.period.end) for entry in solution.timetable]
+        value = objective_value(objective, entries)
+        if not compact:
+            assert value == expected
+        elif objective == 'makespan':
+            # compaction only moves stages earlier
+            assert value <= expected
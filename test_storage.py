@@ -0,0 +1,157 @@
+"""
+Storage seen by two uvicorn processes at once, two Storage objects on one directory here:
+rows written by one are read by the other, old rows go by age and count with their files,
+unfinished jobs only when their owner stops answering
+"""
+import os
+import time
+import types
+
+import pytest
+
+import storage
+from storage import JOB_STALE_ERROR, Storage
+
+LIMITS = {
+    'upload_ttl': 100, 'plan_ttl': 100, 'max_uploads': 2, 'max_plans': 2,
+    'job_ttl': 100, 'max_jobs': 2, 'job_stale': 10,
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time of storage, moved on by hand"""
+    now = [time.time()]
+    monkeypatch.setattr(storage, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def pair(tmp_path, clock):
+    return Storage(str(tmp_path), **LIMITS), Storage(str(tmp_path), **LIMITS)
+
+
+def add_upload(store: Storage, upload_id: str) -> str:
+    path = store.upload_path(upload_id, f'../{upload_id}.csv')
+    with open(path, 'w') as file:
+        file.write(upload_id)
+    store.add_upload(upload_id, path, f'{upload_id}.csv', 'digest')
+    return path
+
+
+def test_directories(tmp_path, pair):
+    first, _ = pair
+    assert os.stat(first.input_dir).st_mode & 0o777 == 0o700
+    # only the last part of the file name is kept
+    assert os.path.dirname(first.upload_path('id', '../../etc/passwd')) == first.upload_dir
+
+
+def test_job_rows(pair):
+    first, second = pair
+    first.add_job('j', 'queued')
+    assert second.get_job('j')['status'] == 'queued'
+    assert second.start_job('j')
+    first.set_job_progress('j', {'nodes': 5, 'placedGroups': 1})
+    assert second.get_job('j')['progress'] == {'nodes': 5, 'placedGroups': 1}
+    # cancel asked in one process is seen by the one searching
+    assert not first.job_cancelled('j')
+    assert second.cancel_job('j')
+    assert first.job_cancelled('j')
+    assert first.get_job('j')['status'] == 'running'
+    first.finish_job('j', 'cancelled', {'id': 'p', 'slots': []}, None)
+    assert second.get_job('j')['result'] == {'id': 'p', 'slots': []}
+    assert second.count_jobs() == {'cancelled': 1}
+    assert not second.cancel_job('no-such-job') and second.get_job('no-such-job') is None
+
+
+def test_cancel_queued_job(pair):
+    first, second = pair
+    first.add_job('j', 'queued')
+    assert second.cancel_job('j')
+    assert first.get_job('j')['status'] == 'cancelled'
+    # the pool took it before the cancel, it doesn't start
+    assert not first.start_job('j')
+    assert first.get_job('j')['status'] == 'cancelled'
+
+
+def test_jobs_of_silent_owner_fail(pair, clock):
+    first, second = pair
+    first.add_job('alive', 'queued')
+    first.add_job('silent', 'queued')
+    first.start_job('silent')
+    clock[0] += 8
+    first.touch_jobs(['alive'])
+    clock[0] += 8
+    second.cleanup()
+    assert second.get_job('alive')['status'] == 'queued'
+    silent = second.get_job('silent')
+    assert silent['status'] == 'failed' and silent['error'] == JOB_STALE_ERROR
+
+
+def test_unfinished_jobs_never_expire(pair, clock):
+    first, second = pair
+    first.add_job('running', 'queued')
+    first.start_job('running')
+    first.add_job('done', 'done', result={'id': 'p'})
+    for _ in range(20):
+        clock[0] += 9
+        first.set_job_progress('running', {'nodes': 1})
+        second.cleanup()
+    assert second.get_job('running')['status'] == 'running'
+    assert second.get_job('done') is None
+
+
+def test_finished_jobs_over_the_limit(pair, clock):
+    first, second = pair
+    first.add_job('queued', 'queued')
+    for idx in range(4):
+        clock[0] += 1
+        first.add_job(f'j{idx}', 'failed', error='no timetable')
+    # the oldest finished ones go, unfinished ones don't count
+    assert [job for job in ['queued', 'j0', 'j1', 'j2', 'j3'] if second.get_job(job)] == ['queued', 'j2', 'j3']
+
+
+def test_uploads(pair, clock):
+    first, second = pair
+    paths = []
+    for idx in range(3):
+        clock[0] += 1
+        paths.append(add_upload(first, f'u{idx}'))
+    # the oldest over max_uploads goes with its file
+    assert second.get_upload('u0') is None and not os.path.exists(paths[0])
+    assert second.get_upload('u2')['path'] == paths[2]
+    clock[0] += 100
+    assert second.get_upload('u1') is None and second.get_upload('u2') is not None
+    second.cleanup()
+    assert not os.path.exists(paths[1]) and os.path.exists(paths[2])
+
+
+def test_cleanup_files(pair, clock):
+    first, second = pair
+    orphan = os.path.join(first.upload_dir, 'orphan.csv')
+    open(orphan, 'w').close()
+    os.utime(orphan, (clock[0], clock[0]))
+    inputs = []
+    for idx in range(3):
+        inputs.append(os.path.join(first.input_dir, f'{idx}.json'))
+        open(inputs[-1], 'w').close()
+        os.utime(inputs[-1], (clock[0] + idx, clock[0] + idx))
+    second.cleanup()
+    # young files stay, parsed inputs over max_uploads go, least recently used first
+    assert os.path.exists(orphan)
+    assert [os.path.exists(path) for path in inputs] == [False, True, True]
+    clock[0] += 103
+    second.cleanup()
+    assert not os.path.exists(orphan) and not any(os.path.exists(path) for path in inputs)
+
+
+def test_plans(pair, clock):
+    first, second = pair
+    for idx in range(3):
+        clock[0] += 1
+        first.save_plan({'id': f'p{idx}', 'slots': []}, {'params': {}, 'deltas': [idx]})
+    assert second.get_plan('p0') is None
+    assert second.get_plan('p2') == {'id': 'p2', 'slots': []}
+    assert second.get_plan_source('p2') == {'params': {}, 'deltas': [2]}
+    clock[0] += 100
+    assert second.get_plan('p1') is None and second.get_plan_source('p1') is None